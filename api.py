@@ -1,25 +1,80 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
+from starlette.background import BackgroundTask
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
 import pandas as pd
 import numpy as np
 import joblib
 import os
-from typing import Optional, List
-from contextlib import asynccontextmanager
-import json
-from database import db, PredictionRecord
+from typing import Dict, Literal, Optional, List
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+from datetime import datetime, timedelta
+import threading
+import time
+import warnings
+from database import db, EXPORT_COLUMNS, PredictionRecord, decode_history_cursor, encode_history_cursor
+from history_writer import HistoryWriter
+from feature_transformer import FeatureTransformer, TRANSFORMER_PATH
+from prediction_cube import PredictionCube
+from prediction_cache import PredictionCache, make_key
+from scenario_engine import ScenarioEngine, compute_snapshot, load_snapshot, save_snapshot
+from inference_executor import InferenceExecutor, ExecutorSaturated, InferenceTimeout
+from micro_batcher import MicroBatcher
+from process_memory import workers_memory
+from tree_compiler import CompiledModel, CompiledTreeEnsemble, compile_model
+from request_logger import RequestLogger, RequestLoggingMiddleware, annotate
+from model_registry import ModelRegistry, ModelWatcher, LoadedVersion, compact_paths
+from history_export import EXPORT_FORMATS, ExportFormatError, check_format, iter_export
+from bulk_scoring import (
+    DuplexStreamingResponse, StreamFormatError, detect_format, iter_chunks, iter_lines, iter_rows, ndjson_line
+)
+from profiler import SamplingProfiler, ProfileStore, RequestProfilingMiddleware
+from fast_json import FastJSONResponse, now_iso
+from metrics import registry as metrics_registry, MetricsMiddleware, PREDICT_STAGE_LATENCY, PREDICTIONS, request_start
+
+# Les modèles reçoivent une matrice float32 (sans noms de colonnes)
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gestionnaire de lifespan pour l'initialisation et le nettoyage"""
     # Code d'initialisation (startup)
-    print("🚀 Démarrage de l'API SmartMobility ML...")
-    load_models()
+    global event_loop
+    print(f"🚀 Démarrage de l'API SmartMobility ML (STARTUP_MODE={STARTUP_MODE})...")
+    event_loop = asyncio.get_running_loop()
+    request_logger.start()
+    if HISTORY_WRITE_BEHIND:
+        history_writer.start()
+        print(f"💾 Écriture différée de l'historique (lots de {HISTORY_FLUSH_ROWS} lignes ou {HISTORY_FLUSH_INTERVAL_MS:g} ms)")
+    inference_executor.start(model_paths=model_paths)
+    print(f"⚙️ Exécuteur d'inférence: {inference_executor.kind} ({inference_executor.max_workers} workers)")
+
+    # Les modèles peuvent déjà être chargés par serve.py avant le fork des workers
+    if model_status["status"] == "ready":
+        start_model_watcher(event_loop)
+    elif STARTUP_MODE == "eager":
+        initialize_models()
+    elif STARTUP_MODE == "background":
+        load_models_in_background()
+    # lazy: chargement déclenché par la première requête qui a besoin d'un modèle
+
     print("✅ API prête à recevoir des requêtes!")
     yield
     # Code de nettoyage (shutdown) si nécessaire
     print("🛑 Arrêt de l'API SmartMobility ML...")
+    if model_watcher is not None:
+        model_watcher.stop()
+    if micro_batcher is not None:
+        await micro_batcher.close()
+    inference_executor.shutdown()
+    # Les prédictions encore en file sont écrites avant la fermeture des connexions
+    history_writer.stop()
+    db.connections.close_all()
+    request_logger.stop()
 
 app = FastAPI(
     title="SmartMobility ML API",
@@ -36,31 +91,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware pour logger les requêtes
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    """Middleware pour logger les requêtes entrantes"""
-    if request.method == "POST" and request.url.path == "/predict":
-        print(f"\n📨 Requête reçue: {request.method} {request.url.path}")
-        print(f"🔗 URL complète: {request.url}")
-
-        # Lire le corps de la requête
-        body = await request.body()
-        if body:
-            try:
-                body_json = json.loads(body.decode('utf-8'))
-                print(f"📋 Données reçues: {json.dumps(body_json, indent=2, ensure_ascii=False)}")
-            except json.JSONDecodeError:
-                print(f"📋 Corps brut: {body.decode('utf-8')}")
+# Journalisation des requêtes: lignes JSON écrites par un thread de fond (file bornée, échantillonnage)
+REQUEST_LOG_PATH = os.getenv("REQUEST_LOG_PATH", "-")  # "-" = stdout
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "1.0"))
+REQUEST_LOG_MAX_QUEUE = int(os.getenv("REQUEST_LOG_MAX_QUEUE", "10000"))
+REQUEST_LOG_BODIES = os.getenv("REQUEST_LOG_BODIES", "redacted")  # none | redacted | full
+REQUEST_LOG_REDACT_FIELDS = [f.strip() for f in os.getenv("REQUEST_LOG_REDACT_FIELDS", "").split(",") if f.strip()]
+
+request_logger = RequestLogger(
+    path=REQUEST_LOG_PATH,
+    sample_rate=REQUEST_LOG_SAMPLE_RATE,
+    max_queue=REQUEST_LOG_MAX_QUEUE,
+    log_bodies=REQUEST_LOG_BODIES,
+    redact_fields=REQUEST_LOG_REDACT_FIELDS
+)
+app.add_middleware(RequestLoggingMiddleware, logger=request_logger)
+
+# Latence et erreurs par route pour /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Écriture différée de l'historique: file en mémoire écrite par lots (executemany, un commit par lot)
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "0") == "1"
+HISTORY_QUEUE_SIZE = int(os.getenv("HISTORY_QUEUE_SIZE", "10000"))
+HISTORY_FLUSH_ROWS = int(os.getenv("HISTORY_FLUSH_ROWS", "500"))
+HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "50"))
+
+history_writer = HistoryWriter(
+    db,
+    max_queue=HISTORY_QUEUE_SIZE,
+    batch_size=HISTORY_FLUSH_ROWS,
+    flush_interval=HISTORY_FLUSH_INTERVAL_MS / 1000
+)
 
-        print(f"🌐 Headers: {dict(request.headers)}")
-        print("-" * 50)
+# Profilage CPU par échantillonnage (désactivé par défaut: aucun middleware ni thread)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN") or None
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
 
-    response = await call_next(request)
-    return response
+profile_store = ProfileStore()
+active_profiler = None  # Profil de tout le processus en cours (un seul à la fois)
+if PROFILER_ENABLED:
+    # En-tête X-Profile sur /predict ou /analytics/*: profil de cette seule requête
+    app.add_middleware(RequestProfilingMiddleware, store=profile_store, token=PROFILER_TOKEN)
 
 # Modèle de données pour les prédictions
 class PredictionRequest(BaseModel):
+    # Espaces retirés une fois pour toutes: les mêmes valeurs servent à la clé de cache,
+    # au cube et au modèle ("Train " serait sinon une catégorie inconnue)
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     TransportType: str
     Line: str
     Hour: int
@@ -69,19 +148,280 @@ class PredictionRequest(BaseModel):
     Event: str
     model_type: str = "random_forest"  # Nouveau paramètre pour choisir le modèle
 
+class EnsemblePredictionRequest(PredictionRequest):
+    """Requête évaluée par tous les modèles chargés (model_type est ignoré)"""
+    weights: Optional[Dict[str, float]] = None  # Poids de l'ensemble (ENSEMBLE_WEIGHTS par défaut)
+    save_history: bool = True
+
+class BatchPredictionRequest(BaseModel):
+    requests: List[PredictionRequest]
+    save_history: bool = True
+
+class PredictionResponse(BaseModel):
+    """Réponse de /predict (documentation OpenAPI; le corps est sérialisé par FastJSONResponse)"""
+    delay: float
+    risk: str
+    probability: float
+    model_used: str
+    unit: str = "minutes"
+    prediction_id: Optional[int] = None
+    timestamp: str
+    input: Optional[PredictionRequest] = None  # Absent avec include_input=false
+
+# Taille maximale d'un lot pour /predict/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+
+# Poids par défaut de l'ensemble de /predict/all ("random_forest:0.5,xgboost:0.3,..."; vide = poids égaux)
+ENSEMBLE_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (item.split(":") for item in os.getenv("ENSEMBLE_WEIGHTS", "").split(",") if item.strip())
+}
+
+# Renvoi des données d'entrée dans la réponse de /predict (désactivable par requête avec include_input)
+PREDICT_INCLUDE_INPUT = os.getenv("PREDICT_INCLUDE_INPUT", "1") == "1"
+
+# Nombre de lignes scorées ensemble par /predict/stream
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+
+# Précalcul de toutes les prédictions au chargement des modèles (cube)
+USE_PREDICTION_CUBE = os.getenv("USE_PREDICTION_CUBE", "0") == "1"
+
+# Cache des prédictions (0 entrée = désactivé)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "300"))
+
+# Exécuteur pour l'inférence et les appels bloquants (thread ou process)
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "4"))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", "64"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "10"))
+
+# Regroupement des requêtes /predict concurrentes en un seul predict par modèle
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "0") == "1"
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "32"))
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2"))
+
+# Chargement des tableaux des modèles en mémoire partagée en lecture seule (mmap)
+MODEL_MMAP = os.getenv("MODEL_MMAP", "0") == "1"
+
+# Modèles à arbres servis par l'évaluateur compilé (liste séparée par des virgules, ou "all")
+COMPILED_MODELS = {name.strip() for name in os.getenv("COMPILED_MODELS", "").split(",") if name.strip()}
+COMPILED_MAX_ROWS = int(os.getenv("COMPILED_MAX_ROWS", "64"))
+
+# Modèles à arbres servis depuis leur export compact (compact/<modèle>.npz, export_compact_models.py)
+COMPACT_MODELS = os.getenv("COMPACT_MODELS", "0") == "1"
+
+# Intervalle de surveillance du manifeste des versions de modèles (0 = pas de rechargement à chaud)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+
+# Chargement des modèles au démarrage: eager (bloquant), background (tâche de fond) ou lazy (première requête)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+if STARTUP_MODE not in ("eager", "background", "lazy"):
+    raise ValueError(f"STARTUP_MODE invalide: {STARTUP_MODE} (eager, background ou lazy)")
+# Attente maximale d'une requête pendant le chargement des modèles avant de répondre 503
+MODEL_LOAD_WAIT = float(os.getenv("MODEL_LOAD_WAIT", "30"))
+
+MODEL_PATHS = {
+    'random_forest': './models/random_forest.pkl',
+    'linear_regression': './models/linear_regression.pkl',
+    'xgboost': './models/xgboost.pkl'
+}
+# Instantané des analyses des modèles models/*.pkl (hors registre)
+LEGACY_ANALYTICS_PATH = './models/analytics.json'
+
 # Variables globales pour les modèles
 models = {}  # Dictionnaire pour stocker tous les modèles
 feature_columns = None
+transformer = None  # FeatureTransformer partagé avec train_model.py
+prediction_cube = None  # PredictionCube si USE_PREDICTION_CUBE est activé
+model_versions = {}  # Version de chaque modèle chargé (clé du cache)
+live_version = None  # Version du registre en service (None: fichiers models/*.pkl)
+model_paths = {}  # Fichiers des modèles en service (chargés par les workers en mode process)
+analytics_snapshot = None  # Résultats des /analytics/* pour la version en service (scenario_engine.compute_snapshot)
+model_registry = ModelRegistry()
+model_watcher = None  # ModelWatcher démarré par le lifespan
+event_loop = None  # Boucle d'événements du serveur (pour les bascules de version)
+
+# État du chargement des modèles (readiness) et durée de chaque étape
+model_status = {"status": "not_loaded", "error": None, "started_at": None, "ready_at": None}
+startup_timings = {}
+_loader_lock = threading.Lock()
+_loader_thread = None
+
+@contextmanager
+def startup_stage(name: str):
+    """Mesure une étape du chargement des modèles (en ms)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+def initialize_models():
+    """Charge (ou entraîne) les modèles et met à jour l'état de readiness"""
+    model_status.update(status="loading", error=None, started_at=pd.Timestamp.now().isoformat())
+    startup_timings.clear()
+    try:
+        with startup_stage("total"):
+            load_models()
+    except Exception as e:
+        model_status.update(status="failed", error=str(e))
+        print(f"❌ Chargement des modèles impossible: {e}")
+        return
+
+    if not models:
+        model_status.update(status="failed", error="Aucun modèle chargé")
+        return
+
+    model_status.update(status="ready", ready_at=pd.Timestamp.now().isoformat())
+    stages = ", ".join(f"{name} {ms:.0f} ms" for name, ms in startup_timings.items() if name != "total")
+    print(f"⏱️ Modèles prêts en {startup_timings['total']:.0f} ms ({stages})")
+
+    inference_executor.reload_models(model_paths)
+    if event_loop is not None:
+        start_model_watcher(event_loop)
+
+def load_models_in_background():
+    """Démarre le chargement des modèles dans un thread (une seule fois)"""
+    global _loader_thread
+    with _loader_lock:
+        if _loader_thread is not None and (_loader_thread.is_alive() or model_status["status"] == "ready"):
+            return
+        _loader_thread = threading.Thread(target=initialize_models, name="model-loader", daemon=True)
+        model_status["status"] = "loading"
+        _loader_thread.start()
+
+async def ensure_models_loaded():
+    """Garantit que les modèles sont chargés avant de servir une requête.
+
+    Le chargement (lazy ou background) se fait dans un thread: la requête attend au plus
+    MODEL_LOAD_WAIT secondes, et répond 503 tout de suite pendant un entraînement de secours.
+    """
+    if model_status["status"] == "ready":
+        return
+
+    load_models_in_background()
+    deadline = time.monotonic() + MODEL_LOAD_WAIT
+    while model_status["status"] != "ready":
+        status = model_status["status"]
+        if status == "failed":
+            raise HTTPException(status_code=503, detail=f"Modèles indisponibles: {model_status['error']}")
+        if status == "training" or time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=503,
+                detail=f"Modèles en cours de chargement ({status}), réessayez plus tard",
+                headers={"Retry-After": "5"}
+            )
+        await asyncio.sleep(0.02)
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+inference_executor = InferenceExecutor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, INFERENCE_MAX_QUEUE, INFERENCE_TIMEOUT)
+
+def use_compiled_backend(model_name: str) -> bool:
+    return model_name in COMPILED_MODELS or "all" in COMPILED_MODELS
+
+def set_model(model_name: str, model, version: str):
+    """Enregistre un modèle chargé et invalide les prédictions en cache de l'ancienne version"""
+    if use_compiled_backend(model_name):
+        model = compile_backend(model_name, model)
+    models[model_name] = model
+    model_versions[model_name] = version
+    prediction_cache.invalidate_model(model_name)
+
+def compile_backend(model_name: str, model):
+    """Remplace un modèle à arbres par son évaluateur compilé (le modèle d'origine sinon)"""
+    try:
+        compiled = compile_model(model)
+    except Exception as e:
+        print(f"⚠️ Compilation de {model_name} impossible: {e}")
+        return model
+    if compiled is None:
+        return model
+    print(f"🌲 {model_name} compilé: {compiled.n_trees} arbres, {compiled.n_nodes} nœuds, {compiled.nbytes / 1e6:.1f} Mo")
+    return CompiledModel(compiled, model, max_rows=COMPILED_MAX_ROWS)
+
+def prepare_version(loaded: LoadedVersion):
+    """Prépare une version hors du chemin des requêtes: compilation, préchauffage, cube"""
+    for name, model in loaded.models.items():
+        if use_compiled_backend(name):
+            loaded.models[name] = compile_backend(name, model)
+
+    # Préchauffage: un premier predict par modèle (imports paresseux, caches internes)
+    sample = loaded.transformer.transform_one({
+        'TransportType': 'Bus', 'Line': 'Line1', 'Hour': 8, 'Day': 'Lundi', 'Weather': 'Pluie', 'Event': 'Non'
+    })
+    for model in loaded.models.values():
+        model.predict(sample)
+
+    loaded.state['prediction_cube'] = make_prediction_cube(loaded.models, loaded.transformer)
+    loaded.state['analytics'] = load_or_build_analytics(
+        loaded.models, loaded.transformer, {name: loaded.version for name in loaded.models},
+        model_registry.analytics_path(loaded.version)
+    )
+
+def activate_version(loaded: LoadedVersion):
+    """Met en service une version préparée.
+
+    Les globales sont remplacées (et non modifiées) sans point d'attente: les requêtes
+    en cours gardent les objets qu'elles ont déjà lus, les suivantes voient la nouvelle version.
+    """
+    global models, model_versions, feature_columns, transformer, prediction_cube, live_version, model_paths
+    global analytics_snapshot
+
+    previous = live_version
+    models = dict(loaded.models)
+    model_versions = {name: loaded.version for name in loaded.models}
+    transformer = loaded.transformer
+    feature_columns = list(loaded.feature_columns)
+    prediction_cube = loaded.state.get('prediction_cube')
+    analytics_snapshot = loaded.state.get('analytics')
+    model_paths = dict(loaded.model_paths)
+    live_version = loaded.version
+
+    # Les clés du cache contiennent la version: les anciennes entrées ne servent plus
+    prediction_cache.clear()
+    inference_executor.reload_models(model_paths)
+    print(f"🔄 Version de modèles en service: {loaded.version} (précédente: {previous or 'fichiers models/*.pkl'})")
+
+def start_model_watcher(loop: asyncio.AbstractEventLoop):
+    """Surveille le manifeste et bascule sur chaque nouvelle version promue"""
+    global model_watcher
+
+    if model_watcher is not None:
+        return
+
+    def activate_on_loop(loaded: LoadedVersion):
+        # La bascule s'exécute sur la boucle d'événements, entre deux étapes des requêtes
+        async def swap():
+            activate_version(loaded)
+        asyncio.run_coroutine_threadsafe(swap(), loop).result()
+
+    model_watcher = ModelWatcher(
+        model_registry, live_version, prepare_version, activate_on_loop,
+        interval=MODEL_WATCH_INTERVAL, mmap_mode='r' if MODEL_MMAP else None, compact=COMPACT_MODELS
+    )
+    model_watcher.start()
 
 def load_models():
     """Charge tous les modèles ML sauvegardés"""
-    global models, feature_columns
+    global models, feature_columns, transformer, model_paths, analytics_snapshot
+
+    # Version promue dans le registre (models/manifest.json) si elle existe
+    version = model_registry.live_version()
+    if version is not None:
+        try:
+            with startup_stage("registry_load"):
+                loaded = model_registry.load(version, mmap_mode='r' if MODEL_MMAP else None, compact=COMPACT_MODELS)
+            with startup_stage("prepare"):
+                prepare_version(loaded)
+            activate_version(loaded)
+            print(f"✅ Modèles disponibles: {list(models.keys())}")
+            return
+        except Exception as e:
+            print(f"⚠️ Erreur lors du chargement de la version {version}: {e}, utilisation de models/*.pkl")
 
-    models_to_load = {
-        'random_forest': './models/random_forest.pkl',
-        'linear_regression': './models/linear_regression.pkl',
-        'xgboost': './models/xgboost.pkl'
-    }
+    models_to_load = dict(MODEL_PATHS)
+    if COMPACT_MODELS:
+        models_to_load.update(compact_paths(model_registry.root))
 
     # Vérifier si au moins un modèle existe
     models_exist = any(os.path.exists(path) for path in models_to_load.values())
@@ -96,7 +436,14 @@ def load_models():
         for model_name, model_path in models_to_load.items():
             if os.path.exists(model_path):
                 try:
-                    models[model_name] = joblib.load(model_path)
+                    version = f"{os.path.getmtime(model_path):.0f}"
+                    with startup_stage(f"load:{model_name}"):
+                        if model_path.endswith(".npz"):
+                            model = CompiledTreeEnsemble.load(model_path, mmap_mode='r')
+                        else:
+                            model = joblib.load(model_path, mmap_mode='r' if MODEL_MMAP else None)
+                        set_model(model_name, model, version)
+                    model_paths[model_name] = model_path
                     print(f"✅ Modèle {model_name} chargé avec succès")
                 except Exception as e:
                     print(f"⚠️ Erreur lors du chargement de {model_name}: {e}")
@@ -122,15 +469,41 @@ def load_models():
             feature_columns = ['hour', 'TransportType_encoded', 'Line_encoded', 'Status_encoded', 'IncidentCause_encoded']
             print(f"📊 Features par défaut utilisées")
 
+        # Charger le transformer de features sauvegardé par train_model.py
+        with startup_stage("transformer"):
+            load_transformer()
+
+        with startup_stage("prediction_cube"):
+            build_prediction_cube()
+
+        with startup_stage("analytics"):
+            analytics_snapshot = load_or_build_analytics(models, transformer, model_versions, LEGACY_ANALYTICS_PATH)
+
     except Exception as e:
         print(f"❌ Erreur lors du chargement des modèles: {e}")
         train_basic_models()
 
+def load_transformer():
+    """Charge le transformer sauvegardé par train_model.py (ou celui par défaut)"""
+    global transformer
+
+    if os.path.exists(TRANSFORMER_PATH):
+        transformer = FeatureTransformer.load(TRANSFORMER_PATH)
+        if transformer.feature_columns != list(feature_columns):
+            print("⚠️ Colonnes du transformer différentes de feature_info.pkl, utilisation de feature_info.pkl")
+            transformer = FeatureTransformer(feature_columns, transformer.vocabularies)
+        print("🔤 Transformer de features chargé")
+    else:
+        transformer = FeatureTransformer(feature_columns)
+        print("🔤 Transformer de features par défaut utilisé")
+
 def train_basic_models():
     """Entraîne les 3 modèles de base si aucun modèle sauvegardé n'existe"""
-    global models, feature_columns
+    global models, feature_columns, transformer
 
     print("🔧 Entraînement des modèles de base...")
+    model_status["status"] = "training"
+    training_start = time.perf_counter()
 
     # Créer des données d'exemple pour l'entraînement
     np.random.seed(42)
@@ -166,53 +539,109 @@ def train_basic_models():
     import xgboost as xgb
 
     # Entraîner les 3 modèles
-    models['random_forest'] = RandomForestRegressor(n_estimators=100, random_state=42)
-    models['random_forest'].fit(X, y)
+    version = f"basic-{time.time():.0f}"
+
+    rf_model = RandomForestRegressor(n_estimators=100, random_state=42)
+    rf_model.fit(X, y)
+    set_model('random_forest', rf_model, version)
     
-    models['linear_regression'] = LinearRegression()
-    models['linear_regression'].fit(X, y)
+    lr_model = LinearRegression()
+    lr_model.fit(X, y)
+    set_model('linear_regression', lr_model, version)
     
-    models['xgboost'] = xgb.XGBRegressor(objective='reg:squarederror', random_state=42, verbosity=0)
-    models['xgboost'].fit(X, y)
+    xgb_model = xgb.XGBRegressor(objective='reg:squarederror', random_state=42, verbosity=0)
+    xgb_model.fit(X, y)
+    set_model('xgboost', xgb_model, version)
 
     # Sauvegarder les modèles
     os.makedirs("./models", exist_ok=True)
-    joblib.dump(models['random_forest'], "./models/random_forest.pkl")
-    joblib.dump(models['linear_regression'], "./models/linear_regression.pkl")
-    joblib.dump(models['xgboost'], "./models/xgboost.pkl")
+    joblib.dump(rf_model, "./models/random_forest.pkl")
+    joblib.dump(lr_model, "./models/linear_regression.pkl")
+    joblib.dump(xgb_model, "./models/xgboost.pkl")
+    model_paths.update(MODEL_PATHS)
 
     feature_columns = list(X.columns)
+    transformer = FeatureTransformer(feature_columns)
+    transformer.save(TRANSFORMER_PATH)
     print("✅ Modèles de base entraînés et sauvegardés")
+    startup_timings["train_basic_models"] = round((time.perf_counter() - training_start) * 1000, 1)
 
-def preprocess_input(data: PredictionRequest) -> pd.DataFrame:
-    """Prétraite les données d'entrée pour le modèle"""
-
-    # Créer un dictionnaire avec toutes les features à 0
-    features = {col: 0 for col in feature_columns}
-
-    # Remplir avec les données d'entrée
-    features['hour'] = data.Hour
+    with startup_stage("prediction_cube"):
+        build_prediction_cube()
 
-    # Transport Type encoding
-    transport_mapping = {'Bus': 0, 'Metro': 1, 'Train': 2}
-    features['TransportType_encoded'] = transport_mapping.get(data.TransportType, 0)
+def build_prediction_cube():
+    """Évalue tous les modèles sur toute la grille des entrées (si activé)"""
+    global prediction_cube
 
-    # Line encoding
-    line_mapping = {'Line1': 0, 'Line2': 1, 'Line3': 2, 'Line4': 3, 'Line5': 4}
-    features['Line_encoded'] = line_mapping.get(data.Line, 0)
+    prediction_cube = make_prediction_cube(models, transformer)
 
-    # Status encoding (on suppose Delayed par défaut pour les prédictions)
-    features['Status_encoded'] = 1  # Delayed
+def make_prediction_cube(models_to_evaluate: dict, feature_transformer: FeatureTransformer):
+    """Cube de prédictions des modèles donnés (None si USE_PREDICTION_CUBE est désactivé)"""
+    if not USE_PREDICTION_CUBE:
+        return None
 
-    # Incident Cause encoding (basé sur Weather et Event)
-    if data.Weather == 'Pluie':
-        features['IncidentCause_encoded'] = 2  # Weather
-    elif data.Event == 'Oui':
-        features['IncidentCause_encoded'] = 3  # Planned
-    else:
-        features['IncidentCause_encoded'] = 1  # Traffic (défaut)
+    start = time.perf_counter()
+    cube = PredictionCube.build(models_to_evaluate, feature_transformer)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"🧊 Cube de prédictions: {cube.size} combinaisons x {len(models_to_evaluate)} modèles en {elapsed:.0f} ms")
+    return cube
 
-    return pd.DataFrame([features])
+def preprocess_input(data: PredictionRequest) -> np.ndarray:
+    """Prétraite les données d'entrée pour le modèle"""
+    return transformer.transform_one(data)
+
+def preprocess_batch(requests: List[PredictionRequest]) -> np.ndarray:
+    """Prétraite un lot de requêtes en une seule matrice (une ligne par requête)"""
+    return transformer.transform(requests)
+
+async def save_history(records: List[PredictionRecord]) -> List[int]:
+    """Sauvegarde des prédictions: file d'écriture différée si activée (identifiants attribués
+    immédiatement), sinon transaction immédiate. File pleine ou identifiants réservés
+    insuffisants (gros lot): écriture synchrone sur l'exécuteur, jamais sur la boucle."""
+    if history_writer.running:
+        prediction_ids = history_writer.submit(records)
+        if prediction_ids is not None:
+            return prediction_ids
+    if len(records) == 1:
+        return [await run_blocking(db.save_prediction, records[0])]
+    return await run_blocking(db.save_predictions, records)
+
+async def run_blocking(fn, *args, **kwargs):
+    """Exécute un appel bloquant (sqlite3, analyses) sur l'exécuteur, hors de la boucle d'événements"""
+    try:
+        return await inference_executor.run(fn, *args, **kwargs)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except InferenceTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+async def run_predict(model_type: str, input_data: np.ndarray) -> np.ndarray:
+    """Exécute model.predict sur l'exécuteur d'inférence"""
+    try:
+        return await inference_executor.predict(model_type, input_data, models[model_type])
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except InferenceTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+micro_batcher = MicroBatcher(run_predict, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_MAX_WAIT_MS) if MICRO_BATCHING else None
+
+# Métriques lues au moment du scrape (aucun coût sur le chemin des requêtes)
+if micro_batcher is not None:
+    metrics_registry.histogram("micro_batch_size", "Rows per micro-batch").attach(micro_batcher.batch_sizes)
+    metrics_registry.histogram("micro_batch_wait_milliseconds", "Queueing time of a row before its micro-batch runs").attach(micro_batcher.wait_ms)
+metrics_registry.gauge("inference_pending_tasks", "Tasks running or queued on the inference executor",
+                       lambda: inference_executor.stats()["pending"])
+metrics_registry.gauge("prediction_cache_entries", "Entries in the /predict result cache", lambda: prediction_cache.stats()["size"])
+metrics_registry.gauge("request_log_dropped", "Request log records dropped because the queue was full",
+                       lambda: request_logger.dropped)
+metrics_registry.gauge("model_ready", "1 when the models are loaded", lambda: int(model_status["status"] == "ready"))
+
+def observe_stage(stage: str, model_type: str, start: float) -> float:
+    """Enregistre la durée d'une étape de /predict et renvoie l'instant courant"""
+    now = time.perf_counter()
+    PREDICT_STAGE_LATENCY.labels(stage, model_type).observe(now - start)
+    return now
 
 def calculate_risk_level(delay: float) -> str:
     """Calcule le niveau de risque basé sur le délai prédit"""
@@ -233,6 +662,16 @@ def calculate_probability(delay: float) -> float:
     else:
         return round(75 + np.random.uniform(0, 15), 1)
 
+def calculate_risk_levels(delays: np.ndarray) -> np.ndarray:
+    """Version vectorisée de calculate_risk_level"""
+    return np.where(delays < 5, "Faible", np.where(delays < 15, "Moyen", "Élevé"))
+
+def calculate_probabilities(delays: np.ndarray) -> np.ndarray:
+    """Version vectorisée de calculate_probability"""
+    base = np.where(delays < 5, 15.0, np.where(delays < 15, 45.0, 75.0))
+    spread = np.where(delays < 5, 10.0, np.where(delays < 15, 20.0, 15.0))
+    return np.round(base + np.random.uniform(0, 1, len(delays)) * spread, 1)
+
 @app.get("/")
 async def root():
     """Endpoint racine"""
@@ -244,6 +683,12 @@ async def root():
             "GET /",
             "GET /models",
             "POST /predict",
+            "POST /predict/batch",
+            "GET /cube/{model_type}",
+            "GET /cache/stats",
+            "GET /executor/stats",
+            "GET /batcher/stats",
+            "GET /system/memory",
             "GET /health",
             "GET /analytics/temporal",
             "GET /analytics/weather",
@@ -258,10 +703,27 @@ async def health_check():
     """Vérification de santé de l'API"""
     return {
         "status": "healthy",
-        "models_loaded": len(models) > 0,
+        "models_loaded": model_status["status"] == "ready",
+        "model_status": model_status["status"],
         "available_models": list(models.keys()),
+        "model_version": live_version,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 quand les modèles sont chargés, 503 sinon (/health reste la sonde de liveness)"""
+    # En mode lazy le serveur accepte le trafic: la première requête déclenche le chargement
+    ready = model_status["status"] == "ready" or (STARTUP_MODE == "lazy" and model_status["status"] == "not_loaded")
+    content = {
+        "ready": ready,
+        "startup_mode": STARTUP_MODE,
+        **model_status,
+        "model_version": live_version,
+        "startup_timings_ms": startup_timings,
         "timestamp": pd.Timestamp.now().isoformat()
     }
+    return JSONResponse(status_code=200 if ready else 503, content=content)
 
 @app.get("/models")
 async def get_available_models():
@@ -288,335 +750,188 @@ async def get_available_models():
             }
         ],
         "total_available": len(models),
+        "live_version": live_version,
+        "model_versions": model_versions,
+        "backends": {
+            name: "compact" if isinstance(model, CompiledTreeEnsemble)
+            else "compiled" if isinstance(model, CompiledModel) else "native"
+            for name, model in models.items()
+        },
+        "analytics_snapshot": {
+            key: analytics_snapshot.get(key) for key in ("model", "model_version", "generated_at", "compute_ms")
+        } if analytics_snapshot is not None else None,
         "timestamp": pd.Timestamp.now().isoformat()
     }
 
-@app.get("/analytics/temporal")
-async def get_temporal_analytics():
-    """Analyse temporelle des retards par heure"""
-    if not models:
-        raise HTTPException(status_code=500, detail="Modèles non chargés")
+@app.get("/models/versions")
+async def get_model_versions():
+    """Versions publiées dans le registre, version en service et état du rechargement à chaud"""
+    manifest = await run_blocking(model_registry.read_manifest)
+    return {
+        "live_version": live_version,
+        "promoted_version": manifest.get("live"),
+        "versions": manifest.get("versions", {}),
+        "watcher": model_watcher.stats() if model_watcher is not None else None,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
 
-    try:
-        hours = [6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20]
-        temporal_data = []
-
-        # Utiliser le meilleur modèle (Random Forest par défaut)
-        model_to_use = models.get('random_forest', list(models.values())[0])
-
-        # Générer des prédictions pour différentes heures avec conditions typiques
-        for hour in hours:
-            # Conditions représentatives pour chaque heure
-            transport_types = ["Metro", "Bus", "Train"]
-            lines = ["Line1", "Line2", "Line3", "Line4", "Line5"]
-            weathers = ["Soleil", "Pluie", "TempsNormal"]
-            events = ["Oui", "Non"]
-            days = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"]
-
-            # Faire plusieurs prédictions pour avoir une moyenne représentative
-            delays = []
-            volumes = []
-
-            for _ in range(10):  # 10 échantillons par heure
-                transport = np.random.choice(transport_types)
-                line = np.random.choice(lines)
-                weather = np.random.choice(weathers, p=[0.6, 0.3, 0.1])  # Soleil plus fréquent
-                event = np.random.choice(events, p=[0.85, 0.15])  # Événements rares
-                day = np.random.choice(days)
-
-                # Volume de trafic simulé basé sur l'heure
-                if 7 <= hour <= 9 or 17 <= hour <= 19:
-                    volume = np.random.randint(400, 800)  # Heures de pointe
-                elif 6 <= hour <= 6 or 20 <= hour <= 20:
-                    volume = np.random.randint(100, 300)  # Heures creuses
-                else:
-                    volume = np.random.randint(200, 500)  # Heures normales
-
-                volumes.append(volume)
-
-                # Prédiction ML
-                request_data = PredictionRequest(
-                    TransportType=transport,
-                    Line=line,
-                    Hour=hour,
-                    Day=day,
-                    Weather=weather,
-                    Event=event
-                )
+# Résultats d'analyse calculés avec une graine explicite (reproductibles): LRU sans
+# expiration, la clé contient la version du modèle
+MAX_ANALYTICS_RESULTS = 256
+analytics_results = PredictionCache(max_entries=MAX_ANALYTICS_RESULTS, ttl_seconds=float("inf"))
+
+def analytics_model_type(available: dict) -> str:
+    """Modèle utilisé par les analyses: le meilleur modèle (Random Forest par défaut)"""
+    return 'random_forest' if 'random_forest' in available else next(iter(available))
 
-                input_data = preprocess_input(request_data)
-                prediction = model_to_use.predict(input_data)[0]
-                delays.append(float(prediction))
+def analytics_path() -> str:
+    """Fichier de l'instantané des analyses de la version en service"""
+    return model_registry.analytics_path(live_version) if live_version is not None else LEGACY_ANALYTICS_PATH
 
-            avg_delay = round(np.mean(delays), 1)
-            avg_volume = int(np.mean(volumes))
-            punctuality = max(0, 100 - (avg_delay * 2))  # Estimation de la ponctualité
+def build_analytics(models_to_use: dict, feature_transformer: FeatureTransformer, versions: dict, path: str) -> dict:
+    """Calcule toutes les analyses d'une version et les sauvegarde à côté des modèles"""
+    model_type = analytics_model_type(models_to_use)
+    snapshot = compute_snapshot(models_to_use[model_type].predict, feature_transformer, model_type, versions.get(model_type))
+    try:
+        save_snapshot(path, snapshot)
+    except OSError as e:
+        print(f"⚠️ Instantané des analyses non sauvegardé ({path}): {e}")
+    print(f"📊 Instantané des analyses calculé pour {model_type} ({versions.get(model_type)}) en {snapshot['compute_ms']} ms")
+    return snapshot
+
+def load_or_build_analytics(models_to_use: dict, feature_transformer: FeatureTransformer, versions: dict, path: str):
+    """Instantané sauvegardé s'il correspond à la version des modèles, recalculé sinon (None en cas d'erreur)"""
+    model_type = analytics_model_type(models_to_use)
+    snapshot = load_snapshot(path)
+    if snapshot is not None and snapshot.get("model") == model_type and snapshot.get("model_version") == versions.get(model_type):
+        print(f"📊 Instantané des analyses chargé: {path}")
+        return snapshot
+    try:
+        return build_analytics(models_to_use, feature_transformer, versions, path)
+    except Exception as e:
+        print(f"⚠️ Instantané des analyses non calculé: {e}")
+        return None
+
+def run_analytics(analysis: str, seed: Optional[int] = None, refresh: bool = False) -> dict:
+    """Exécute une analyse du moteur de scénarios avec le meilleur modèle disponible
+
+    Sans graine, le résultat vient de l'instantané de la version en service: il n'est
+    recalculé que si la version a changé ou si refresh est demandé.
+    """
+    global analytics_snapshot
+
+    model_type = analytics_model_type(models)
+
+    if seed is None:
+        snapshot = analytics_snapshot
+        if (refresh or snapshot is None or snapshot.get("model") != model_type
+                or snapshot.get("model_version") != model_versions.get(model_type)):
+            snapshot = build_analytics(models, transformer, model_versions, analytics_path())
+            analytics_snapshot = snapshot
+        return snapshot["analyses"][analysis]
+
+    # Appelé depuis les threads de l'exécuteur: LRU protégé par un verrou
+    key = (model_type, model_versions.get(model_type), analysis, seed)
+    found, result = analytics_results.get(key)
+    if found:
+        return result
+
+    engine = ScenarioEngine(models[model_type].predict, transformer, seed=seed)
+    result = getattr(engine, analysis)()
+    analytics_results.set(key, result)
+    return result
 
-            temporal_data.append({
-                "hour": f"{hour}h",
-                "delay": avg_delay,
-                "volume": avg_volume,
-                "punctuality": round(punctuality, 1)
-            })
+@app.get("/analytics/temporal")
+async def get_temporal_analytics(seed: Optional[int] = None, refresh: bool = False):
+    """Analyse temporelle des retards par heure"""
+    await ensure_models_loaded()
 
-        print(f"📊 Analyse temporelle générée: {len(temporal_data)} points de données")
-        return {"temporal_data": temporal_data}
+    try:
+        result = await run_blocking(run_analytics, "temporal", seed, refresh)
+        print(f"📊 Analyse temporelle générée: {len(result['temporal_data'])} points de données")
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de l'analyse temporelle: {str(e)}"
         print(f"❌ {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
 @app.get("/analytics/weather")
-async def get_weather_analytics():
+async def get_weather_analytics(seed: Optional[int] = None, refresh: bool = False):
     """Impact des conditions météo sur les retards"""
-    if not models:
-        raise HTTPException(status_code=500, detail="Modèles non chargés")
+    await ensure_models_loaded()
 
     try:
-        # Utiliser le meilleur modèle
-        model_to_use = models.get('random_forest', list(models.values())[0])
-
-        weather_conditions = [
-            {"name": "Soleil", "emoji": "☀️", "frequency": 65},
-            {"name": "Pluie", "emoji": "🌧️", "frequency": 25},
-            {"name": "Neige", "emoji": "❄️", "frequency": 5},
-            {"name": "Tempête", "emoji": "⛈️", "frequency": 5}
-        ]
-
-        weather_data = []
-
-        for condition in weather_conditions:
-            delays = []
-
-            # Générer des prédictions pour cette condition météo
-            for _ in range(20):  # 20 échantillons par condition
-                transport = np.random.choice(["Metro", "Bus", "Train"])
-                line = np.random.choice(["Line1", "Line2", "Line3", "Line4", "Line5"])
-                hour = np.random.randint(6, 22)
-                day = np.random.choice(["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"])
-                event = np.random.choice(["Oui", "Non"], p=[0.9, 0.1])  # Peu d'événements
-
-                request_data = PredictionRequest(
-                    TransportType=transport,
-                    Line=line,
-                    Hour=hour,
-                    Day=day,
-                    Weather=condition["name"],
-                    Event=event
-                )
-
-                input_data = preprocess_input(request_data)
-                prediction = model_to_use.predict(input_data)[0]
-                delays.append(float(prediction))
-
-            avg_delay = round(np.mean(delays), 1)
-
-            weather_data.append({
-                "condition": f"{condition['emoji']} {condition['name']}",
-                "delay": avg_delay,
-                "frequency": condition["frequency"],
-                "color": "#10B981" if condition["name"] == "Soleil" else
-                        "#3B82F6" if condition["name"] == "Pluie" else
-                        "#6B7280" if condition["name"] == "Neige" else "#EF4444"
-            })
-
-        print(f"🌤️ Analyse météo générée: {len(weather_data)} conditions")
-        return {"weather_data": weather_data}
+        result = await run_blocking(run_analytics, "weather", seed, refresh)
+        print(f"🌤️ Analyse météo générée: {len(result['weather_data'])} conditions")
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de l'analyse météo: {str(e)}"
         print(f"❌ {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
 @app.get("/analytics/events")
-async def get_events_analytics():
+async def get_events_analytics(seed: Optional[int] = None, refresh: bool = False):
     """Impact des événements sur les retards"""
-    if not models:
-        raise HTTPException(status_code=500, detail="Modèles non chargés")
-
-    # Utiliser le meilleur modèle
-    model_to_use = models.get('random_forest', list(models.values())[0])
+    await ensure_models_loaded()
 
     try:
-        event_types = [
-            {"name": "Jour normal", "emoji": "🚫", "frequency": 85},
-            {"name": "Événement majeur", "emoji": "🚨", "frequency": 15}
-        ]
-
-        event_data = []
-
-        for event_type in event_types:
-            delays = []
-
-            # Générer des prédictions pour ce type d'événement
-            for _ in range(25):  # 25 échantillons par type
-                transport = np.random.choice(["Metro", "Bus", "Train"])
-                line = np.random.choice(["Line1", "Line2", "Line3", "Line4", "Line5"])
-                hour = np.random.randint(6, 22)
-                day = np.random.choice(["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"])
-                weather = np.random.choice(["Soleil", "Pluie", "TempsNormal"], p=[0.7, 0.2, 0.1])
-                event = "Oui" if event_type["name"] == "Événement majeur" else "Non"
-
-                request_data = PredictionRequest(
-                    TransportType=transport,
-                    Line=line,
-                    Hour=hour,
-                    Day=day,
-                    Weather=weather,
-                    Event=event
-                )
-
-                input_data = preprocess_input(request_data)
-                prediction = model_to_use.predict(input_data)[0]
-                delays.append(float(prediction))
-
-            avg_delay = round(np.mean(delays), 1)
-
-            event_data.append({
-                "type": f"{event_type['emoji']} {event_type['name']}",
-                "delay": avg_delay,
-                "frequency": event_type["frequency"],
-                "color": "#10B981" if event_type["name"] == "Jour normal" else "#F59E0B"
-            })
-
-        print(f"🎉 Analyse événements générée: {len(event_data)} types")
-        return {"event_data": event_data}
+        result = await run_blocking(run_analytics, "events", seed, refresh)
+        print(f"🎉 Analyse événements générée: {len(result['event_data'])} types")
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de l'analyse événements: {str(e)}"
         print(f"❌ {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
 @app.get("/analytics/transport")
-async def get_transport_analytics():
+async def get_transport_analytics(seed: Optional[int] = None, refresh: bool = False):
     """Répartition des types de transport"""
-    if not models:
-        raise HTTPException(status_code=500, detail="Modèles non chargés")
-
-    # Utiliser le meilleur modèle
-    model_to_use = models.get('random_forest', list(models.values())[0])
+    await ensure_models_loaded()
 
     try:
-        transport_types = [
-            {"name": "Bus", "color": "#3B82F6"},
-            {"name": "Metro", "color": "#8B5CF6"},
-            {"name": "Train", "color": "#10B981"}
-        ]
-
-        transport_data = []
-
-        for transport_type in transport_types:
-            delays = []
-
-            # Générer des prédictions pour ce type de transport
-            for _ in range(30):  # 30 échantillons par type
-                line = np.random.choice(["Line1", "Line2", "Line3", "Line4", "Line5"])
-                hour = np.random.randint(6, 22)
-                day = np.random.choice(["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"])
-                weather = np.random.choice(["Soleil", "Pluie", "TempsNormal"], p=[0.7, 0.2, 0.1])
-                event = np.random.choice(["Oui", "Non"], p=[0.9, 0.1])
-
-                request_data = PredictionRequest(
-                    TransportType=transport_type["name"],
-                    Line=line,
-                    Hour=hour,
-                    Day=day,
-                    Weather=weather,
-                    Event=event
-                )
-
-                input_data = preprocess_input(request_data)
-                prediction = model_to_use.predict(input_data)[0]
-                delays.append(float(prediction))
-
-            avg_delay = round(np.mean(delays), 1)
-
-            # Valeurs représentatives pour la visualisation
-            if transport_type["name"] == "Bus":
-                value = 45
-            elif transport_type["name"] == "Metro":
-                value = 35
-            else:  # Train
-                value = 20
-
-            transport_data.append({
-                "name": transport_type["name"],
-                "value": value,
-                "avg_delay": avg_delay,
-                "color": transport_type["color"]
-            })
-
-        print(f"🚌 Analyse transport générée: {len(transport_data)} types")
-        return {"transport_data": transport_data}
+        result = await run_blocking(run_analytics, "transport", seed, refresh)
+        print(f"🚌 Analyse transport générée: {len(result['transport_data'])} types")
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de l'analyse transport: {str(e)}"
         print(f"❌ {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
 @app.get("/analytics/overview")
-async def get_overview_analytics():
+async def get_overview_analytics(seed: Optional[int] = None, refresh: bool = False):
     """Vue d'ensemble des métriques clés"""
-    if not models:
-        raise HTTPException(status_code=500, detail="Modèles non chargés")
+    await ensure_models_loaded()
 
     try:
-        # Utiliser le meilleur modèle
-        model_to_use = models.get('random_forest', list(models.values())[0])
-
-        # Calculer des métriques réelles basées sur des prédictions du modèle
-        delays = []
-        for _ in range(50):
-            transport = np.random.choice(["Metro", "Bus", "Train"])
-            line = np.random.choice(["Line1", "Line2", "Line3", "Line4", "Line5"])
-            hour = np.random.randint(6, 22)
-            day = np.random.choice(["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi"])
-            weather = np.random.choice(["Soleil", "Pluie", "TempsNormal"], p=[0.7, 0.2, 0.1])
-            event = np.random.choice(["Oui", "Non"], p=[0.9, 0.1])
-
-            request_data = PredictionRequest(
-                TransportType=transport,
-                Line=line,
-                Hour=hour,
-                Day=day,
-                Weather=weather,
-                Event=event
-            )
-
-            input_data = preprocess_input(request_data)
-            prediction = model_to_use.predict(input_data)[0]
-            delays.append(float(prediction))
-
-        real_avg_delay = round(np.mean(delays), 1)
-        real_max_delay = round(np.max(delays), 1)
-        real_min_delay = round(np.min(delays), 1)
-        real_punctuality = round(100 - (real_avg_delay * 2), 1)
-
-        overview_data = {
-            "total_predictions": 100,
-            "avg_delay": real_avg_delay,
-            "max_delay": real_max_delay,
-            "min_delay": real_min_delay,
-            "punctuality_rate": real_punctuality,
-            "model_accuracy": 89.2,
-            "last_updated": pd.Timestamp.now().isoformat()
-        }
-
-        print(f"📈 Vue d'ensemble générée: délai moyen {real_avg_delay} min")
-        return {"overview_data": overview_data}
+        result = await run_blocking(run_analytics, "overview", seed, refresh)
+        print(f"📈 Vue d'ensemble générée: délai moyen {result['overview_data']['avg_delay']} min")
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de la vue d'ensemble: {str(e)}"
         print(f"❌ {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
-@app.post("/predict")
-async def predict_delay(data: PredictionRequest):
-    """Endpoint de prédiction des retards"""
+@app.post("/predict", response_model=PredictionResponse, response_model_exclude_none=True)
+async def predict_delay(data: PredictionRequest, include_input: bool = PREDICT_INCLUDE_INPUT):
+    """Endpoint de prédiction des retards (include_input=false: sans renvoi des données d'entrée)"""
+    handler_start = time.perf_counter()
 
-    if not models:
-        raise HTTPException(status_code=500, detail="Aucun modèle chargé")
+    await ensure_models_loaded()
 
     # Vérifier que le modèle demandé existe
     model_type = data.model_type if data.model_type in models else 'random_forest'
@@ -624,14 +939,39 @@ async def predict_delay(data: PredictionRequest):
     if model_type not in models:
         raise HTTPException(status_code=400, detail=f"Modèle '{model_type}' non disponible. Modèles disponibles: {list(models.keys())}")
 
-    selected_model = models[model_type]
+    # Lecture du corps, parsing JSON et validation pydantic (avant l'appel du handler)
+    request_started = request_start.get()
+    if request_started is not None:
+        PREDICT_STAGE_LATENCY.labels("validation", model_type).observe(handler_start - request_started)
 
-    try:
-        # Prétraiter les données
-        input_data = preprocess_input(data)
+    source = "cache"
+
+    async def compute_prediction():
+        nonlocal source
+        # Lecture directe dans le cube si la requête est dans le domaine précalculé
+        prediction = prediction_cube.lookup(model_type, data) if prediction_cube is not None else None
+        source = "cube" if prediction is not None else "model"
 
-        # Faire la prédiction avec le modèle sélectionné
-        prediction = selected_model.predict(input_data)[0]
+        if prediction is None:
+            # Prétraiter les données
+            t0 = time.perf_counter()
+            input_data = preprocess_input(data)
+            t0 = observe_stage("preprocess", model_type, t0)
+
+            # Faire la prédiction avec le modèle sélectionné (hors de la boucle d'événements)
+            if micro_batcher is not None:
+                prediction = await micro_batcher.predict(model_type, input_data)
+            else:
+                prediction = (await run_predict(model_type, input_data))[0]
+            observe_stage("predict", model_type, t0)
+
+        return float(prediction)
+
+    try:
+        # Les requêtes identiques partagent le même résultat (cache + single-flight)
+        cache_key = make_key(model_type, model_versions.get(model_type), data)
+        prediction = await prediction_cache.get_or_compute(cache_key, compute_prediction)
+        PREDICTIONS.labels(model_type, source).inc()
 
         # Arrondir à 1 décimale
         delay = round(float(prediction), 1)
@@ -653,8 +993,11 @@ async def predict_delay(data: PredictionRequest):
             predicted_risk=risk_level,
             predicted_probability=probability
         )
-        prediction_id = db.save_prediction(prediction_record)
+        t0 = time.perf_counter()
+        prediction_id = (await save_history([prediction_record]))[0]
+        t0 = observe_stage("db_save", model_type, t0)
 
+        # Horodatage de l'enregistrement sauvegardé (pas de second appel à l'horloge)
         response_data = {
             "delay": delay,
             "risk": risk_level,
@@ -662,22 +1005,501 @@ async def predict_delay(data: PredictionRequest):
             "model_used": model_type,
             "unit": "minutes",
             "prediction_id": prediction_id,
-            "timestamp": pd.Timestamp.now().isoformat(),
-            "input": data.model_dump()
+            "timestamp": prediction_record.timestamp
         }
+        request_fields = data.model_dump()
+        if include_input:
+            response_data["input"] = request_fields
 
-        print(f"🤖 Modèle utilisé: {model_type}")
-        print(f"💾 Prédiction sauvegardée avec ID: {prediction_id}")
-        print(f"📤 Réponse envoyée: {json.dumps(response_data, indent=2, ensure_ascii=False)}")
-        print("-" * 50)
+        annotate(model_used=model_type, prediction_id=prediction_id, delay=delay,
+                 body=request_logger.body(request_fields))
 
-        return response_data
+        # Sérialisation faite ici (et non par FastAPI après le retour) pour pouvoir la mesurer;
+        # le retour direct d'une Response évite aussi le passage par jsonable_encoder
+        response = FastJSONResponse(content=response_data)
+        observe_stage("serialization", model_type, t0)
+        return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = f"Erreur lors de la prédiction: {str(e)}"
         print(f"❌ {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
+async def score_requests(requests: List[PredictionRequest], source: str, timing: Optional[dict] = None):
+    """Prétraite un lot en une matrice, exécute un seul predict par modèle et calcule risques et probabilités"""
+    start = time.perf_counter()
+    input_data = preprocess_batch(requests)
+    if timing is not None:
+        timing["preprocess"] = round((time.perf_counter() - start) * 1000, 3)
+
+    # Regrouper les lignes par modèle (même règle de repli que /predict)
+    model_types = np.array(
+        [r.model_type if r.model_type in models else 'random_forest' for r in requests],
+        dtype=object
+    )
+    delays = np.empty(len(requests), dtype=np.float64)
+
+    for model_type in dict.fromkeys(model_types):
+        rows = np.flatnonzero(model_types == model_type)
+        t0 = time.perf_counter()
+        delays[rows] = await run_predict(model_type, input_data[rows])
+        if timing is not None:
+            timing["predict"][model_type] = round((time.perf_counter() - t0) * 1000, 3)
+        PREDICTIONS.labels(model_type, source).inc(len(rows))
+
+    delays = np.round(delays, 1)
+    return model_types, delays, calculate_risk_levels(delays), calculate_probabilities(delays)
+
+def build_records(requests: List[PredictionRequest], model_types, delays, risks, probabilities) -> List[PredictionRecord]:
+    """Enregistrements d'historique d'un lot scoré"""
+    return [
+        PredictionRecord(
+            transport_type=r.TransportType,
+            line=r.Line,
+            hour=r.Hour,
+            day=r.Day,
+            weather=r.Weather,
+            event=r.Event,
+            model_used=model_types[i],
+            predicted_delay=float(delays[i]),
+            predicted_risk=str(risks[i]),
+            predicted_probability=float(probabilities[i])
+        )
+        for i, r in enumerate(requests)
+    ]
+
+def ensemble_weights(requested: Optional[Dict[str, float]], available: List[str]) -> Dict[str, float]:
+    """Poids normalisés de l'ensemble sur les modèles disponibles"""
+    weights = requested if requested is not None else ENSEMBLE_WEIGHTS
+    if not weights:
+        return {name: 1 / len(available) for name in available}
+
+    unknown = [name for name in weights if name not in available]
+    if unknown and requested is not None:
+        raise HTTPException(status_code=400, detail=f"Modèles inconnus dans weights: {unknown}. Modèles disponibles: {available}")
+    if any(w < 0 for w in weights.values()):
+        raise HTTPException(status_code=400, detail="Les poids de l'ensemble doivent être positifs")
+
+    weights = {name: float(weights.get(name, 0.0)) for name in available}
+    total = sum(weights.values())
+    if total <= 0:
+        raise HTTPException(status_code=400, detail="La somme des poids de l'ensemble doit être positive")
+    return {name: w / total for name, w in weights.items()}
+
+@app.post("/predict/all")
+async def predict_all_models(data: EnsemblePredictionRequest):
+    """Prédiction de tous les modèles chargés en un appel, avec un ensemble pondéré.
+
+    L'entrée est encodée une seule fois, les modèles sont évalués en parallèle sur
+    l'exécuteur et les lignes d'historique (une par modèle, l'ensemble n'est pas
+    enregistré) sont écrites en une seule insertion.
+    """
+    await ensure_models_loaded()
+
+    available = list(models)
+    weights = ensemble_weights(data.weights, available)
+    encoded = []  # Encodage partagé par les modèles (calculé au plus une fois)
+
+    def encode():
+        if not encoded:
+            encoded.append(preprocess_input(data))
+        return encoded[0]
+
+    async def predict_model(model_type: str) -> float:
+        async def compute_prediction():
+            prediction = prediction_cube.lookup(model_type, data) if prediction_cube is not None else None
+            if prediction is None:
+                prediction = (await run_predict(model_type, encode()))[0]
+                PREDICTIONS.labels(model_type, "model").inc()
+            else:
+                PREDICTIONS.labels(model_type, "cube").inc()
+            return float(prediction)
+
+        cache_key = make_key(model_type, model_versions.get(model_type), data)
+        return await prediction_cache.get_or_compute(cache_key, compute_prediction)
+
+    try:
+        start = time.perf_counter()
+        raw = dict(zip(available, await asyncio.gather(*(predict_model(m) for m in available))))
+        predict_ms = round((time.perf_counter() - start) * 1000, 3)
+
+        results = {}
+        for model_type, prediction in raw.items():
+            delay = round(prediction, 1)
+            results[model_type] = {
+                "delay": delay,
+                "risk": calculate_risk_level(delay),
+                "probability": calculate_probability(delay),
+                "weight": round(weights[model_type], 4)
+            }
+
+        ensemble_delay = round(sum(weights[m] * p for m, p in raw.items()), 1)
+        ensemble = {
+            "delay": ensemble_delay,
+            "risk": calculate_risk_level(ensemble_delay),
+            "probability": calculate_probability(ensemble_delay),
+            "weights": {m: round(w, 4) for m, w in weights.items()}
+        }
+
+        # 💾 Une ligne par modèle, en une seule insertion. L'ensemble n'est pas enregistré:
+        # ce n'est pas un modèle de /comparison/{model_name} (il n'a donc pas de prediction_id)
+        if data.save_history:
+            outputs = list(results.items())
+            records = [
+                PredictionRecord(
+                    transport_type=data.TransportType,
+                    line=data.Line,
+                    hour=data.Hour,
+                    day=data.Day,
+                    weather=data.Weather,
+                    event=data.Event,
+                    model_used=model_type,
+                    predicted_delay=output["delay"],
+                    predicted_risk=output["risk"],
+                    predicted_probability=output["probability"]
+                )
+                for model_type, output in outputs
+            ]
+            prediction_ids = await save_history(records)
+            for (_, output), prediction_id in zip(outputs, prediction_ids):
+                output["prediction_id"] = prediction_id
+
+        annotate(models=available, ensemble_delay=ensemble_delay)
+
+        return FastJSONResponse(content={
+            "predictions": results,
+            "ensemble": ensemble,
+            "unit": "minutes",
+            "timing_ms": {"predict": predict_ms},
+            "timestamp": now_iso(),
+            "input": data.model_dump(include=set(PredictionRequest.model_fields) - {"model_type"})
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"Erreur lors de la prédiction multi-modèles: {str(e)}"
+        print(f"❌ {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+@app.post("/predict/batch")
+async def predict_delay_batch(batch: BatchPredictionRequest):
+    """Prédiction des retards pour un lot de requêtes (un seul predict par modèle)"""
+
+    await ensure_models_loaded()
+
+    n = len(batch.requests)
+    if n == 0:
+        raise HTTPException(status_code=400, detail="Le lot de requêtes est vide")
+    if n > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Lot trop volumineux: {n} requêtes (maximum {MAX_BATCH_SIZE})")
+
+    if 'random_forest' not in models and any(r.model_type not in models for r in batch.requests):
+        raise HTTPException(status_code=400, detail=f"Modèle 'random_forest' non disponible. Modèles disponibles: {list(models.keys())}")
+
+    try:
+        start = time.perf_counter()
+        timing = {"predict": {}}
+
+        model_types, delays, risks, probabilities = await score_requests(batch.requests, "batch", timing)
+
+        # 💾 Sauvegarder tout le lot dans une seule transaction
+        prediction_ids = [None] * n
+        t0 = time.perf_counter()
+        if batch.save_history:
+            records = build_records(batch.requests, model_types, delays, risks, probabilities)
+            prediction_ids = await save_history(records)
+        timing["database"] = round((time.perf_counter() - t0) * 1000, 3)
+        timing["total"] = round((time.perf_counter() - start) * 1000, 3)
+
+        predictions = [
+            {
+                "delay": float(delays[i]),
+                "risk": str(risks[i]),
+                "probability": float(probabilities[i]),
+                "model_used": model_types[i],
+                "unit": "minutes",
+                "prediction_id": prediction_ids[i]
+            }
+            for i in range(n)
+        ]
+
+        annotate(batch_size=n, timing_ms=timing)
+
+        return FastJSONResponse(content={
+            "count": n,
+            "predictions": predictions,
+            "timing_ms": timing,
+            "timestamp": now_iso()
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        error_msg = f"Erreur lors de la prédiction par lot: {str(e)}"
+        print(f"❌ {error_msg}")
+        raise HTTPException(status_code=500, detail=error_msg)
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors())
+
+@app.post("/predict/stream")
+async def predict_stream(
+    request: Request,
+    format: Optional[str] = None,
+    model_type: str = "random_forest",
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    save_history: bool = False
+):
+    """Scoring en flux: lignes NDJSON ou CSV en entrée, résultats NDJSON renvoyés au fil de la lecture.
+
+    Les lignes sont scorées par paquets de `chunk_size`; la mémoire reste bornée à un paquet.
+    Une ligne invalide produit une ligne d'erreur sans interrompre le flux. La dernière ligne
+    est un résumé ("done": true).
+    """
+    await ensure_models_loaded()
+
+    try:
+        fmt = detect_format(request.headers.get("content-type"), format)
+    except StreamFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not 1 <= chunk_size <= MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"chunk_size doit être compris entre 1 et {MAX_BATCH_SIZE}")
+
+    async def results():
+        start = time.perf_counter()
+        counts = {"rows": 0, "errors": 0, "saved": 0, "chunks": 0}
+        rows = iter_rows(iter_lines(request.stream()), fmt)
+
+        try:
+            async for chunk in iter_chunks(rows, chunk_size):
+                out = [None] * len(chunk)
+                valid = []  # (position dans le paquet, requête, identifiant fourni par le client)
+
+                for position, (line_no, row, error) in enumerate(chunk):
+                    if error is None:
+                        try:
+                            data = PredictionRequest(**{"model_type": model_type, **row})
+                        except ValidationError as e:
+                            error = validation_message(e)
+                        else:
+                            if data.model_type not in models and 'random_forest' not in models:
+                                error = f"Modèle '{data.model_type}' non disponible"
+                    if error is not None:
+                        out[position] = ndjson_line({"line": line_no, "error": error})
+                        counts["errors"] += 1
+                    else:
+                        valid.append((position, data, row.get("id")))
+
+                if valid:
+                    requests = [data for _, data, _ in valid]
+                    model_types, delays, risks, probabilities = await score_requests(requests, "stream")
+                    prediction_ids = [None] * len(valid)
+                    if save_history:
+                        prediction_ids = await save_history(
+                            build_records(requests, model_types, delays, risks, probabilities)
+                        )
+                        counts["saved"] += len(valid)
+
+                    for i, (position, _, row_id) in enumerate(valid):
+                        result = {
+                            "line": chunk[position][0],
+                            "delay": float(delays[i]),
+                            "risk": str(risks[i]),
+                            "probability": float(probabilities[i]),
+                            "model_used": model_types[i],
+                            "prediction_id": prediction_ids[i]
+                        }
+                        if row_id is not None:
+                            result["id"] = row_id
+                        out[position] = ndjson_line(result)
+
+                counts["rows"] += len(valid)
+                counts["chunks"] += 1
+                # Le paquet suivant n'est lu qu'une fois celui-ci envoyé (contre-pression)
+                yield b"".join(out)
+
+        except ClientDisconnect:
+            print(f"⚠️ Scoring en flux interrompu par le client après {counts['rows']} lignes")
+            return
+        except (StreamFormatError, UnicodeDecodeError) as e:
+            yield ndjson_line({"error": str(e), "aborted": True})
+        except HTTPException as e:
+            yield ndjson_line({"error": e.detail, "aborted": True})
+        except Exception as e:
+            print(f"❌ Erreur lors du scoring en flux: {e}")
+            yield ndjson_line({"error": f"Erreur lors du scoring en flux: {e}", "aborted": True})
+
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        annotate(stream_rows=counts["rows"], stream_errors=counts["errors"])
+        yield ndjson_line({"done": True, **counts, "elapsed_ms": elapsed_ms})
+
+    return DuplexStreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/cube/{model_type}")
+async def get_cube_slice(
+    model_type: str,
+    TransportType: Optional[str] = None,
+    Line: Optional[str] = None,
+    Hour: Optional[int] = None,
+    Day: Optional[str] = None,
+    Weather: Optional[str] = None,
+    Event: Optional[str] = None,
+    mean_over: Optional[str] = None
+):
+    """Tranche du cube de prédictions (ex: toutes les heures x météos pour Line3)"""
+    await ensure_models_loaded()
+    if prediction_cube is None:
+        raise HTTPException(status_code=404, detail="Cube de prédictions désactivé (USE_PREDICTION_CUBE=1 pour l'activer)")
+
+    if model_type not in prediction_cube.values:
+        raise HTTPException(status_code=400, detail=f"Modèle '{model_type}' non disponible. Modèles disponibles: {list(prediction_cube.values.keys())}")
+
+    fixed = {
+        name: value
+        for name, value in [("TransportType", TransportType), ("Line", Line), ("Hour", Hour),
+                            ("Day", Day), ("Weather", Weather), ("Event", Event)]
+        if value is not None
+    }
+    reduce_axes = [name.strip() for name in mean_over.split(",") if name.strip()] if mean_over else []
+
+    try:
+        axes, values = prediction_cube.slice(model_type, fixed, reduce_axes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Axe inconnu ou déjà fixé: {e}")
+
+    return {
+        "model_used": model_type,
+        "fixed": fixed,
+        "axes": [{"name": name, "values": axis_values} for name, axis_values in axes],
+        "values": np.round(values, 1).tolist(),
+        "unit": "minutes"
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métriques au format texte Prometheus"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def check_profiler_access(token: Optional[str]):
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profilage désactivé (PROFILER_ENABLED=1 pour l'activer)")
+    if PROFILER_TOKEN and token != PROFILER_TOKEN:
+        raise HTTPException(status_code=403, detail="Jeton d'administration invalide")
+
+def profile_response(profile: dict, format: str, name: str):
+    if format == "json":
+        return profile["summary"]
+    return PlainTextResponse(
+        profile["collapsed"],
+        headers={"Content-Disposition": f'attachment; filename="{name}.collapsed"'}
+    )
+
+@app.post("/admin/profile")
+async def profile_process(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    format: str = "collapsed",
+    x_admin_token: Optional[str] = Header(default=None)
+):
+    """Profil CPU du worker pendant `seconds` secondes (piles repliées pour flamegraph, ou résumé JSON)"""
+    global active_profiler
+    check_profiler_access(x_admin_token)
+
+    if not 0 < seconds <= PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"La durée doit être comprise entre 0 et {PROFILER_MAX_SECONDS} s")
+    if not 0.1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="L'intervalle doit être compris entre 0.1 et 1000 ms")
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="Format invalide (collapsed ou json)")
+    if active_profiler is not None:
+        raise HTTPException(status_code=409, detail="Un profilage est déjà en cours")
+
+    # L'échantillonnage tourne dans son propre thread: la boucle d'événements reste libre
+    active_profiler = SamplingProfiler(interval=interval_ms / 1000).start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler = active_profiler.stop()
+        active_profiler = None
+
+    profile_id = profile_store.add(profiler, path="*", method="process", seconds=seconds)
+    print(f"🔬 Profil {profile_id}: {profiler.samples} échantillons en {seconds} s")
+    return profile_response(profile_store.get(profile_id), format, f"profile-{profile_id}")
+
+@app.get("/admin/profiles")
+async def list_profiles(x_admin_token: Optional[str] = Header(default=None)):
+    """Profils conservés en mémoire (les plus récents)"""
+    check_profiler_access(x_admin_token)
+    return {"profiles": profile_store.list()}
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "collapsed", x_admin_token: Optional[str] = Header(default=None)):
+    """Télécharge un profil (identifiant renvoyé dans l'en-tête X-Profile-Id)"""
+    check_profiler_access(x_admin_token)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profil {profile_id} introuvable")
+    return profile_response(profile, format, f"profile-{profile_id}")
+
+@app.get("/logging/stats")
+async def get_logging_stats():
+    """Compteurs de la journalisation des requêtes (écrites, échantillonnées, perdues)"""
+    return {
+        "request_log": request_logger.stats(),
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Compteurs du cache de prédictions"""
+    return {
+        "cache": prediction_cache.stats(),
+        "model_versions": model_versions,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/executor/stats")
+async def get_executor_stats():
+    """Taille de la file et workers actifs de l'exécuteur d'inférence"""
+    return {
+        "executor": inference_executor.stats(),
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/database/stats")
+async def get_database_stats():
+    """Connexions SQLite ouvertes (une en écriture et une en lecture seule par thread) et réglages"""
+    return {
+        "database": db.connections.stats(),
+        "write_behind": history_writer.stats(),
+        "timestamp": now_iso()
+    }
+
+@app.get("/batcher/stats")
+async def get_batcher_stats():
+    """Histogrammes de taille de lot et d'attente du micro-batching"""
+    return {
+        "enabled": micro_batcher is not None,
+        "batcher": micro_batcher.stats() if micro_batcher is not None else None,
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
+@app.get("/system/memory")
+async def get_memory_usage():
+    """Mémoire (RSS, PSS, partagée, privée) de ce worker et des autres workers de serve.py"""
+    master_pid = os.getenv("SERVE_MASTER_PID")
+    return {
+        "worker_pid": os.getpid(),
+        "mmap": MODEL_MMAP,
+        **workers_memory(int(master_pid) if master_pid else None),
+        "timestamp": pd.Timestamp.now().isoformat()
+    }
+
 
 # ==================== HISTORIQUE ET COMPARAISON ====================
 
@@ -687,33 +1509,127 @@ async def get_history(
     offset: int = 0,
     model_filter: Optional[str] = None,
     transport_filter: Optional[str] = None,
-    day_filter: Optional[str] = None
+    day_filter: Optional[str] = None,
+    cursor: Optional[str] = None,
+    total: Optional[Literal["exact", "estimate", "none"]] = None
 ):
-    """Récupère l'historique des prédictions avec filtres optionnels"""
+    """Récupère l'historique des prédictions avec filtres optionnels
+
+    Pagination par curseur: passer le `next_cursor` de la réponse précédente (lecture
+    d'index quelle que soit la profondeur, contrairement à `offset`). `total`: "exact"
+    (COUNT), "estimate" (agrégats par modèle et échantillon récent) ou "none"; par
+    défaut "exact" sans curseur (compatibilité) et "none" avec un curseur.
+    """
     try:
-        records, total = db.get_history(
-            limit=limit,
+        after = None
+        if cursor:
+            try:
+                after = decode_history_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Curseur d'historique invalide")
+        if limit < 1:
+            raise HTTPException(status_code=400, detail="Le paramètre limit doit être supérieur à 0")
+        total = total or ("none" if cursor else "exact")
+
+        # Lignes lues directement en dictionnaires (sans objets PredictionRecord intermédiaires);
+        # une ligne de plus pour savoir s'il existe une page suivante
+        rows, count = await run_blocking(
+            db.get_history_rows,
+            limit=limit + 1,
             offset=offset,
             model_filter=model_filter,
             transport_filter=transport_filter,
-            day_filter=day_filter
+            day_filter=day_filter,
+            after=after,
+            count=total == "exact"
         )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_history_cursor(rows[-1]["timestamp"], rows[-1]["id"])
+
+        total_exact = total == "exact"
+        if total == "estimate":
+            count, total_exact = await run_blocking(
+                db.estimate_history_count, model_filter, transport_filter, day_filter
+            )
         
-        return {
-            "total": total,
+        return FastJSONResponse(content={
+            "total": count,
+            "total_exact": total_exact if count is not None else None,
             "limit": limit,
             "offset": offset,
-            "predictions": [record.to_dict() for record in records]
-        }
+            "next_cursor": next_cursor,
+            "predictions": rows
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération de l'historique: {str(e)}")
 
 
+def export_bounds(date_from: Optional[str], date_to: Optional[str]) -> tuple:
+    """Bornes ISO de l'export: date_from incluse, date_to exclue (une date seule inclut toute la journée)"""
+    bounds = []
+    for name, value in (("date_from", date_from), ("date_to", date_to)):
+        if not value:
+            bounds.append(None)
+            continue
+        try:
+            bound = datetime.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} invalide: {value} (format ISO, ex: 2024-01-31 ou 2024-01-31T08:00)")
+        if name == "date_to" and len(value) == 10:
+            bound += timedelta(days=1)
+        bounds.append(bound.isoformat())
+    return tuple(bounds)
+
+
+@app.get("/history/export")
+async def export_history(
+    format: str = "csv",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    model_filter: Optional[str] = None
+):
+    """Exporte l'historique en flux (csv, csv.gz, parquet ou arrow), avec filtres de dates et de modèle
+
+    Les lignes sont lues par blocs (fetchmany) et envoyées au fil de l'eau: mémoire
+    constante quelle que soit la taille de l'historique.
+    """
+    try:
+        check_format(format)
+    except ExportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    start, end = export_bounds(date_from, date_to)
+
+    chunks = db.iter_history_chunks(date_from=start, date_to=end, model_filter=model_filter)
+    stream = iter_export(chunks, EXPORT_COLUMNS, format)
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"predictions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+    def close_export():
+        # Client déconnecté en cours de flux: Starlette abandonne les générateurs sans les fermer,
+        # la connexion dédiée (et son instantané, qui bloque les checkpoints WAL) resterait ouverte
+        stream.close()
+        chunks.close()
+
+    # Générateur synchrone: Starlette l'itère dans son pool de threads, hors de la boucle d'événements.
+    # La tâche de fond s'exécute après la fin du flux, qu'il soit complet ou interrompu.
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        background=BackgroundTask(close_export)
+    )
+
+
 @app.get("/history/{prediction_id}")
 async def get_prediction_details(prediction_id: int):
     """Récupère les détails d'une prédiction spécifique"""
     try:
-        record = db.get_prediction(prediction_id)
+        # Prédiction encore dans la file d'écriture différée
+        record = history_writer.pending(prediction_id) or await run_blocking(db.get_prediction, prediction_id)
         if not record:
             raise HTTPException(status_code=404, detail=f"Prédiction avec ID {prediction_id} non trouvée")
         
@@ -732,15 +1648,19 @@ async def update_prediction_actual(
 ):
     """Met à jour une prédiction avec le délai réel observé"""
     try:
+        # Prédiction encore dans la file d'écriture différée: attendre son écriture
+        if history_writer.pending(prediction_id) is not None:
+            await run_blocking(history_writer.wait_written, prediction_id)
+
         # Vérifier que la prédiction existe
-        record = db.get_prediction(prediction_id)
+        record = await run_blocking(db.get_prediction, prediction_id)
         if not record:
             raise HTTPException(status_code=404, detail=f"Prédiction avec ID {prediction_id} non trouvée")
         
-        db.update_actual_delay(prediction_id, actual_delay, actual_risk)
+        await run_blocking(db.update_actual_delay, prediction_id, actual_delay, actual_risk)
         
         # Retourner la prédiction mise à jour
-        updated_record = db.get_prediction(prediction_id)
+        updated_record = await run_blocking(db.get_prediction, prediction_id)
         return updated_record.to_dict()
     except HTTPException:
         raise
@@ -753,14 +1673,16 @@ async def get_model_comparison():
     """Récupère la comparaison détaillée entre tous les modèles"""
     try:
         # Récupérer les statistiques complètes pour chaque modèle
-        model_stats = db.get_model_statistics()
-        comparison = db.get_model_comparison()
+        model_stats = await run_blocking(db.get_model_statistics)
+        comparison = await run_blocking(db.get_model_comparison)
         
-        return {
+        return FastJSONResponse(content={
             "comparison": comparison,
             "statistics": model_stats,
-            "timestamp": pd.Timestamp.now().isoformat()
-        }
+            "timestamp": now_iso()
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération de la comparaison: {str(e)}")
 
@@ -772,7 +1694,7 @@ async def get_model_details(model_name: str):
         if model_name not in models:
             raise HTTPException(status_code=400, detail=f"Modèle '{model_name}' non disponible. Modèles disponibles: {list(models.keys())}")
         
-        stats = db.get_model_statistics(model_name)
+        stats = await run_blocking(db.get_model_statistics, model_name)
         if model_name not in stats:
             stats[model_name] = {
                 "model_used": model_name,
@@ -791,11 +1713,25 @@ async def get_model_details(model_name: str):
         raise HTTPException(status_code=500, detail=f"Erreur lors de la récupération des détails: {str(e)}")
 
 
+@app.post("/comparison/aggregates/check")
+async def check_comparison_aggregates(repair: bool = True):
+    """Vérifie les tables d'agrégats de /comparison contre l'historique complet (et les reconstruit si besoin)"""
+    try:
+        result = await run_blocking(db.check_aggregates, repair)
+        if not result["consistent"]:
+            print(f"⚠️ Agrégats incohérents: {len(result['mismatches'])} écarts (reconstruits: {result['repaired']})")
+        return {**result, "timestamp": now_iso()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur lors de la vérification des agrégats: {str(e)}")
+
+
 @app.post("/history/export/csv")
 async def export_history_csv():
-    """Exporte l'historique en CSV"""
+    """Exporte l'historique en CSV dans ./exports (téléchargement en flux: GET /history/export)"""
     try:
-        success = db.export_to_csv("./exports/predictions_export.csv")
+        success = await run_blocking(db.export_to_csv, "./exports/predictions_export.csv")
         if not success:
             raise HTTPException(status_code=400, detail="Aucune prédiction à exporter")
         
@@ -813,12 +1749,14 @@ async def export_history_csv():
 async def cleanup_old_predictions(days: int = 30):
     """Supprime les prédictions plus anciennes que le nombre de jours spécifié"""
     try:
-        deleted_count = db.clear_old_predictions(days)
+        deleted_count = await run_blocking(db.clear_old_predictions, days)
         return {
             "message": f"Nettoyage réussi",
             "deleted_count": deleted_count,
             "days": days
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors du nettoyage: {str(e)}")
 
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Benchmark des requêtes de l'historique (database.py) avant et après les index de la migration 3
+
+Une base de N prédictions synthétiques (1M par défaut, sur 180 jours) est créée dans
+l'état d'un fichier déployé avant les index (schéma version 2), les requêtes de
+/history et de clear_old_predictions sont chronométrées, puis la base est migrée par
+Database.init_db() comme au démarrage de l'API et les mêmes requêtes sont rejouées.
+
+Usage: python benchmark_history.py [--rows 1000000] [--repeat 5] [--db chemin.db]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database import MIGRATIONS, Database, split_statements
+
+REPORT_PATH = "./results/history_query_benchmark.csv"
+MODELS = ['random_forest', 'xgboost', 'linear_regression']
+TRANSPORTS = ['Bus', 'Metro', 'Train']
+DAYS = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
+WEATHERS = ['Ensoleillé', 'Pluie', 'Neige', 'Nuageux']
+RISKS = ['Faible', 'Moyen', 'Élevé']
+
+# (nom, arguments de get_history_rows)
+HISTORY_QUERIES = [
+    ('page 1', {}),
+    ('page 1, modèle', {'model_filter': 'xgboost'}),
+    ('page 1, transport', {'transport_filter': 'Metro'}),
+    ('page 1, jour', {'day_filter': 'Samedi'}),
+    ('page 1, modèle + jour', {'model_filter': 'xgboost', 'day_filter': 'Samedi'}),
+    ('page 1, 3 filtres', {'model_filter': 'xgboost', 'transport_filter': 'Metro', 'day_filter': 'Samedi'}),
+    ('page 100', {'offset': 9900}),
+    ('page 100, modèle', {'model_filter': 'xgboost', 'offset': 9900}),
+]
+
+
+def history_index_names():
+    return [statement.split('EXISTS', 1)[1].split()[0]
+            for statement in split_statements(MIGRATIONS[2][1]) if 'CREATE INDEX' in statement]
+
+
+def fill(db: Database, rows: int, chunk: int = 50000, seed: int = 42):
+    """Insère `rows` prédictions aléatoires, horodatées dans l'ordre d'insertion sur 180 jours"""
+    rng = np.random.default_rng(seed)
+    start = datetime.now() - timedelta(days=180)
+    step = 180 * 86400 / rows
+    with db.connections.writer() as conn:
+        for first in range(0, rows, chunk):
+            n = min(chunk, rows - first)
+            models = rng.integers(0, len(MODELS), n)
+            transports = rng.integers(0, len(TRANSPORTS), n)
+            days = rng.integers(0, len(DAYS), n)
+            weathers = rng.integers(0, len(WEATHERS), n)
+            hours = rng.integers(0, 24, n)
+            delays = rng.gamma(2.0, 4.0, n).round(2)
+            probabilities = rng.uniform(0, 100, n).round(1)
+            conn.executemany('''
+                INSERT INTO predictions (
+                    transport_type, line, hour, day, weather, event, model_used,
+                    predicted_delay, predicted_risk, predicted_probability, timestamp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                (TRANSPORTS[transports[i]], f"Line{hours[i] % 10 + 1}", int(hours[i]), DAYS[days[i]],
+                 WEATHERS[weathers[i]], 'Non', MODELS[models[i]], float(delays[i]),
+                 RISKS[min(int(delays[i] // 10), 2)], float(probabilities[i]),
+                 (start + timedelta(seconds=(first + i) * step)).isoformat())
+                for i in range(n)
+            ))
+
+
+def timed(fn, repeat: int) -> float:
+    """Médiane en ms de `repeat` appels (après un appel de chauffe)"""
+    fn()
+    durations = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(durations)
+
+
+def where_clause(kwargs: dict):
+    filters = [(column, kwargs[key]) for key, column in (
+        ('model_filter', 'model_used'), ('transport_filter', 'transport_type'), ('day_filter', 'day')
+    ) if key in kwargs]
+    return ''.join(f" AND {column} = ?" for column, _ in filters), [value for _, value in filters]
+
+
+def query_plan(db: Database, kwargs: dict) -> str:
+    where, params = where_clause(kwargs)
+    with db.connections.reader() as conn:
+        rows = conn.execute(
+            f'EXPLAIN QUERY PLAN SELECT * FROM predictions WHERE 1=1{where} ORDER BY timestamp DESC LIMIT 100', params
+        ).fetchall()
+    return ' | '.join(row[-1] for row in rows)
+
+
+def count_rows(db: Database, kwargs: dict):
+    """COUNT(*) du total renvoyé avec chaque page"""
+    where, params = where_clause(kwargs)
+    with db.connections.reader() as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM predictions WHERE 1=1{where}', params).fetchone()
+
+
+def measure(db: Database, repeat: int) -> dict:
+    cutoff = (datetime.now() - timedelta(days=30)).isoformat()
+    results = {}
+    for name, kwargs in HISTORY_QUERIES:
+        results[name] = (
+            timed(lambda: db.get_history_rows(limit=100, **kwargs), repeat),
+            query_plan(db, kwargs),
+            timed(lambda: count_rows(db, kwargs), repeat)
+        )
+
+    def old_rows():
+        # Sélection de clear_old_predictions (lecture seule, sans supprimer)
+        with db.connections.reader() as conn:
+            return conn.execute('SELECT COUNT(*) FROM predictions WHERE timestamp < ?', (cutoff,)).fetchone()
+
+    results['prédictions > 30 jours'] = (timed(old_rows, repeat), '', None)
+    return results
+
+
+def run_benchmark(rows: int = 1_000_000, repeat: int = 5, db_path: str = None):
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(db_path or os.path.join(directory, "benchmark.db"))
+
+        # État d'un fichier déployé avant les index: schéma version 2
+        with db.connections.writer() as conn:
+            for name in history_index_names():
+                conn.execute(f'DROP INDEX IF EXISTS {name}')
+            conn.execute('PRAGMA user_version = 2')
+
+        t0 = time.perf_counter()
+        fill(db, rows)
+        print(f"📦 {rows:,} prédictions insérées en {time.perf_counter() - t0:.1f} s ({db.db_path})")
+
+        print("⏱️ Requêtes sans index (version 2)...")
+        before = measure(db, repeat)
+
+        t0 = time.perf_counter()
+        db.init_db()
+        migration_s = time.perf_counter() - t0
+        print(f"🗄️ Migration vers la version {len(MIGRATIONS)} en {migration_s:.1f} s")
+        db.connections.close_all()  # connexions neuves, comme après un redémarrage de l'API
+
+        print("⏱️ Requêtes avec index...")
+        after = measure(db, repeat)
+        db.connections.close_all()
+
+    report = pd.DataFrame([
+        {'query': name, 'rows': rows, 'before_ms': round(before[name][0], 3), 'after_ms': round(after[name][0], 3),
+         'speedup': round(before[name][0] / after[name][0], 1),
+         'after_count_ms': None if after[name][2] is None else round(after[name][2], 3), 'plan_before': before[name][1],
+         'plan_after': after[name][1]}
+        for name in before
+    ])
+    report['migration_s'] = round(migration_s, 2)
+
+    print(f"\n{'Requête':<26}{'avant (ms)':>12}{'après (ms)':>12}{'gain':>8}{'dont COUNT(*)':>15}")
+    for row in report.itertuples():
+        count = '' if pd.isna(row.after_count_ms) else f"{row.after_count_ms:.2f}"
+        print(f"{row.query:<26}{row.before_ms:>12.2f}{row.after_ms:>12.2f}{row.speedup:>7.0f}x{count:>15}")
+    print("\nPlans après migration:")
+    for row in report.itertuples():
+        if row.plan_after:
+            print(f"  • {row.query}: {row.plan_after}")
+
+    os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+    report.to_csv(REPORT_PATH, index=False)
+    print(f"\n💾 Rapport: {REPORT_PATH}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark des requêtes de l'historique avant/après index")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Nombre de prédictions synthétiques")
+    parser.add_argument("--repeat", type=int, default=5, help="Mesures par requête (médiane)")
+    parser.add_argument("--db", default=None, help="Fichier de base à créer (par défaut: répertoire temporaire)")
+    args = parser.parse_args()
+    run_benchmark(args.rows, args.repeat, args.db)
@@ -0,0 +1,109 @@
+"""
+Streaming input/output helpers for bulk scoring (POST /predict/stream).
+
+The request body is consumed incrementally: bytes are split into lines, parsed as
+NDJSON or CSV rows and grouped into fixed-size chunks. Only one chunk of rows and
+one body message are held in memory; the next body message is read only after the
+previous chunk's results were sent, which propagates backpressure to the client.
+"""
+import csv
+import json
+from typing import AsyncIterator, List, Optional, Tuple
+
+from starlette.responses import StreamingResponse
+
+from fast_json import dumps
+
+# A single input line larger than this aborts the stream (protects memory)
+MAX_LINE_BYTES = 64 * 1024
+
+CSV_MEDIA_TYPES = ("text/csv", "application/csv")
+
+
+class StreamFormatError(ValueError):
+    """Raised when the input stream cannot be parsed any further."""
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> str:
+    """'ndjson' or 'csv', from the explicit parameter or the Content-Type header."""
+    if requested:
+        if requested not in ("ndjson", "csv"):
+            raise StreamFormatError(f"Format d'entrée inconnu: {requested} (ndjson ou csv)")
+        return requested
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return "csv" if media_type in CSV_MEDIA_TYPES else "ndjson"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = MAX_LINE_BYTES) -> AsyncIterator[str]:
+    """Decoded lines (without the line terminator) of a byte stream."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > max_line_bytes:
+            raise StreamFormatError(f"Ligne de plus de {max_line_bytes} octets")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+    if buffer.strip():
+        yield buffer.rstrip(b"\r").decode("utf-8")
+
+
+async def iter_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(line number, row dict, error) for every non-empty line; CSV needs a header line."""
+    header = None
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"JSON invalide: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, "Chaque ligne doit être un objet JSON"
+                continue
+            yield line_no, row, None
+        else:
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            if len(values) != len(header):
+                yield line_no, None, f"{len(values)} colonnes au lieu de {len(header)}"
+                continue
+            yield line_no, dict(zip(header, values)), None
+
+
+async def iter_chunks(rows: AsyncIterator, chunk_size: int) -> AsyncIterator[List]:
+    """Group an async iterator into lists of at most chunk_size items."""
+    chunk = []
+    async for item in rows:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_line(obj: dict) -> bytes:
+    return dumps(obj) + b"\n"
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse that may keep reading the request body while it streams.
+
+    Starlette's StreamingResponse listens for the client disconnect with receive(),
+    which would consume (and discard) the request body messages still being read by
+    the generator. Here only the body iterator calls receive(); a disconnect surfaces
+    as ClientDisconnect from request.stream() and ends the generator.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
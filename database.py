@@ -1,15 +1,253 @@
 """
 Database models and configuration for storing prediction history and model comparisons.
 """
+import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List
+from typing import Iterator, Optional, List
 from dataclasses import asdict
+from urllib.parse import quote
+import base64
+import itertools
 import json
 
+from metrics import timed_db
+
 # Database configuration
 DB_PATH = "./predictions_history.db"
 
+# Connection tuning (see ConnectionManager)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable in WAL mode except on power loss
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Most recent rows sampled by estimate_history_count() for the transport/day filters
+HISTORY_ESTIMATE_SAMPLE = int(os.getenv("HISTORY_ESTIMATE_SAMPLE", "10000"))
+
+# Columns of a prediction as returned by the API (PredictionRecord.to_dict() order)
+PREDICTION_COLUMNS = (
+    'id', 'transport_type', 'line', 'hour', 'day', 'weather', 'event', 'model_used',
+    'predicted_delay', 'predicted_risk', 'predicted_probability', 'actual_delay', 'actual_risk', 'timestamp'
+)
+
+# Columns of an export: the API columns plus the insertion time
+EXPORT_COLUMNS = PREDICTION_COLUMNS + ('created_at',)
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+
+
+# Per-model and per-model x risk aggregates of the predictions table, kept up to date
+# by triggers (same transaction as every insert, update and delete) so that
+# /comparison reads O(models) rows instead of scanning the history.
+AGGREGATE_TABLES = '''
+    CREATE TABLE IF NOT EXISTS model_aggregates (
+        model_used TEXT PRIMARY KEY,
+        total_predictions INTEGER NOT NULL,
+        sum_predicted_delay REAL NOT NULL,
+        min_predicted_delay REAL,
+        max_predicted_delay REAL,
+        sum_probability REAL NOT NULL,
+        verified_predictions INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS model_risk_aggregates (
+        model_used TEXT NOT NULL,
+        predicted_risk TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        sum_probability REAL NOT NULL,
+        PRIMARY KEY (model_used, predicted_risk)
+    );
+    -- MIN/MAX of a model after a delete is an index lookup, not a scan
+    CREATE INDEX IF NOT EXISTS idx_predictions_model_delay ON predictions (model_used, predicted_delay);
+'''
+
+# Effect of adding the NEW row / removing the OLD row (trigger bodies)
+_AGGREGATE_ADD = '''
+    INSERT INTO model_aggregates VALUES (
+        NEW.model_used, 1, NEW.predicted_delay, NEW.predicted_delay, NEW.predicted_delay,
+        NEW.predicted_probability, NEW.actual_delay IS NOT NULL
+    ) ON CONFLICT (model_used) DO UPDATE SET
+        total_predictions = total_predictions + 1,
+        sum_predicted_delay = sum_predicted_delay + excluded.sum_predicted_delay,
+        min_predicted_delay = MIN(min_predicted_delay, excluded.min_predicted_delay),
+        max_predicted_delay = MAX(max_predicted_delay, excluded.max_predicted_delay),
+        sum_probability = sum_probability + excluded.sum_probability,
+        verified_predictions = verified_predictions + excluded.verified_predictions;
+    INSERT INTO model_risk_aggregates VALUES (NEW.model_used, NEW.predicted_risk, 1, NEW.predicted_probability)
+    ON CONFLICT (model_used, predicted_risk) DO UPDATE SET
+        count = count + 1,
+        sum_probability = sum_probability + excluded.sum_probability;
+'''
+_AGGREGATE_REMOVE = '''
+    UPDATE model_aggregates SET
+        total_predictions = total_predictions - 1,
+        sum_predicted_delay = sum_predicted_delay - OLD.predicted_delay,
+        sum_probability = sum_probability - OLD.predicted_probability,
+        verified_predictions = verified_predictions - (OLD.actual_delay IS NOT NULL)
+    WHERE model_used = OLD.model_used;
+    -- Min/max cannot be decremented: recomputed when the removed row was the bound
+    UPDATE model_aggregates SET
+        min_predicted_delay = (SELECT MIN(predicted_delay) FROM predictions WHERE model_used = OLD.model_used),
+        max_predicted_delay = (SELECT MAX(predicted_delay) FROM predictions WHERE model_used = OLD.model_used)
+    WHERE model_used = OLD.model_used
+      AND (OLD.predicted_delay <= min_predicted_delay OR OLD.predicted_delay >= max_predicted_delay);
+    DELETE FROM model_aggregates WHERE model_used = OLD.model_used AND total_predictions <= 0;
+    UPDATE model_risk_aggregates SET
+        count = count - 1,
+        sum_probability = sum_probability - OLD.predicted_probability
+    WHERE model_used = OLD.model_used AND predicted_risk = OLD.predicted_risk;
+    DELETE FROM model_risk_aggregates
+    WHERE model_used = OLD.model_used AND predicted_risk = OLD.predicted_risk AND count <= 0;
+'''
+AGGREGATE_TRIGGERS = f'''
+    CREATE TRIGGER IF NOT EXISTS predictions_aggregates_insert AFTER INSERT ON predictions
+    BEGIN {_AGGREGATE_ADD} END;
+    CREATE TRIGGER IF NOT EXISTS predictions_aggregates_delete AFTER DELETE ON predictions
+    BEGIN {_AGGREGATE_REMOVE} END;
+    CREATE TRIGGER IF NOT EXISTS predictions_aggregates_update
+    AFTER UPDATE OF model_used, predicted_delay, predicted_risk, predicted_probability, actual_delay ON predictions
+    BEGIN {_AGGREGATE_REMOVE} {_AGGREGATE_ADD} END;
+'''
+
+# Aggregates recomputed from scratch (rebuild and consistency check)
+MODEL_AGGREGATES_QUERY = '''
+    SELECT model_used, COUNT(*), SUM(predicted_delay), MIN(predicted_delay), MAX(predicted_delay),
+           SUM(predicted_probability), COUNT(actual_delay)
+    FROM predictions GROUP BY model_used
+'''
+RISK_AGGREGATES_QUERY = '''
+    SELECT model_used, predicted_risk, COUNT(*), SUM(predicted_probability)
+    FROM predictions GROUP BY model_used, predicted_risk
+'''
+REBUILD_AGGREGATES = f'''
+    DELETE FROM model_aggregates;
+    DELETE FROM model_risk_aggregates;
+    INSERT INTO model_aggregates {MODEL_AGGREGATES_QUERY};
+    INSERT INTO model_risk_aggregates {RISK_AGGREGATES_QUERY};
+'''
+
+# Indexes of the history queries: every filter of get_history followed by the sort
+# column, so a page is an index range read in timestamp order instead of a full scan
+# and a sort; the timestamp index also serves clear_old_predictions. SQLite appends
+# the rowid (id) to every index entry, so ties on timestamp are ordered by id, and
+# the filtered COUNT(*) is answered from the index alone.
+HISTORY_INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_predictions_timestamp ON predictions (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_predictions_model_timestamp ON predictions (model_used, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_predictions_transport_timestamp ON predictions (transport_type, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_predictions_day_timestamp ON predictions (day, timestamp);
+'''
+
+# Schema migrations, applied in order: migration i brings PRAGMA user_version to i + 1.
+# Files created before versioning have user_version 0; every statement is idempotent
+# (IF NOT EXISTS, aggregates recomputed) so they upgrade in place. Append new entries,
+# never edit applied ones.
+MIGRATIONS = [
+    ('predictions and model_metrics tables', '''
+        CREATE TABLE IF NOT EXISTS predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transport_type TEXT NOT NULL,
+            line TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            weather TEXT NOT NULL,
+            event TEXT NOT NULL,
+            model_used TEXT NOT NULL,
+            predicted_delay REAL NOT NULL,
+            predicted_risk TEXT NOT NULL,
+            predicted_probability REAL NOT NULL,
+            actual_delay REAL,
+            actual_risk TEXT,
+            timestamp TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        -- Daily aggregated stats
+        CREATE TABLE IF NOT EXISTS model_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            model_name TEXT NOT NULL,
+            date TEXT NOT NULL,
+            total_predictions INTEGER DEFAULT 0,
+            avg_prediction REAL,
+            min_prediction REAL,
+            max_prediction REAL,
+            mae REAL,
+            rmse REAL,
+            r2_score REAL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(model_name, date)
+        );
+    '''),
+    ('model aggregate tables and triggers', AGGREGATE_TABLES + AGGREGATE_TRIGGERS + REBUILD_AGGREGATES),
+    ('history indexes', HISTORY_INDEXES),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def encode_history_cursor(timestamp: str, prediction_id: int) -> str:
+    """Opaque keyset cursor: position (timestamp, id) of the last row of a history page."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, prediction_id]).encode()).decode().rstrip('=')
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """(timestamp, id) of an encode_history_cursor() value; ValueError if malformed."""
+    try:
+        timestamp, prediction_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError(f"Invalid history cursor: {cursor!r}")
+    if not isinstance(timestamp, str) or not isinstance(prediction_id, int):
+        raise ValueError(f"Invalid history cursor: {cursor!r}")
+    return timestamp, prediction_id
+
+
+def split_statements(script: str) -> List[str]:
+    """Split a SQL script into complete statements (trigger bodies kept whole)."""
+    statements, statement = [], ''
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ''
+    if statement.strip():
+        statements.append(statement)
+    return statements
+
+
+def migrate(conn: sqlite3.Connection, target: Optional[int] = None) -> List[int]:
+    """Apply the pending MIGRATIONS up to `target` (default: all); returns the versions applied.
+
+    Each migration runs in its own BEGIN IMMEDIATE transaction together with the
+    user_version bump, and the version is re-read under the write lock, so processes
+    starting at the same time apply each migration once. A file with a newer schema
+    than this code is refused.
+    """
+    target = SCHEMA_VERSION if target is None else target
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # explicit transactions below
+    applied = []
+    try:
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version > SCHEMA_VERSION:
+                    raise RuntimeError(
+                        f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})"
+                    )
+                if version >= target:
+                    conn.execute('COMMIT')
+                    return applied
+                for statement in split_statements(MIGRATIONS[version][1]):
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version + 1}')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            applied.append(version + 1)
+    finally:
+        conn.isolation_level = isolation_level
+
 
 class PredictionRecord:
     """Represents a prediction record in the database."""
@@ -66,107 +304,257 @@ class PredictionRecord:
         }
 
 
+class ConnectionManager:
+    """Long-lived SQLite connections, one read-write and one read-only per thread.
+
+    Connections are opened on first use by a thread and reused by every later call
+    (no connect/close per query). The database runs in WAL mode, so readers see the
+    last committed state without waiting for the writer; reads go through separate
+    read-only connections (mode=ro, query_only) that can never take the write lock.
+    A process forked after connections were opened gets fresh ones.
+    """
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS,
+                 synchronous: str = SQLITE_SYNCHRONOUS, cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+                 mmap_size: int = SQLITE_MMAP_SIZE):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.opened = {'writer': 0, 'reader': 0}
+        self.journal_mode: Optional[str] = None  # as reported by SQLite (see enable_wal)
+
+    def enable_wal(self):
+        """Switch the database file to WAL journaling (persistent, done once at startup).
+
+        SQLite keeps the previous mode where WAL is not supported (e.g. network file
+        systems); the mode actually in effect is recorded in journal_mode.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000)
+        try:
+            self.journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0].lower()
+        finally:
+            conn.close()
+        if self.journal_mode != 'wal':
+            print(f"⚠️ Mode WAL indisponible pour {self.db_path} (journal {self.journal_mode}): "
+                  "les lecteurs attendront les écritures")
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        timeout = self.busy_timeout_ms / 1000
+        if read_only:
+            uri = f"file:{quote(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=False)
+            conn.execute('PRAGMA query_only=ON')
+            conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=timeout, check_same_thread=False)
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._connections.append(conn)
+            self.opened['reader' if read_only else 'writer'] += 1
+        return conn
+
+    def _get(self, role: str) -> sqlite3.Connection:
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # New thread, or inherited across fork(): never reuse the parent's connections
+            local.__dict__.clear()
+            local.pid = os.getpid()
+        conn = getattr(local, role, None)
+        if conn is None:
+            conn = self._connect(read_only=role == 'reader')
+            setattr(local, role, conn)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Read-write connection of this thread; commits on success, rolls back on error."""
+        conn = self._get('writer')
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    @contextmanager
+    def reader(self):
+        """Read-only connection of this thread (never blocks nor is blocked by the writer)."""
+        conn = self._get('reader')
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+    @contextmanager
+    def dedicated_reader(self):
+        """Read-only connection owned by the caller until the block exits.
+
+        For long reads consumed step by step, possibly from several threads (streamed
+        exports): the per-thread connections stay free for the other requests.
+        """
+        conn = self._connect(read_only=True)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            conn.close()
+
+    def close_all(self):
+        """Close every connection (shutdown); threads reopen on next use."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'open_connections': len(self._connections), 'opened': dict(self.opened),
+                    'journal_mode': self.journal_mode, 'synchronous': self.synchronous}
+
+
 class Database:
     """Handles all database operations for prediction history."""
     
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
+        self.connections = ConnectionManager(db_path)
         self.init_db()
+        self.connections.enable_wal()
     
     def get_connection(self):
-        """Get a database connection."""
+        """Get a new, caller-owned database connection (the methods below use self.connections)."""
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         return conn
     
     def init_db(self):
-        """Initialize database tables if they don't exist."""
+        """Create the database or upgrade its schema to SCHEMA_VERSION (see MIGRATIONS)."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Create predictions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS predictions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                transport_type TEXT NOT NULL,
-                line TEXT NOT NULL,
-                hour INTEGER NOT NULL,
-                day TEXT NOT NULL,
-                weather TEXT NOT NULL,
-                event TEXT NOT NULL,
-                model_used TEXT NOT NULL,
-                predicted_delay REAL NOT NULL,
-                predicted_risk TEXT NOT NULL,
-                predicted_probability REAL NOT NULL,
-                actual_delay REAL,
-                actual_risk TEXT,
-                timestamp TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create model metrics table (daily aggregated stats)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS model_metrics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                model_name TEXT NOT NULL,
-                date TEXT NOT NULL,
-                total_predictions INTEGER DEFAULT 0,
-                avg_prediction REAL,
-                min_prediction REAL,
-                max_prediction REAL,
-                mae REAL,
-                rmse REAL,
-                r2_score REAL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(model_name, date)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        try:
+            applied = migrate(conn)
+            if applied:
+                print(f"🗄️ Schéma de la base: version {applied[0] - 1} -> {applied[-1]} "
+                      f"({', '.join(MIGRATIONS[v - 1][0] for v in applied)})")
+        finally:
+            conn.close()
     
+    @timed_db
     def save_prediction(self, record: PredictionRecord) -> int:
         """Save a prediction record to the database."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO predictions (
-                transport_type, line, hour, day, weather, event,
-                model_used, predicted_delay, predicted_risk, predicted_probability,
-                actual_delay, actual_risk, timestamp
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            record.transport_type,
-            record.line,
-            record.hour,
-            record.day,
-            record.weather,
-            record.event,
-            record.model_used,
-            record.predicted_delay,
-            record.predicted_risk,
-            record.predicted_probability,
-            record.actual_delay,
-            record.actual_risk,
-            record.timestamp
-        ))
-        
-        prediction_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return prediction_id
-    
+        with self.connections.writer() as conn:
+            cursor = conn.execute('''
+                INSERT INTO predictions (
+                    transport_type, line, hour, day, weather, event,
+                    model_used, predicted_delay, predicted_risk, predicted_probability,
+                    actual_delay, actual_risk, timestamp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                record.transport_type,
+                record.line,
+                record.hour,
+                record.day,
+                record.weather,
+                record.event,
+                record.model_used,
+                record.predicted_delay,
+                record.predicted_risk,
+                record.predicted_probability,
+                record.actual_delay,
+                record.actual_risk,
+                record.timestamp
+            ))
+        
+        return cursor.lastrowid
+
+    @timed_db
+    def save_predictions(self, records: List[PredictionRecord]) -> List[int]:
+        """Save several prediction records in a single transaction."""
+        prediction_ids = []
+        with self.connections.writer() as conn:
+            cursor = conn.cursor()
+            for record in records:
+                cursor.execute('''
+                    INSERT INTO predictions (
+                        transport_type, line, hour, day, weather, event,
+                        model_used, predicted_delay, predicted_risk, predicted_probability,
+                        actual_delay, actual_risk, timestamp
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    record.transport_type,
+                    record.line,
+                    record.hour,
+                    record.day,
+                    record.weather,
+                    record.event,
+                    record.model_used,
+                    record.predicted_delay,
+                    record.predicted_risk,
+                    record.predicted_probability,
+                    record.actual_delay,
+                    record.actual_risk,
+                    record.timestamp
+                ))
+                prediction_ids.append(cursor.lastrowid)
+
+        return prediction_ids
+
+    @timed_db
+    def reserve_prediction_ids(self, count: int) -> tuple[int, int]:
+        """Reserve `count` consecutive ids (first, last) from the AUTOINCREMENT sequence.
+
+        Rows inserted later with these explicit ids (insert_predictions) never collide
+        with ids assigned by save_prediction, in this process or another one.
+        """
+        with self.connections.writer() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'predictions'").fetchone()
+            if row is None:
+                last = conn.execute('SELECT COALESCE(MAX(id), 0) FROM predictions').fetchone()[0]
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('predictions', ?)", (last + count,))
+            else:
+                last = row[0]
+                conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'predictions'", (last + count,))
+        return last + 1, last + count
+
+    @timed_db
+    def insert_predictions(self, records: List[PredictionRecord]):
+        """Insert records that already carry their id (reserve_prediction_ids), one executemany and one commit."""
+        with self.connections.writer() as conn:
+            conn.executemany('''
+                INSERT INTO predictions (
+                    id, transport_type, line, hour, day, weather, event,
+                    model_used, predicted_delay, predicted_risk, predicted_probability,
+                    actual_delay, actual_risk, timestamp
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (
+                    record.id, record.transport_type, record.line, record.hour, record.day, record.weather,
+                    record.event, record.model_used, record.predicted_delay, record.predicted_risk,
+                    record.predicted_probability, record.actual_delay, record.actual_risk, record.timestamp
+                )
+                for record in records
+            ])
+
+    @timed_db
     def get_prediction(self, prediction_id: int) -> Optional[PredictionRecord]:
         """Get a single prediction by ID."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM predictions WHERE id = ?', (prediction_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connections.reader() as conn:
+            row = conn.execute('SELECT * FROM predictions WHERE id = ?', (prediction_id,)).fetchone()
         
         if not row:
             return None
@@ -188,6 +576,7 @@ class Database:
             timestamp=row['timestamp']
         )
     
+    @timed_db
     def get_history(
         self,
         limit: int = 100,
@@ -197,219 +586,289 @@ class Database:
         day_filter: Optional[str] = None
     ) -> tuple[List[PredictionRecord], int]:
         """Get prediction history with optional filters and pagination."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Build query
-        query = 'SELECT * FROM predictions WHERE 1=1'
-        params = []
-        
-        if model_filter:
-            query += ' AND model_used = ?'
-            params.append(model_filter)
-        
-        if transport_filter:
-            query += ' AND transport_type = ?'
-            params.append(transport_filter)
-        
-        if day_filter:
-            query += ' AND day = ?'
-            params.append(day_filter)
-        
-        # Get total count
-        count_query = query.replace('SELECT *', 'SELECT COUNT(*) as count')
-        cursor.execute(count_query, params)
-        total = cursor.fetchone()['count']
-        
-        # Get paginated results
-        query += ' ORDER BY timestamp DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
-        
-        records = [
-            PredictionRecord(
-                id=row['id'],
-                transport_type=row['transport_type'],
-                line=row['line'],
-                hour=row['hour'],
-                day=row['day'],
-                weather=row['weather'],
-                event=row['event'],
-                model_used=row['model_used'],
-                predicted_delay=row['predicted_delay'],
-                predicted_risk=row['predicted_risk'],
-                predicted_probability=row['predicted_probability'],
-                actual_delay=row['actual_delay'],
-                actual_risk=row['actual_risk'],
-                timestamp=row['timestamp']
-            )
-            for row in rows
-        ]
-        
-        return records, total
+        rows, total = self.get_history_rows(limit, offset, model_filter, transport_filter, day_filter)
+        return [PredictionRecord(**row) for row in rows], total
+
+    @staticmethod
+    def _history_filters(model_filter, transport_filter, day_filter) -> tuple[str, list]:
+        """WHERE clause (after 'WHERE 1=1') and parameters of the history filters."""
+        where, params = '', []
+        for column, value in (('model_used', model_filter), ('transport_type', transport_filter), ('day', day_filter)):
+            if value:
+                where += f' AND {column} = ?'
+                params.append(value)
+        return where, params
+
+    @timed_db
+    def get_history_rows(
+        self,
+        limit: int = 100,
+        offset: int = 0,
+        model_filter: Optional[str] = None,
+        transport_filter: Optional[str] = None,
+        day_filter: Optional[str] = None,
+        after: Optional[tuple] = None,
+        count: bool = True
+    ) -> tuple[List[dict], Optional[int]]:
+        """Same as get_history, as plain dicts ready to be serialized (no PredictionRecord objects).
+
+        Rows are ordered by (timestamp, id) descending. `after` is the (timestamp, id)
+        of the last row of the previous page (keyset pagination: an index range read,
+        whatever the depth, unlike `offset`). With count=False the total is not
+        computed and None is returned instead.
+        """
+        where, params = self._history_filters(model_filter, transport_filter, day_filter)
+        
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # plain tuples, zipped with the column names
+
+            total = None
+            if count:
+                cursor.execute('SELECT COUNT(*) FROM predictions WHERE 1=1' + where, params)
+                total = cursor.fetchone()[0]
+
+            # Get paginated results
+            query = f'SELECT {", ".join(PREDICTION_COLUMNS)} FROM predictions WHERE 1=1' + where
+            if after is not None:
+                query += ' AND (timestamp, id) < (?, ?)'
+                params = params + list(after)
+            query += ' ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?'
+
+            cursor.execute(query, params + [limit, offset])
+            rows = [dict(zip(PREDICTION_COLUMNS, row)) for row in cursor.fetchall()]
+
+        return rows, total
+
+    @timed_db
+    def estimate_history_count(
+        self,
+        model_filter: Optional[str] = None,
+        transport_filter: Optional[str] = None,
+        day_filter: Optional[str] = None,
+        sample: int = HISTORY_ESTIMATE_SAMPLE
+    ) -> tuple[int, bool]:
+        """Number of history rows matching the filters, without counting them: (total, exact).
+
+        The per-model total comes from model_aggregates (exact). The share matching the
+        transport/day filters is measured on the `sample` most recent rows of that model
+        and extrapolated; it is exact when the model has no more rows than the sample.
+        """
+        with self.connections.reader() as conn:
+            if model_filter:
+                row = conn.execute(
+                    'SELECT total_predictions FROM model_aggregates WHERE model_used = ?', (model_filter,)
+                ).fetchone()
+                base = row[0] if row else 0
+            else:
+                base = conn.execute('SELECT COALESCE(SUM(total_predictions), 0) FROM model_aggregates').fetchone()[0]
+            if not (transport_filter or day_filter) or base == 0:
+                return base, True
+
+            model_where, model_params = self._history_filters(model_filter, None, None)
+            match_where, match_params = self._history_filters(None, transport_filter, day_filter)
+            sampled, matched = conn.execute(f'''
+                SELECT COUNT(*), COALESCE(SUM(1=1{match_where}), 0) FROM (
+                    SELECT transport_type, day FROM predictions WHERE 1=1{model_where}
+                    ORDER BY timestamp DESC LIMIT ?
+                )
+            ''', match_params + model_params + [sample]).fetchone()
+
+        if sampled < sample:
+            return matched, True
+        return round(base * matched / sampled), False
     
+    @timed_db
     def get_model_statistics(self, model_name: Optional[str] = None) -> dict:
-        """Get statistics for model(s)."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if model_name:
-            # Stats for specific model
-            cursor.execute('''
-                SELECT 
-                    model_used,
-                    COUNT(*) as total_predictions,
-                    AVG(predicted_delay) as avg_predicted_delay,
-                    MIN(predicted_delay) as min_predicted_delay,
-                    MAX(predicted_delay) as max_predicted_delay,
-                    AVG(predicted_probability) as avg_confidence,
-                    COUNT(CASE WHEN actual_delay IS NOT NULL THEN 1 END) as verified_predictions
-                FROM predictions
-                WHERE model_used = ?
-                GROUP BY model_used
-            ''', (model_name,))
-        else:
-            # Stats for all models
-            cursor.execute('''
-                SELECT 
-                    model_used,
-                    COUNT(*) as total_predictions,
-                    AVG(predicted_delay) as avg_predicted_delay,
-                    MIN(predicted_delay) as min_predicted_delay,
-                    MAX(predicted_delay) as max_predicted_delay,
-                    AVG(predicted_probability) as avg_confidence,
-                    COUNT(CASE WHEN actual_delay IS NOT NULL THEN 1 END) as verified_predictions
-                FROM predictions
-                GROUP BY model_used
-            ''')
-        
-        rows = cursor.fetchall()
-        conn.close()
+        """Get statistics for model(s), from the model_aggregates table."""
+        with self.connections.reader() as conn:
+            if model_name:
+                # Stats for specific model
+                rows = conn.execute('SELECT * FROM model_aggregates WHERE model_used = ?', (model_name,)).fetchall()
+            else:
+                # Stats for all models
+                rows = conn.execute('SELECT * FROM model_aggregates').fetchall()
         
         stats = {}
         for row in rows:
             model = row['model_used']
+            total = row['total_predictions']
+            avg_delay = row['sum_predicted_delay'] / total
+            avg_confidence = row['sum_probability'] / total
             stats[model] = {
                 'model_used': model,
-                'total_predictions': row['total_predictions'],
-                'avg_predicted_delay': round(row['avg_predicted_delay'], 2) if row['avg_predicted_delay'] else 0,
+                'total_predictions': total,
+                'avg_predicted_delay': round(avg_delay, 2) if avg_delay else 0,
                 'min_predicted_delay': round(row['min_predicted_delay'], 2) if row['min_predicted_delay'] else 0,
                 'max_predicted_delay': round(row['max_predicted_delay'], 2) if row['max_predicted_delay'] else 0,
-                'avg_confidence': round(row['avg_confidence'], 4) if row['avg_confidence'] else 0,
+                'avg_confidence': round(avg_confidence, 4) if avg_confidence else 0,
                 'verified_predictions': row['verified_predictions']
             }
         
         return stats
     
+    @timed_db
     def get_model_comparison(self) -> dict:
-        """Get detailed comparison between all models."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        """Get detailed comparison between all models, from the aggregate tables."""
+        with self.connections.reader() as conn:
+            # Both tables read in one transaction (consistent with each other)
+            conn.execute('BEGIN')
+            usage_rows = conn.execute(
+                'SELECT model_used, total_predictions, sum_predicted_delay FROM model_aggregates'
+            ).fetchall()
+            risk_rows = conn.execute(
+                'SELECT model_used, predicted_risk, count, sum_probability FROM model_risk_aggregates'
+            ).fetchall()
         
         # Get usage stats
-        cursor.execute('''
-            SELECT 
-                model_used,
-                COUNT(*) as usage_count,
-                AVG(predicted_delay) as avg_delay
-            FROM predictions
-            GROUP BY model_used
-        ''')
-        
         stats = {}
-        for row in cursor.fetchall():
+        for row in usage_rows:
             model = row['model_used']
+            avg_delay = row['sum_predicted_delay'] / row['total_predictions']
             stats[model] = {
-                'usage_count': row['usage_count'],
-                'avg_delay': round(row['avg_delay'], 2) if row['avg_delay'] else 0
+                'usage_count': row['total_predictions'],
+                'avg_delay': round(avg_delay, 2) if avg_delay else 0
             }
         
         # Get performance by risk level
-        cursor.execute('''
-            SELECT 
-                model_used,
-                predicted_risk,
-                COUNT(*) as count,
-                AVG(predicted_probability) as avg_confidence
-            FROM predictions
-            GROUP BY model_used, predicted_risk
-        ''')
-        
         risk_analysis = {}
-        for row in cursor.fetchall():
+        for row in risk_rows:
             model = row['model_used']
             risk = row['predicted_risk']
             if model not in risk_analysis:
                 risk_analysis[model] = {}
             risk_analysis[model][risk] = {
                 'count': row['count'],
-                'avg_confidence': round(row['avg_confidence'], 4)
+                'avg_confidence': round(row['sum_probability'] / row['count'], 4)
             }
         
-        conn.close()
-        
         return {
             'statistics': stats,
             'risk_analysis': risk_analysis,
             'timestamp': datetime.now().isoformat()
         }
+
+    @timed_db
+    def rebuild_aggregates(self):
+        """Recompute the aggregate tables from the full history (single transaction)."""
+        with self.connections.writer() as conn:
+            for statement in split_statements(REBUILD_AGGREGATES):
+                conn.execute(statement)
+
+    @timed_db
+    def check_aggregates(self, repair: bool = False, tolerance: float = 1e-6) -> dict:
+        """Compare the aggregate tables with a full recomputation; optionally rebuild them.
+
+        Sums are compared with a relative tolerance (floating point drift of the
+        incremental additions and subtractions).
+        """
+        with self.connections.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            # Both reads in one transaction: consistent snapshot of history and aggregates
+            cursor.execute('BEGIN')
+            expected = {
+                'model_aggregates': {row[0]: row[1:] for row in cursor.execute(MODEL_AGGREGATES_QUERY)},
+                'model_risk_aggregates': {row[:2]: row[2:] for row in cursor.execute(RISK_AGGREGATES_QUERY)},
+            }
+            actual = {
+                'model_aggregates': {row[0]: row[1:] for row in cursor.execute('SELECT * FROM model_aggregates')},
+                'model_risk_aggregates': {
+                    row[:2]: row[2:] for row in cursor.execute('SELECT * FROM model_risk_aggregates')
+                },
+            }
+
+        def same(a, b):
+            return a == b or (a is not None and b is not None and abs(a - b) <= tolerance * max(1.0, abs(a), abs(b)))
+
+        mismatches = []
+        for table in expected:
+            for key in expected[table].keys() | actual[table].keys():
+                exp, act = expected[table].get(key), actual[table].get(key)
+                if exp is None or act is None or not all(same(e, a) for e, a in zip(exp, act)):
+                    mismatches.append({'table': table, 'key': list(key) if isinstance(key, tuple) else key,
+                                       'expected': exp, 'actual': act})
+
+        if mismatches and repair:
+            self.rebuild_aggregates()
+        return {'consistent': not mismatches, 'mismatches': mismatches, 'repaired': bool(mismatches and repair)}
     
+    @timed_db
     def update_actual_delay(self, prediction_id: int, actual_delay: float, actual_risk: str):
         """Update a prediction with actual delay data."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE predictions
-            SET actual_delay = ?, actual_risk = ?
-            WHERE id = ?
-        ''', (actual_delay, actual_risk, prediction_id))
-        
-        conn.commit()
-        conn.close()
+        with self.connections.writer() as conn:
+            conn.execute('''
+                UPDATE predictions
+                SET actual_delay = ?, actual_risk = ?
+                WHERE id = ?
+            ''', (actual_delay, actual_risk, prediction_id))
     
-    def export_to_csv(self, filename: str = "predictions_export.csv"):
-        """Export all predictions to CSV."""
-        import csv
-        
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM predictions ORDER BY timestamp DESC')
-        rows = cursor.fetchall()
-        conn.close()
-        
-        if not rows:
+    def iter_history_chunks(
+        self,
+        chunk_size: int = EXPORT_CHUNK_ROWS,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        model_filter: Optional[str] = None
+    ) -> Iterator[List[tuple]]:
+        """Predictions as lists of at most `chunk_size` EXPORT_COLUMNS tuples, newest first.
+
+        date_from (inclusive) and date_to (exclusive) are compared with the ISO
+        timestamps. Rows are read with fetchmany on a dedicated connection, from a
+        single snapshot of the table: memory stays bounded whatever its size.
+        """
+        where, params = self._history_filters(model_filter, None, None)
+        if date_from:
+            where += ' AND timestamp >= ?'
+            params.append(date_from)
+        if date_to:
+            where += ' AND timestamp < ?'
+            params.append(date_to)
+
+        with self.connections.dedicated_reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(
+                f'SELECT {", ".join(EXPORT_COLUMNS)} FROM predictions WHERE 1=1{where} '
+                'ORDER BY timestamp DESC, id DESC', params
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    @timed_db
+    def export_to_csv(self, filename: str = "predictions_export.csv", **filters):
+        """Export predictions to CSV (streamed in chunks; see iter_history_chunks for the filters)."""
+        from history_export import iter_export
+
+        chunks = self.iter_history_chunks(**filters)
+        first = next(chunks, None)
+        if first is None:
             return False
-        
-        with open(filename, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=[description[0] for description in cursor.description])
-            writer.writeheader()
-            for row in rows:
-                writer.writerow(dict(row))
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, 'wb') as f:
+            for data in iter_export(itertools.chain([first], chunks), EXPORT_COLUMNS, 'csv'):
+                f.write(data)
         
         return True
     
+    @timed_db
     def clear_old_predictions(self, days: int = 30):
         """Clear predictions older than specified days."""
         from datetime import timedelta, datetime
         
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         cutoff_date = (datetime.now() - timedelta(days=days)).isoformat()
-        cursor.execute(
-            'DELETE FROM predictions WHERE timestamp < ?',
-            (cutoff_date,)
-        )
-        
-        deleted = cursor.rowcount
-        conn.commit()
-        conn.close()
+        with self.connections.writer() as conn:
+            cursor = conn.execute(
+                'DELETE FROM predictions WHERE timestamp < ?',
+                (cutoff_date,)
+            )
         
-        return deleted
+        return cursor.rowcount
 
 
 # Initialize global database instance
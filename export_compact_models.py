@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Export des modèles à arbres dans une représentation compacte (tree_compiler.py)
+
+Seuils float32, indices de features sur un octet, feuilles quantifiées à une tolérance
+près, dans des fichiers .npz non compressés (chargeables en mmap par l'API avec
+COMPACT_MODELS=1). Le script mesure la mémoire économisée et l'écart de précision par
+rapport à results/model_comparison.csv.
+
+Usage: python export_compact_models.py [--tolerance 0.01] [--version <version>]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import train_test_split
+
+from model_registry import COMPACT_DIR, ModelRegistry
+from tree_compiler import compile_model
+
+COMPARISON_PATH = "./results/model_comparison.csv"
+DATA_PATH = "./data/processed/clean_data.csv"
+REPORT_PATH = "./results/compact_models.csv"
+
+# Noms des lignes de results/model_comparison.csv
+COMPARISON_NAMES = {
+    'random_forest': 'Random Forest',
+    'linear_regression': 'Linear Regression',
+    'xgboost': 'XGBoost',
+}
+
+# Mesure du RSS ajouté par le chargement d'un modèle, dans un processus neuf
+# (bibliothèques importées avant la première mesure pour ne compter que le modèle)
+RSS_SNIPPET = """
+import sys, joblib, numpy, sklearn.ensemble, xgboost
+from tree_compiler import CompiledTreeEnsemble
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096
+path, mmap = sys.argv[1], sys.argv[2] == '1'
+before = rss()
+model = CompiledTreeEnsemble.load(path, mmap_mode='r' if mmap else None) if path.endswith('.npz') else joblib.load(path)
+print(rss() - before)
+"""
+
+
+def model_directory(registry: ModelRegistry, version):
+    """Répertoire des modèles: version du registre (live par défaut) ou models/*.pkl"""
+    version = version or registry.live_version()
+    if version is not None:
+        return registry.version_dir(version), version
+    return registry.root, None
+
+
+def rss_delta(path: str, mmap: bool = False):
+    """RSS ajouté par le chargement du fichier (None si indisponible, ex: hors Linux)"""
+    if not os.path.exists("/proc/self/statm"):
+        return None
+    result = subprocess.run(
+        [sys.executable, "-c", RSS_SNIPPET, path, "1" if mmap else "0"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return int(result.stdout.strip()) if result.returncode == 0 else None
+
+
+def evaluation_data(directory: str):
+    """Jeu de test de train_model.py (même découpage), ou None sans les données d'origine"""
+    if not os.path.exists(DATA_PATH):
+        return None
+
+    from train_model import load_and_prepare_data
+
+    df, feature_cols, _ = load_and_prepare_data()
+    info_path = os.path.join(directory, "feature_info.pkl")
+    if os.path.exists(info_path):
+        feature_cols = joblib.load(info_path)['feature_columns']
+    X = df[feature_cols]
+    y = df['delay_minutes']
+    _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    return X_test.to_numpy(dtype=np.float32), y_test.to_numpy()
+
+
+def scores(y_true, y_pred) -> dict:
+    return {
+        'RMSE': float(np.sqrt(mean_squared_error(y_true, y_pred))),
+        'MAE': float(mean_absolute_error(y_true, y_pred)),
+        'R²': float(r2_score(y_true, y_pred)),
+    }
+
+
+def export_compact_models(tolerance: float = 0.01, version=None, measure_rss: bool = True):
+    registry = ModelRegistry()
+    directory, version = model_directory(registry, version)
+    output_dir = os.path.join(directory, COMPACT_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"📦 Export compact des modèles de {directory} (tolérance {tolerance})")
+
+    evaluation = evaluation_data(directory)
+    if evaluation is None:
+        print(f"⚠️ {DATA_PATH} introuvable: écart mesuré sur des entrées aléatoires, sans comparaison aux scores de référence")
+    reference = pd.read_csv(COMPARISON_PATH, index_col=0) if os.path.exists(COMPARISON_PATH) else None
+
+    rows = []
+    for name in ('random_forest', 'xgboost'):
+        model_path = os.path.join(directory, f"{name}.pkl")
+        if not os.path.exists(model_path):
+            print(f"⚠️ Modèle {name} non trouvé: {model_path}")
+            continue
+
+        model = joblib.load(model_path)
+        compiled = compile_model(model)
+        if compiled is None:
+            print(f"⚠️ {name}: type de modèle non compilable ({type(model).__name__})")
+            continue
+        compact = compiled.compact(tolerance)
+        compact_path = os.path.join(output_dir, f"{name}.npz")
+        compact.save(compact_path)
+
+        if evaluation is not None:
+            X_test, y_test = evaluation
+        else:
+            X_test = np.random.default_rng(42).integers(0, 24, (10000, model.n_features_in_)).astype(np.float32)
+            y_test = None
+        original_pred = model.predict(X_test)
+        compact_pred = compact.predict(X_test)
+
+        row = {
+            'model': name,
+            'nodes': compact.n_nodes,
+            'original_file_bytes': os.path.getsize(model_path),
+            'compact_file_bytes': os.path.getsize(compact_path),
+            'compiled_float64_bytes': compiled.nbytes,
+            'compact_bytes': compact.nbytes,
+            'max_abs_diff': float(np.abs(compact_pred - original_pred).max()),
+        }
+        if measure_rss:
+            row['original_rss_bytes'] = rss_delta(model_path)
+            row['compact_rss_bytes'] = rss_delta(compact_path)
+            row['compact_mmap_rss_bytes'] = rss_delta(compact_path, mmap=True)
+
+        if y_test is not None:
+            compact_scores = scores(y_test, compact_pred)
+            row.update({f"compact_{k}": v for k, v in compact_scores.items()})
+            if reference is not None and COMPARISON_NAMES[name] in reference.index:
+                for metric, value in compact_scores.items():
+                    row[f"delta_{metric}"] = value - float(reference.loc[COMPARISON_NAMES[name], metric])
+
+        rows.append(row)
+        print(f"\n{name}: {compact.n_trees} arbres, {compact.n_nodes} nœuds -> {compact_path}")
+        print(f"  • Fichier: {row['original_file_bytes'] / 1e6:.1f} Mo -> {row['compact_file_bytes'] / 1e6:.1f} Mo")
+        print(f"  • Tableaux: {compiled.nbytes / 1e6:.1f} Mo (float64) -> {compact.nbytes / 1e6:.1f} Mo")
+        if row.get('original_rss_bytes') is not None:
+            print(f"  • RSS: {row['original_rss_bytes'] / 1e6:.1f} Mo -> {row['compact_rss_bytes'] / 1e6:.1f} Mo"
+                  f" ({row['compact_mmap_rss_bytes'] / 1e6:.1f} Mo en mmap avant usage)")
+        print(f"  • Écart max avec le modèle d'origine: {row['max_abs_diff']:.5f} min")
+        if 'delta_RMSE' in row:
+            print(f"  • RMSE {row['compact_RMSE']:.4f} (Δ {row['delta_RMSE']:+.5f}) | MAE {row['compact_MAE']:.4f}"
+                  f" (Δ {row['delta_MAE']:+.5f}) | R² {row['compact_R²']:.4f} (Δ {row['delta_R²']:+.5f})")
+
+    if rows:
+        os.makedirs(os.path.dirname(REPORT_PATH), exist_ok=True)
+        pd.DataFrame(rows).to_csv(REPORT_PATH, index=False)
+        with open(os.path.join(output_dir, "report.json"), "w", encoding="utf-8") as f:
+            json.dump({"tolerance": tolerance, "version": version, "models": rows}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Rapport: {REPORT_PATH}")
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export compact des modèles à arbres")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Écart maximal des prédictions (minutes)")
+    parser.add_argument("--version", default=None, help="Version du registre (par défaut: version live, sinon models/*.pkl)")
+    parser.add_argument("--no-rss", action="store_true", help="Ne pas mesurer le RSS dans des processus séparés")
+    args = parser.parse_args()
+    export_compact_models(args.tolerance, args.version, measure_rss=not args.no_rss)
@@ -0,0 +1,46 @@
+"""
+Fast JSON responses for the high-volume endpoints (/predict, /history, /comparison).
+
+Returning a Response directly skips FastAPI's jsonable_encoder pass over the
+payload; the body is then encoded with orjson when it is installed (numpy scalars
+and arrays included), and with the standard json module otherwise.
+"""
+import json
+from datetime import datetime
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional dependency (requirements_api.txt)
+    orjson = None
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, option=_OPTIONS)
+else:
+    def dumps(content: Any) -> bytes:
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+                          default=_default).encode("utf-8")
+
+
+def _default(value):
+    # numpy scalars and arrays, for the json fallback
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def now_iso() -> str:
+    """Local timestamp in ISO format (same format as the stored prediction timestamps)."""
+    return datetime.now().isoformat()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (if available)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,185 @@
+"""
+Fitted feature transformer shared by training (train_model.py) and serving (api.py).
+
+The transformer holds the category vocabularies and the feature column order used
+when the models were trained, and encodes prediction requests into a float32 matrix.
+"""
+import os
+from typing import Dict, Optional, Sequence
+
+import joblib
+import numpy as np
+
+# Saved next to models/feature_info.pkl
+TRANSFORMER_PATH = "./models/feature_transformer.pkl"
+
+# Request fields (see api.PredictionRequest)
+REQUEST_FIELDS = ['TransportType', 'Line', 'Hour', 'Day', 'Weather', 'Event']
+
+DAY_MAPPING = {'Lundi': 0, 'Mardi': 1, 'Mercredi': 2, 'Jeudi': 3, 'Vendredi': 4, 'Samedi': 5, 'Dimanche': 6}
+
+# Vocabularies used when no fitted transformer is available (models trained before
+# the transformer existed). They reproduce the historical hard-coded API mappings.
+DEFAULT_VOCABULARIES = {
+    'TransportType': ['Bus', 'Metro', 'Train'],
+    'Line': ['Line1', 'Line2', 'Line3', 'Line4', 'Line5'],
+    'Status': ['OnTime', 'Delayed'],
+    'IncidentCause': ['None', 'Traffic', 'Weather', 'Planned'],
+    'Weather': ['Pluie', 'Soleil', 'TempsNormal'],
+    'Event': ['Non', 'Oui'],
+}
+
+# Status is not part of a request: predictions assume a delayed service
+SERVING_STATUS = 'Delayed'
+
+
+def _derived_column(name: str, columns: Dict[str, np.ndarray], n: int) -> Optional[np.ndarray]:
+    """Values of a training column that is not sent by clients but derived from the request."""
+    if name == 'Status':
+        return np.full(n, SERVING_STATUS, dtype=object)
+    if name == 'IncidentCause':
+        weather = columns['Weather']
+        event = columns['Event']
+        return np.where(weather == 'Pluie', 'Weather', np.where(event == 'Oui', 'Planned', 'Traffic'))
+    return None
+
+
+def _derived_value(name: str, values: dict):
+    """Single-row counterpart of _derived_column."""
+    if name == 'Status':
+        return SERVING_STATUS
+    if name == 'IncidentCause':
+        if values['Weather'] == 'Pluie':
+            return 'Weather'
+        if values['Event'] == 'Oui':
+            return 'Planned'
+        return 'Traffic'
+    return None
+
+
+class FeatureTransformer:
+    """Encodes prediction requests into the feature matrix expected by the models."""
+
+    def __init__(self, feature_columns: Sequence[str], vocabularies: Optional[Dict[str, Sequence[str]]] = None):
+        self.feature_columns = list(feature_columns)
+        self.vocabularies = {name: [str(v) for v in vocab] for name, vocab in (vocabularies or DEFAULT_VOCABULARIES).items()}
+        self._compile()
+
+    def _compile(self):
+        """Resolve, once, how each feature column is computed from a request."""
+        self._index = {name: {value: code for code, value in enumerate(vocab)} for name, vocab in self.vocabularies.items()}
+        self._index['Day'] = DAY_MAPPING
+
+        self._plan = []
+        for col in self.feature_columns:
+            if col in ('hour', 'Hour'):
+                self._plan.append(('numeric', 'Hour', None))
+            elif col in ('day_of_week', 'dayofweek'):
+                self._plan.append(('category', 'Day', None))
+            elif col.endswith('_encoded') and col[:-len('_encoded')] in self._index:
+                self._plan.append(('category', col[:-len('_encoded')], None))
+            elif '_' in col and col.split('_', 1)[0] in self._index:
+                # Colonnes one-hot (ex: Weather_Pluie)
+                name, value = col.split('_', 1)
+                self._plan.append(('onehot', name, value))
+            else:
+                self._plan.append(('constant', None, 0.0))
+
+    # ------------------------------------------------------------------ fitting
+
+    @classmethod
+    def fit(cls, df, categorical_cols: Sequence[str], feature_columns: Sequence[str] = ()) -> 'FeatureTransformer':
+        """Learn one vocabulary per categorical column (sorted, like LabelEncoder)."""
+        vocabularies = dict(DEFAULT_VOCABULARIES)
+        for col in categorical_cols:
+            if col in df.columns:
+                vocabularies[col] = sorted(df[col].astype(str).unique())
+        return cls(feature_columns, vocabularies)
+
+    def encode_frame(self, df):
+        """Add the `<col>_encoded` and `day_of_week` training columns to a DataFrame."""
+        df = df.copy()
+        for name, index in self._index.items():
+            if name == 'Day':
+                if 'Day' in df.columns:
+                    df['day_of_week'] = df['Day'].map(DAY_MAPPING).fillna(0)
+            elif name in df.columns:
+                df[f'{name}_encoded'] = df[name].astype(str).map(index).fillna(0).astype(int)
+        return df
+
+    # ---------------------------------------------------------------- encoding
+
+    def encode(self, name: str, values, unknown: int = 0) -> np.ndarray:
+        """Map an array of category values to their integer codes."""
+        values = np.asarray(values, dtype=object)
+        uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+        index = self._index[name]
+        lookup = np.fromiter((index.get(v, unknown) for v in uniques), dtype=np.int64, count=len(uniques))
+        return lookup[inverse.reshape(-1)]
+
+    def transform_columns(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Encode request columns (one array per request field) into a float32 matrix."""
+        n = len(columns['Hour'])
+        X = np.empty((n, len(self.feature_columns)), dtype=np.float32)
+        codes = {}
+
+        for j, (kind, name, arg) in enumerate(self._plan):
+            if kind == 'numeric':
+                X[:, j] = columns[name]
+            elif kind == 'constant':
+                X[:, j] = arg
+            else:
+                if name not in codes:
+                    values = columns.get(name)
+                    if values is None:
+                        values = _derived_column(name, columns, n)
+                    codes[name] = self.encode(name, values) if values is not None else np.zeros(n, dtype=np.int64)
+                if kind == 'category':
+                    X[:, j] = codes[name]
+                else:
+                    X[:, j] = codes[name] == self._index[name].get(arg, -1)
+
+        return X
+
+    def transform(self, records: Sequence) -> np.ndarray:
+        """Encode a sequence of requests (pydantic models or dicts) into a float32 matrix."""
+        if records and isinstance(records[0], dict):
+            columns = {f: np.array([r[f] for r in records], dtype=object) for f in REQUEST_FIELDS}
+        else:
+            columns = {f: np.array([getattr(r, f) for r in records], dtype=object) for f in REQUEST_FIELDS}
+        columns['Hour'] = columns['Hour'].astype(np.float32)
+        return self.transform_columns(columns)
+
+    def transform_one(self, record) -> np.ndarray:
+        """Fast path for a single request: plain dict lookups into a 1-row matrix."""
+        values = record if isinstance(record, dict) else {f: getattr(record, f) for f in REQUEST_FIELDS}
+        X = np.empty((1, len(self.feature_columns)), dtype=np.float32)
+
+        for j, (kind, name, arg) in enumerate(self._plan):
+            if kind == 'numeric':
+                X[0, j] = values[name]
+            elif kind == 'constant':
+                X[0, j] = arg
+            else:
+                value = values.get(name)
+                if value is None:
+                    value = _derived_value(name, values)
+                code = self._index[name].get(str(value), 0)
+                X[0, j] = code if kind == 'category' else code == self._index[name].get(arg, -1)
+
+        return X
+
+    # ------------------------------------------------------------- persistence
+
+    def to_dict(self) -> dict:
+        return {'feature_columns': self.feature_columns, 'vocabularies': self.vocabularies}
+
+    def save(self, path: str = TRANSFORMER_PATH):
+        """Persist the transformer as a plain dict (robust to code changes)."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        joblib.dump(self.to_dict(), path)
+
+    @classmethod
+    def load(cls, path: str = TRANSFORMER_PATH) -> 'FeatureTransformer':
+        state = joblib.load(path)
+        return cls(state['feature_columns'], state['vocabularies'])
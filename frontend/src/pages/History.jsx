@@ -13,6 +13,10 @@ const History = () => {
     limit: 50
   });
   const [total, setTotal] = useState(0);
+  const [totalExact, setTotalExact] = useState(true);
+  // Curseur de chaque page visitée (pagination par curseur de l'API), page suivante
+  const [cursors, setCursors] = useState([null]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [expandedId, setExpandedId] = useState(null);
   const [searchTerm, setSearchTerm] = useState('');
 
@@ -26,9 +30,11 @@ const History = () => {
       setLoading(true);
       setError(null);
 
+      // Total estimé sur la première page seulement, pages suivantes par curseur
+      const cursor = cursors[filters.page];
       const params = new URLSearchParams({
         limit: filters.limit,
-        offset: filters.page * filters.limit,
+        ...(cursor ? { cursor } : { total: 'estimate' }),
         ...(filters.model_filter && { model_filter: filters.model_filter }),
         ...(filters.transport_filter && { transport_filter: filters.transport_filter }),
         ...(filters.day_filter && { day_filter: filters.day_filter })
@@ -39,7 +45,11 @@ const History = () => {
 
       const data = await response.json();
       setPredictions(data.predictions || []);
-      setTotal(data.total || 0);
+      setNextCursor(data.next_cursor || null);
+      if (data.total !== null && data.total !== undefined) {
+        setTotal(data.total);
+        setTotalExact(data.total_exact !== false);
+      }
     } catch (err) {
       setError(err.message);
       console.error('Erreur:', err);
@@ -49,6 +59,7 @@ const History = () => {
   };
 
   const handleFilterChange = (field, value) => {
+    setCursors([null]);
     setFilters(prev => ({
       ...prev,
       [field]: value,
@@ -57,23 +68,24 @@ const History = () => {
   };
 
   const handlePageChange = (direction) => {
-    const maxPage = Math.ceil(total / filters.limit) - 1;
-    let newPage = filters.page + direction;
-    newPage = Math.max(0, Math.min(newPage, maxPage));
-    setFilters(prev => ({ ...prev, page: newPage }));
+    if (direction > 0) {
+      if (!nextCursor) return;
+      setCursors(prev => [...prev.slice(0, filters.page + 1), nextCursor]);
+    } else if (filters.page === 0) {
+      return;
+    }
+    setFilters(prev => ({ ...prev, page: prev.page + direction }));
   };
 
-  const handleExport = async () => {
-    try {
-      const response = await fetch('http://localhost:8000/history/export/csv', {
-        method: 'POST'
-      });
-      if (!response.ok) throw new Error('Erreur lors de l\'export');
+  const pageCount = Math.max(Math.ceil(total / filters.limit), filters.page + (nextCursor ? 2 : 1));
 
-      alert('Export réussi! Fichier sauvegardé: predictions_export.csv');
-    } catch (err) {
-      alert('Erreur lors de l\'export: ' + err.message);
-    }
+  const handleExport = () => {
+    // Téléchargement en flux (CSV compressé), filtré sur le modèle sélectionné
+    const params = new URLSearchParams({
+      format: 'csv.gz',
+      ...(filters.model_filter && { model_filter: filters.model_filter })
+    });
+    window.location.href = `http://localhost:8000/history/export?${params}`;
   };
 
   const handleCleanup = async () => {
@@ -174,7 +186,7 @@ const History = () => {
             <FaHistory className="w-8 h-8" />
             <h1 className="text-3xl font-bold">Historique des Prédictions</h1>
           </div>
-          <p className="text-blue-100">Total: <span className="font-bold text-xl">{total}</span> prédictions</p>
+          <p className="text-blue-100">Total: <span className="font-bold text-xl">{totalExact ? '' : '≈ '}{total}</span> prédictions</p>
         </div>
 
         {/* Barres de contrôle et filtres */}
@@ -232,7 +244,7 @@ const History = () => {
 
           {/* Affichage de la page actuelle */}
           <div className="text-sm text-gray-600">
-            Page {filters.page + 1} de {Math.ceil(total / filters.limit) || 1}
+            Page {filters.page + 1} de {pageCount}
           </div>
         </div>
 
@@ -346,7 +358,7 @@ const History = () => {
         )}
 
         {/* Pagination */}
-        {Math.ceil(total / filters.limit) > 1 && (
+        {(filters.page > 0 || nextCursor) && (
           <div className="flex items-center justify-between bg-white p-4 rounded-lg shadow-md">
             <button
               onClick={() => handlePageChange(-1)}
@@ -356,11 +368,11 @@ const History = () => {
               ← Précédent
             </button>
             <span className="text-gray-700 font-medium">
-              Page {filters.page + 1} / {Math.ceil(total / filters.limit)}
+              Page {filters.page + 1} / {pageCount}
             </span>
             <button
               onClick={() => handlePageChange(1)}
-              disabled={filters.page >= Math.ceil(total / filters.limit) - 1}
+              disabled={!nextCursor}
               className="px-4 py-2 bg-gray-300 text-gray-700 rounded-lg hover:bg-gray-400 disabled:opacity-50 disabled:cursor-not-allowed"
             >
               Suivant →
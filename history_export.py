@@ -0,0 +1,142 @@
+"""
+Streaming export of the prediction history (GET /history/export).
+
+Chunks of rows (Database.iter_history_chunks) are encoded one at a time into CSV,
+gzip-compressed CSV, Parquet (one row group per chunk) or Arrow IPC stream bytes,
+which are yielded as soon as they are produced; memory use depends on the chunk
+size only, never on the number of rows exported. The columnar formats need pyarrow,
+imported on the first columnar export only (it adds tens of MB to every worker).
+"""
+import csv
+import importlib.util
+import io
+import zlib
+from typing import Iterable, Iterator, List, Sequence
+
+# format -> (media type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),  # charset=utf-8 added by the response
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# Compression of the columnar formats (column chunks for Parquet, record batches for Arrow)
+COLUMNAR_COMPRESSION = 'zstd'
+
+# Column types of the columnar formats (other columns are strings)
+_COLUMN_TYPES = {
+    'id': 'int64',
+    'hour': 'int64',
+    'predicted_delay': 'float64',
+    'predicted_probability': 'float64',
+    'actual_delay': 'float64',
+}
+
+
+class ExportFormatError(ValueError):
+    """Raised for an unknown export format or a missing optional dependency."""
+
+
+def check_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise ExportFormatError(f"Format d'export inconnu: {fmt} ({', '.join(EXPORT_FORMATS)})")
+    if fmt in COLUMNAR_FORMATS and importlib.util.find_spec('pyarrow') is None:
+        raise ExportFormatError(f"Le format {fmt} nécessite pyarrow (pip install pyarrow)")
+
+
+def iter_csv(chunks: Iterable[List[tuple]], columns: Sequence[str]) -> Iterator[bytes]:
+    """UTF-8 CSV: the header line, then one piece per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_gzip(pieces: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Gzip stream (single member) of a sequence of byte pieces."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip header and trailer
+    for piece in pieces:
+        data = compressor.compress(piece)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _DrainableSink:
+    """Write-only file object whose content is taken out after each write by the exporter."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _schema(pa, columns: Sequence[str]):
+    return pa.schema([(name, getattr(pa, _COLUMN_TYPES.get(name, 'string'))()) for name in columns])
+
+
+def _record_batch(pa, rows: List[tuple], schema):
+    return pa.record_batch(
+        [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)], schema=schema
+    )
+
+
+def iter_columnar(chunks: Iterable[List[tuple]], columns: Sequence[str], fmt: str,
+                  compression: str = COLUMNAR_COMPRESSION) -> Iterator[bytes]:
+    """Parquet file or Arrow IPC stream, one row group / record batch per chunk."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _schema(pa, columns)
+    sink = _DrainableSink()
+    if fmt == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression=compression)
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+    try:
+        for rows in chunks:
+            writer.write_batch(_record_batch(pa, rows, schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def iter_export(chunks: Iterable[List[tuple]], columns: Sequence[str], fmt: str) -> Iterator[bytes]:
+    """Bytes of the export of `chunks` (lists of row tuples in `columns` order) in format `fmt`."""
+    check_format(fmt)
+    if fmt == 'csv':
+        return iter_csv(chunks, columns)
+    if fmt == 'csv.gz':
+        return iter_gzip(iter_csv(chunks, columns))
+    return iter_columnar(chunks, columns, fmt)
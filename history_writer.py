@@ -0,0 +1,231 @@
+"""
+Write-behind persistence of the prediction history.
+
+Requests put their PredictionRecord on a bounded in-memory queue and return at
+once; a background thread inserts the queued records with executemany and a single
+commit per group (group commit), flushing when `batch_size` rows are waiting or
+`flush_interval` seconds after the first one. Ids are handed out immediately from
+blocks reserved in the AUTOINCREMENT sequence, so clients get their final
+prediction_id before the row is written. Records not yet written can be read back
+with pending(); stop() writes everything still queued.
+"""
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from database import Database, PredictionRecord
+
+
+class HistoryWriter:
+    """Bounded queue of prediction records written in group commits by a background thread."""
+
+    def __init__(self, db: Database, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 0.05, id_block_size: int = 1000, max_retries: int = 3):
+        self.db = db
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.max_retries = max_retries
+
+        # Bounded by submit() (a full queue is reported to the caller, never waited on)
+        self._queue: "queue.Queue[Optional[PredictionRecord]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+        # Records accepted but not committed yet, by id (read back by pending())
+        self._pending: Dict[int, PredictionRecord] = {}
+        self._pending_changed = threading.Condition()
+
+        # Current id block [next_id, block_end] and the next one, reserved ahead by the writer thread
+        self._id_lock = threading.Lock()
+        self._next_id = 1
+        self._block_end = 0
+        self._spare_block: Optional[tuple] = None
+        self._refill = threading.Event()
+
+        self.enqueued = 0
+        self.written = 0
+        self.rejected = 0
+        self.no_ids = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms: Optional[float] = None
+
+    # ------------------------------------------------------------- lifecycle
+
+    def start(self):
+        if self._thread is None:
+            # First id block reserved here, not on the first request
+            if self._spare_block is None and self._next_id > self._block_end:
+                self._reserve_spare_block()
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Write every queued record, then stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    # ------------------------------------------------------------------- ids
+
+    def _take_ids(self, count: int) -> Optional[List[int]]:
+        """Ids from the reserved blocks, or None if they cannot cover `count`.
+
+        Never reserves itself: submit() runs on the event loop, and a reservation is a
+        write transaction that may wait for the database lock. The writer thread
+        reserves the next block ahead of time.
+        """
+        with self._id_lock:
+            available = self._block_end - self._next_id + 1
+            if self._spare_block is not None:
+                available += self._spare_block[1] - self._spare_block[0] + 1
+            if count > available:
+                self._refill.set()
+                return None
+            ids = []
+            while len(ids) < count:
+                if self._next_id > self._block_end:
+                    self._next_id, self._block_end = self._spare_block
+                    self._spare_block = None
+                take = min(count - len(ids), self._block_end - self._next_id + 1)
+                ids.extend(range(self._next_id, self._next_id + take))
+                self._next_id += take
+            if self._spare_block is None and self._block_end - self._next_id < self.id_block_size // 2:
+                self._refill.set()
+        return ids
+
+    def _reserve_spare_block(self):
+        self._refill.clear()
+        if self._spare_block is not None:
+            return  # a submission larger than both blocks: it was saved synchronously
+        block = self.db.reserve_prediction_ids(self.id_block_size)
+        with self._id_lock:
+            if self._spare_block is None:
+                self._spare_block = block
+
+    # --------------------------------------------------------------- records
+
+    def submit(self, records: List[PredictionRecord]) -> Optional[List[int]]:
+        """Assign ids and enqueue without waiting for the database.
+
+        Returns the ids, or None when the queue is full or the reserved ids do not cover
+        the records (the caller then saves synchronously, off the event loop).
+        """
+        if self._queue.qsize() + len(records) > self.max_queue:
+            self.rejected += len(records)
+            return None
+        ids = self._take_ids(len(records))
+        if ids is None:
+            self.no_ids += len(records)
+            return None
+        with self._pending_changed:
+            for record, prediction_id in zip(records, ids):
+                record.id = prediction_id
+                self._pending[prediction_id] = record
+        for record in records:
+            self._queue.put(record)
+        self.enqueued += len(records)
+        return ids
+
+    def pending(self, prediction_id: int) -> Optional[PredictionRecord]:
+        """The record with this id if it is accepted but not yet written."""
+        with self._pending_changed:
+            return self._pending.get(prediction_id)
+
+    def wait_written(self, prediction_id: int, timeout: float = 5.0) -> bool:
+        """Block until the record with this id has been written (or failed); False on timeout."""
+        with self._pending_changed:
+            return self._pending_changed.wait_for(lambda: prediction_id not in self._pending, timeout)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Block until every record accepted so far has been written (or failed)."""
+        with self._pending_changed:
+            target = set(self._pending)
+            return self._pending_changed.wait_for(lambda: not target & self._pending.keys(), timeout)
+
+    # --------------------------------------------------------------- writer
+
+    def _run(self):
+        stop = False
+        while not stop:
+            if self._refill.is_set():
+                try:
+                    self._reserve_spare_block()
+                except Exception as e:
+                    print(f"⚠️ Réservation d'identifiants impossible: {e}")
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            # Group commit: wait up to flush_interval for more rows, at most batch_size
+            batch = [first]
+            deadline = time.perf_counter() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                # Shutdown: everything queued before the sentinel is written below
+                stop = True
+                batch = [r for r in batch if r is not None]
+                while True:
+                    try:
+                        record = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is not None:
+                        batch.append(record)
+            for start in range(0, len(batch), self.batch_size):
+                self._write(batch[start:start + self.batch_size])
+
+    def _write(self, records: List[PredictionRecord]):
+        if not records:
+            return
+        start = time.perf_counter()
+        for attempt in range(self.max_retries):
+            try:
+                self.db.insert_predictions(records)
+                self.written += len(records)
+                break
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    self.failed += len(records)
+                    print(f"❌ {len(records)} prédictions non sauvegardées: {e}")
+                else:
+                    time.sleep(0.1 * (attempt + 1))
+        self.flushes += 1
+        self.last_flush_ms = round((time.perf_counter() - start) * 1000, 3)
+        with self._pending_changed:
+            for record in records:
+                self._pending.pop(record.id, None)
+            self._pending_changed.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.running,
+            "queue_length": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "rejected": self.rejected,
+            "no_ids": self.no_ids,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "avg_batch": round(self.written / self.flushes, 1) if self.flushes else None,
+            "last_flush_ms": self.last_flush_ms,
+        }
@@ -0,0 +1,171 @@
+"""
+Bounded executor running model inference and blocking database calls off the event loop.
+
+Model predictions go to a thread pool or, optionally, to a process pool whose workers
+preload the models once. Other blocking calls (sqlite3, analytics) always run on the
+thread pool. Queue depth is bounded and every task has a timeout.
+"""
+import asyncio
+import functools
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import joblib
+
+from tree_compiler import CompiledTreeEnsemble
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the executor queue is full."""
+
+
+class InferenceTimeout(Exception):
+    """Raised when a task does not finish within the executor timeout."""
+
+
+# Models loaded in each worker process (process mode only)
+_worker_models = {}
+
+
+def _init_worker(model_paths: Dict[str, str]):
+    warnings.filterwarnings("ignore", message="X does not have valid feature names")
+    for name, path in model_paths.items():
+        if path.endswith(".npz"):
+            # Compact export: mapped read-only, pages shared by all worker processes
+            _worker_models[name] = CompiledTreeEnsemble.load(path, mmap_mode="r")
+        else:
+            _worker_models[name] = joblib.load(path)
+
+
+def _worker_predict(model_type: str, X):
+    return _worker_models[model_type].predict(X)
+
+
+class InferenceExecutor:
+    """Thread or process pool with bounded queue depth and per-task timeouts."""
+
+    def __init__(self, kind: str = "thread", max_workers: int = 4, max_queue: int = 64, timeout: float = 10.0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def start(self, model_paths: Optional[Dict[str, str]] = None):
+        """Create the pools; in process mode each worker loads `model_paths`."""
+        self._threads()
+        if self.kind == "process":
+            self._replace_process_pool(model_paths or {})
+
+    def reload_models(self, model_paths: Dict[str, str]):
+        """Replace the process pool so that workers load the new model files (once started)."""
+        if self.kind == "process" and self._process_pool is not None:
+            self._replace_process_pool(model_paths)
+
+    def _replace_process_pool(self, model_paths: Dict[str, str]):
+        old_pool = self._process_pool
+        self._process_pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=_init_worker,
+            initargs=(dict(model_paths),)
+        )
+        if old_pool is not None:
+            old_pool.shutdown(wait=False)
+
+    def _threads(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        return self._thread_pool
+
+    def shutdown(self):
+        for pool in (self._process_pool, self._thread_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        self._process_pool = None
+        self._thread_pool = None
+
+    # ----------------------------------------------------------------- tasks
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(
+                    f"File d'inférence pleine ({self._pending} tâches en attente, maximum {self.max_workers + self.max_queue})"
+                )
+            self._pending += 1
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+
+    def _tracked(self, fn: Callable, *args, **kwargs):
+        """Wrapper running in a pool thread, to count active workers."""
+        with self._lock:
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    async def _await(self, future):
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            future.cancel()
+            raise InferenceTimeout(f"Tâche d'inférence interrompue après {self.timeout} s")
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run a blocking callable on the thread pool."""
+        self._acquire()
+        future = self._threads().submit(self._tracked, functools.partial(fn, *args, **kwargs))
+        return await self._await(future)
+
+    async def predict(self, model_type: str, X, model=None):
+        """Run `predict` for one model: in a worker process if configured, otherwise on a thread."""
+        self._acquire()
+        if self._process_pool is not None:
+            future = self._process_pool.submit(_worker_predict, model_type, X)
+        else:
+            future = self._threads().submit(self._tracked, model.predict, X)
+        return await self._await(future)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            # Worker processes do not report activity: estimate it from pending tasks
+            active = self._active if self.kind == "thread" else min(pending, self.max_workers)
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "timeout_seconds": self.timeout,
+            "active_workers": active,
+            "queue_length": max(0, pending - active),
+            "pending": pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
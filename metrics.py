@@ -0,0 +1,258 @@
+"""
+Low-overhead in-process metrics, exposed in the Prometheus text format.
+
+Counters and histograms are plain Python objects updated under a lock; labelled
+series are created on first use. The registry renders every metric family on
+demand for GET /metrics.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Default latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Fixed-bucket histogram (cumulative counts, Prometheus style)."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def _cumulative(self) -> Tuple[list, float]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for c in counts:
+            running += c
+            cumulative.append(running)
+        return cumulative, total
+
+    def snapshot(self) -> dict:
+        cumulative, total = self._cumulative()
+        return {
+            'buckets': {**{str(le): n for le, n in zip(self.buckets, cumulative)}, '+Inf': cumulative[-1]},
+            'count': cumulative[-1],
+            'sum': round(total, 6),
+            'mean': round(total / cumulative[-1], 6) if cumulative[-1] else 0.0,
+        }
+
+    def samples(self, name: str, labels: str):
+        cumulative, total = self._cumulative()
+        sep = "," if labels else ""
+        for le, n in zip(self.buckets, cumulative):
+            yield f'{name}_bucket{{{labels}{sep}le="{_format_value(le)}"}} {n}'
+        yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {cumulative[-1]}'
+        yield f"{name}_sum{_braces(labels)} {_format_value(total)}"
+        yield f"{name}_count{_braces(labels)} {cumulative[-1]}"
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def samples(self, name: str, labels: str):
+        yield f"{name}{_braces(labels)} {_format_value(self._value)}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricFamily:
+    """A named metric with one child (Counter or Histogram) per combination of label values."""
+
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str] = (),
+                 factory: Optional[Callable[[], object]] = None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+        return child
+
+    def attach(self, child, *values):
+        """Expose an existing Counter/Histogram under the given label values."""
+        with self._lock:
+            self._children[values] = child
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for values, child in sorted(self._children.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, values))
+            yield from child.samples(self.name, labels)
+
+
+class GaugeFamily:
+    """Gauge whose values are read from a callback at scrape time (no bookkeeping on the hot path)."""
+
+    def __init__(self, name: str, help: str, callback: Callable[[], Dict[tuple, float]],
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in sorted(values.items()):
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, label_values))
+            yield f"{self.name}{_braces(labels)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    """Collection of metric families rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._families: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, family):
+        with self._lock:
+            existing = self._families.get(family.name)
+            if existing is not None:
+                return existing
+            self._families[family.name] = family
+            return family
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, help, "counter", labelnames, Counter))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> MetricFamily:
+        return self._register(MetricFamily(name, help, "histogram", labelnames, lambda: Histogram(buckets)))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], object],
+              labelnames: Sequence[str] = ()) -> GaugeFamily:
+        return self._register(GaugeFamily(name, help, callback, labelnames))
+
+    def render(self) -> str:
+        with self._lock:
+            families = list(self._families.values())
+        lines = []
+        for family in families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry (each worker of serve.py exposes its own)
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+HTTP_ERRORS = registry.counter(
+    "http_errors_total", "HTTP responses with a 4xx/5xx status", ("method", "route", "status"))
+PREDICT_STAGE_LATENCY = registry.histogram(
+    "predict_stage_duration_seconds", "Time spent in each stage of /predict", ("stage", "model_type"))
+PREDICTIONS = registry.counter(
+    "predictions_total", "Predictions served, by model and source (model, cube, cache)", ("model_type", "source"))
+DB_QUERY_LATENCY = registry.histogram(
+    "db_query_duration_seconds", "Database method latency", ("method",))
+DB_ERRORS = registry.counter(
+    "db_errors_total", "Database methods that raised", ("method",))
+
+# Start time of the current HTTP request (set by MetricsMiddleware)
+request_start: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_start", default=None)
+
+
+def timed_db(method):
+    """Decorator recording the latency (and failures) of a Database method."""
+    histogram = DB_QUERY_LATENCY.labels(method.__name__)
+    errors = DB_ERRORS.labels(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and errors per route template (bounded label set)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        token = request_start.set(start)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_start.reset(token)
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            labels = (scope["method"], route, str(status))
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - start)
+            if status >= 400:
+                HTTP_ERRORS.labels(*labels).inc()
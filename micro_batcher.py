@@ -0,0 +1,106 @@
+"""
+Dynamic micro-batching of concurrent single-row predictions.
+
+Rows are collected per model_type until the batch is full or the wait window
+expires, scored with one predict call and the results fanned back to the callers.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+import numpy as np
+
+from metrics import Histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+WAIT_MS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50)
+
+
+class MicroBatcher:
+    """Collects single-row predictions per model and scores them together."""
+
+    def __init__(self, predict_batch: Callable[[str, np.ndarray], Awaitable[np.ndarray]],
+                 max_batch_size: int = 32, max_wait_ms: float = 2.0):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queues: Dict[str, List[Tuple[np.ndarray, asyncio.Future, float]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # Strong references to the running batches (the event loop only keeps weak ones)
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.wait_ms = Histogram(WAIT_MS_BUCKETS)
+        self.batches = 0
+        self.rows = 0
+
+    async def predict(self, model_type: str, row: np.ndarray) -> float:
+        """Queue one encoded row (shape (1, n_features)) and wait for its prediction."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        queue = self._queues.setdefault(model_type, [])
+        queue.append((row, future, time.perf_counter()))
+
+        if len(queue) >= self.max_batch_size:
+            self._flush(model_type)
+        elif len(queue) == 1:
+            self._timers[model_type] = loop.call_later(self.max_wait_ms / 1000, self._flush, model_type)
+
+        return await future
+
+    def _flush(self, model_type: str):
+        timer = self._timers.pop(model_type, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._queues.pop(model_type, None)
+        if batch:
+            task = asyncio.ensure_future(self._run(model_type, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, model_type: str, batch: List[Tuple[np.ndarray, asyncio.Future, float]]):
+        now = time.perf_counter()
+        for _, _, enqueued_at in batch:
+            self.wait_ms.observe((now - enqueued_at) * 1000)
+        self.batch_sizes.observe(len(batch))
+        self.batches += 1
+        self.rows += len(batch)
+
+        try:
+            predictions = await self.predict_batch(model_type, np.vstack([row for row, _, _ in batch]))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # Cancelled (shutdown, or CancelledError from the executor): no caller may wait forever
+            for _, future, _ in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+
+        for i, (_, future, _) in enumerate(batch):
+            if not future.done():
+                future.set_result(float(predictions[i]))
+
+    async def close(self):
+        """Score the rows still queued and wait for the running batches (shutdown)."""
+        for model_type in list(self._queues):
+            self._flush(model_type)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'batches': self.batches,
+            'rows': self.rows,
+            'avg_batch_size': round(self.rows / self.batches, 2) if self.batches else 0.0,
+            'queued': sum(len(q) for q in self._queues.values()),
+            'batch_size_histogram': self.batch_sizes.snapshot(),
+            'wait_ms_histogram': self.wait_ms.snapshot(),
+        }
@@ -0,0 +1,258 @@
+"""
+Versioned model registry under models/.
+
+Each trained version lives in models/versions/<version>/ (one .pkl per model plus
+feature_info.pkl, feature_transformer.pkl and the analytics.json snapshot, and
+optionally compact/<model>.npz written by export_compact_models.py). models/manifest.json lists the
+versions and which one is live. Promotion rewrites the manifest atomically
+(write to a temporary file, then os.replace), so readers never see a partial file.
+
+A ModelWatcher thread polls the manifest, loads and warms a newly promoted version
+off the request path and hands it to a callback that swaps it in.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import joblib
+
+from feature_transformer import FeatureTransformer
+from scenario_engine import save_snapshot
+from tree_compiler import CompiledTreeEnsemble
+
+MODELS_DIR = "./models"
+MANIFEST_NAME = "manifest.json"
+FEATURE_INFO_NAME = "feature_info.pkl"
+TRANSFORMER_NAME = "feature_transformer.pkl"
+ANALYTICS_NAME = "analytics.json"
+MODEL_NAMES = ("random_forest", "linear_regression", "xgboost")
+COMPACT_DIR = "compact"
+
+
+def compact_paths(directory: str) -> Dict[str, str]:
+    """Compact tree models (compact/<name>.npz) exported for a model directory."""
+    return {
+        name: os.path.join(directory, COMPACT_DIR, f"{name}.npz")
+        for name in MODEL_NAMES
+        if os.path.exists(os.path.join(directory, COMPACT_DIR, f"{name}.npz"))
+    }
+
+
+class LoadedVersion:
+    """Models, transformer and metadata of one registry version, ready to serve."""
+
+    def __init__(self, version: str, models: Dict[str, Any], transformer: FeatureTransformer,
+                 feature_info: dict, model_paths: Dict[str, str]):
+        self.version = version
+        self.models = models
+        self.transformer = transformer
+        self.feature_info = feature_info
+        self.model_paths = model_paths
+        self.state: Dict[str, Any] = {}  # derived serving state built while warming (cube, ...)
+
+    @property
+    def feature_columns(self):
+        return self.transformer.feature_columns
+
+
+class ModelRegistry:
+    """Reads and writes versioned model artifacts and the manifest."""
+
+    def __init__(self, root: str = MODELS_DIR):
+        self.root = root
+        self.versions_dir = os.path.join(root, "versions")
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------------------- manifest
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"live": None, "versions": {}}
+
+    def _write_manifest(self, manifest: dict):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def live_version(self) -> Optional[str]:
+        return self.read_manifest().get("live")
+
+    def version_dir(self, version: str) -> str:
+        return os.path.join(self.versions_dir, version)
+
+    def analytics_path(self, version: str) -> str:
+        return os.path.join(self.version_dir(version), ANALYTICS_NAME)
+
+    def model_paths(self, version: str) -> Dict[str, str]:
+        directory = self.version_dir(version)
+        return {
+            name: os.path.join(directory, f"{name}.pkl")
+            for name in MODEL_NAMES
+            if os.path.exists(os.path.join(directory, f"{name}.pkl"))
+        }
+
+    # ------------------------------------------------------------ publishing
+
+    def new_version_id(self) -> str:
+        base = datetime.now().strftime("%Y%m%d-%H%M%S")
+        version, n = base, 1
+        while os.path.exists(self.version_dir(version)):
+            n += 1
+            version = f"{base}-{n}"
+        return version
+
+    def publish(self, models: Dict[str, Any], feature_info: dict, transformer: FeatureTransformer,
+                metadata: Optional[dict] = None, promote: bool = True, analytics: Optional[dict] = None) -> str:
+        """Write a complete version directory, register it and (by default) make it live.
+
+        `analytics` (scenario_engine.compute_snapshot) is stamped with the new version id.
+        """
+        version = self.new_version_id()
+        final_dir = self.version_dir(version)
+        staging_dir = final_dir + ".tmp"
+        os.makedirs(staging_dir, exist_ok=True)
+        try:
+            for name, model in models.items():
+                joblib.dump(model, os.path.join(staging_dir, f"{name}.pkl"))
+            joblib.dump(feature_info, os.path.join(staging_dir, FEATURE_INFO_NAME))
+            transformer.save(os.path.join(staging_dir, TRANSFORMER_NAME))
+            if analytics is not None:
+                save_snapshot(os.path.join(staging_dir, ANALYTICS_NAME), {**analytics, "model_version": version})
+            # The directory only appears under its final name once complete
+            os.replace(staging_dir, final_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        with self._lock:
+            manifest = self.read_manifest()
+            manifest.setdefault("versions", {})[version] = {
+                "created_at": datetime.now().isoformat(),
+                "models": sorted(models),
+                **(metadata or {}),
+            }
+            if promote:
+                manifest["live"] = version
+                manifest["promoted_at"] = datetime.now().isoformat()
+            self._write_manifest(manifest)
+        return version
+
+    def promote(self, version: str):
+        """Make an already published version live (rollback included)."""
+        with self._lock:
+            manifest = self.read_manifest()
+            if version not in manifest.get("versions", {}):
+                raise KeyError(f"Unknown model version: {version}")
+            manifest["live"] = version
+            manifest["promoted_at"] = datetime.now().isoformat()
+            self._write_manifest(manifest)
+
+    # --------------------------------------------------------------- loading
+
+    def load(self, version: str, mmap_mode: Optional[str] = None, compact: bool = False) -> LoadedVersion:
+        """Load a version; with `compact`, exported compact tree models replace their .pkl
+        (always memory-mapped, the original model is not loaded)."""
+        directory = self.version_dir(version)
+        paths = self.model_paths(version)
+        if not paths:
+            raise FileNotFoundError(f"No model in {directory}")
+        if compact:
+            paths.update(compact_paths(directory))
+
+        models = {
+            name: CompiledTreeEnsemble.load(path, mmap_mode="r") if path.endswith(".npz")
+            else joblib.load(path, mmap_mode=mmap_mode)
+            for name, path in paths.items()
+        }
+        feature_info = joblib.load(os.path.join(directory, FEATURE_INFO_NAME))
+        transformer = FeatureTransformer.load(os.path.join(directory, TRANSFORMER_NAME))
+        return LoadedVersion(version, models, transformer, feature_info, paths)
+
+
+class ModelWatcher:
+    """Background thread that loads and warms newly promoted versions.
+
+    `prepare(loaded)` runs on the watcher thread (compilation, warm-up, cube...);
+    `activate(loaded)` must perform the swap and is called once preparation succeeded.
+    """
+
+    def __init__(self, registry: ModelRegistry, current_version: Optional[str],
+                 prepare: Callable[[LoadedVersion], None], activate: Callable[[LoadedVersion], None],
+                 interval: float = 5.0, mmap_mode: Optional[str] = None, compact: bool = False):
+        self.registry = registry
+        self.current_version = current_version
+        self.prepare = prepare
+        self.activate = activate
+        self.interval = interval
+        self.mmap_mode = mmap_mode
+        self.compact = compact
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._failed_version: Optional[str] = None
+
+        self.reloads = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_reload_ms: Optional[float] = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> bool:
+        """Load, warm and activate the live version if it changed; returns True on a swap."""
+        live = self.registry.live_version()
+        if live is None or live == self.current_version or live == self._failed_version:
+            return False
+
+        start = time.perf_counter()
+        try:
+            loaded = self.registry.load(live, mmap_mode=self.mmap_mode, compact=self.compact)
+            self.prepare(loaded)
+            self.activate(loaded)
+        except Exception as e:
+            # A broken version is not retried until another one is promoted
+            self._failed_version = live
+            self.failures += 1
+            self.last_error = f"{live}: {e}"
+            print(f"⚠️ Version de modèles {live} non chargée: {e}")
+            return False
+
+        self.current_version = live
+        self.reloads += 1
+        self.last_reload_ms = round((time.perf_counter() - start) * 1000, 1)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._thread is not None,
+            "interval_seconds": self.interval,
+            "current_version": self.current_version,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_reload_ms": self.last_reload_ms,
+        }
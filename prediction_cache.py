@@ -0,0 +1,147 @@
+"""
+In-process cache for model predictions.
+
+Bounded LRU with a TTL, keyed on the request fields plus the model version.
+Concurrent identical misses are coalesced into a single computation (single-flight).
+"""
+import asyncio
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+# Request fields that influence the prediction (model_type is part of the key prefix)
+KEY_FIELDS = ('TransportType', 'Line', 'Hour', 'Day', 'Weather', 'Event')
+
+
+def make_key(model_type: str, model_version: Optional[str], request) -> tuple:
+    """Cache key: (model_type, model_version, *request fields).
+
+    The fields are used as they are: they must be the exact values fed to the model
+    (PredictionRequest strips whitespace at validation), otherwise two requests
+    computed differently would share an entry.
+    """
+    values = [request[field] if isinstance(request, dict) else getattr(request, field) for field in KEY_FIELDS]
+    return (model_type, model_version, *values)
+
+
+def _retrieve_exception(task: asyncio.Task):
+    # Failure already raised to the waiters; avoids "exception never retrieved" when none is left
+    if not task.cancelled():
+        task.exception()
+
+
+class PredictionCache:
+    """Bounded LRU/TTL cache with single-flight computation of misses."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key) -> Tuple[bool, Any]:
+        """Return (found, value) and refresh the entry's LRU position."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def get_or_compute(self, key, compute: Callable[[], Any]):
+        """Return the cached value or compute it once for all concurrent callers.
+
+        `compute` may return a value or an awaitable.
+        """
+        if not self.enabled:
+            value = compute()
+            return await value if inspect.isawaitable(value) else value
+
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        # The computation runs in its own task: if the caller that started it is
+        # cancelled, the coalesced callers still get the result
+        self.misses += 1
+        task = asyncio.ensure_future(self._compute(key, compute))
+        task.add_done_callback(_retrieve_exception)
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, compute: Callable[[], Any]):
+        try:
+            value = compute()
+            if inspect.isawaitable(value):
+                value = await value
+            self.set(key, value)
+            return value
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    def invalidate_model(self, model_type: str) -> int:
+        """Drop every entry computed by a model (called when it is reloaded)."""
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == model_type]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'enabled': self.enabled,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'inflight': len(self._inflight),
+            'hit_rate': round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
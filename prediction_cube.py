@@ -0,0 +1,126 @@
+"""
+Precomputed prediction cube over the full categorical input domain.
+
+Requests only take a few values per field (transport type, line, hour, day,
+weather, event), so every model can be evaluated once over the whole grid and
+/predict answered by an array lookup indexed by category codes.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from feature_transformer import DAY_MAPPING, FeatureTransformer
+
+# Values sent by the frontend and the analytics endpoints, in addition to the
+# vocabularies learned at training time.
+KNOWN_VALUES = {
+    'TransportType': ['Bus', 'Metro', 'Train'],
+    'Line': ['Line1', 'Line2', 'Line3', 'Line4', 'Line5'],
+    'Weather': ['Normal', 'Pluie', 'Extrême', 'Soleil', 'TempsNormal', 'Neige', 'Tempête'],
+    'Event': ['Non', 'Oui'],
+}
+
+
+def default_axes(transformer: FeatureTransformer) -> List[Tuple[str, list]]:
+    """Grid axes: learned vocabularies merged with the values clients actually send."""
+    def merged(name):
+        values = list(KNOWN_VALUES.get(name, []))
+        values += [v for v in transformer.vocabularies.get(name, []) if v not in values]
+        return values
+
+    return [
+        ('TransportType', merged('TransportType')),
+        ('Line', merged('Line')),
+        ('Hour', list(range(24))),
+        ('Day', list(DAY_MAPPING)),
+        ('Weather', merged('Weather')),
+        ('Event', merged('Event')),
+    ]
+
+
+class PredictionCube:
+    """Dense array of predictions for every combination of request fields, per model."""
+
+    def __init__(self, axes: Sequence[Tuple[str, list]], values: Dict[str, np.ndarray]):
+        self.axes = [(name, list(axis_values)) for name, axis_values in axes]
+        self.axis_names = [name for name, _ in self.axes]
+        self.shape = tuple(len(axis_values) for _, axis_values in self.axes)
+        self.values = values
+        self._index = {name: {v: i for i, v in enumerate(axis_values)} for name, axis_values in self.axes}
+
+    @classmethod
+    def build(cls, models: dict, transformer: FeatureTransformer,
+              axes: Optional[Sequence[Tuple[str, list]]] = None) -> 'PredictionCube':
+        """Encode the whole grid once and run a single predict call per model."""
+        axes = axes or default_axes(transformer)
+        shape = tuple(len(axis_values) for _, axis_values in axes)
+        grid = np.indices(shape).reshape(len(shape), -1)
+
+        columns = {}
+        for k, (name, axis_values) in enumerate(axes):
+            dtype = np.float32 if name == 'Hour' else object
+            columns[name] = np.asarray(axis_values, dtype=dtype)[grid[k]]
+        X = transformer.transform_columns(columns)
+
+        values = {
+            model_type: np.asarray(model.predict(X), dtype=np.float64).reshape(shape)
+            for model_type, model in models.items()
+        }
+        return cls(axes, values)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    def codes(self, record) -> Optional[tuple]:
+        """Category codes of a request, or None if a value is outside the grid."""
+        codes = []
+        for name in self.axis_names:
+            value = record[name] if isinstance(record, dict) else getattr(record, name)
+            code = self._index[name].get(value)
+            if code is None:
+                return None
+            codes.append(code)
+        return tuple(codes)
+
+    def lookup(self, model_type: str, record) -> Optional[float]:
+        """O(1) prediction for a request, or None when it must fall back to live inference."""
+        cube = self.values.get(model_type)
+        if cube is None:
+            return None
+        codes = self.codes(record)
+        if codes is None:
+            return None
+        return float(cube[codes])
+
+    def slice(self, model_type: str, fixed: Dict[str, object],
+              mean_over: Sequence[str] = ()) -> Tuple[List[Tuple[str, list]], np.ndarray]:
+        """Sub-cube with some fields fixed (and optionally averaged over others).
+
+        Returns the remaining axes and the array of predictions along them.
+        Raises KeyError for an unknown model/axis and ValueError for a value outside the grid.
+        """
+        cube = self.values[model_type]
+        selector = []
+        remaining = []
+        for name, axis_values in self.axes:
+            if name in fixed:
+                value = fixed[name]
+                if value not in self._index[name]:
+                    raise ValueError(f"{name}={value!r} hors du domaine précalculé")
+                selector.append(self._index[name][value])
+            else:
+                selector.append(slice(None))
+                remaining.append((name, axis_values))
+
+        result = cube[tuple(selector)]
+
+        for name in mean_over:
+            names = [axis_name for axis_name, _ in remaining]
+            if name not in names:
+                raise KeyError(name)
+            axis = names.index(name)
+            result = result.mean(axis=axis)
+            remaining.pop(axis)
+
+        return remaining, result
@@ -0,0 +1,68 @@
+"""
+Per-process memory accounting (RSS, PSS, shared and private pages).
+
+Used to check that serve.py workers share the model pages loaded before forking.
+Reads /proc/<pid>/smaps_rollup on Linux and falls back to getrusage elsewhere.
+"""
+import os
+from typing import List, Optional
+
+SMAPS_FIELDS = {
+    'Rss': 'rss_kb',
+    'Pss': 'pss_kb',
+    'Shared_Clean': 'shared_clean_kb',
+    'Shared_Dirty': 'shared_dirty_kb',
+    'Private_Clean': 'private_clean_kb',
+    'Private_Dirty': 'private_dirty_kb',
+}
+
+
+def process_memory(pid: Optional[int] = None) -> dict:
+    """Memory usage of a process, in kB."""
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            values = {}
+            for line in f:
+                parts = line.split()
+                if parts and parts[0].rstrip(':') in SMAPS_FIELDS:
+                    values[SMAPS_FIELDS[parts[0].rstrip(':')]] = int(parts[1])
+    except OSError:
+        if pid != os.getpid():
+            return {'pid': pid, 'available': False}
+        import resource
+        return {'pid': pid, 'available': True, 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+    values['shared_kb'] = values.get('shared_clean_kb', 0) + values.get('shared_dirty_kb', 0)
+    values['private_kb'] = values.get('private_clean_kb', 0) + values.get('private_dirty_kb', 0)
+    return {'pid': pid, 'available': True, **values}
+
+
+def child_pids(parent_pid: int) -> List[int]:
+    """PIDs whose parent is `parent_pid` (scan of /proc)."""
+    pids = []
+    for entry in os.listdir('/proc') if os.path.isdir('/proc') else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces: ppid is the 2nd field after ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def workers_memory(master_pid: Optional[int]) -> dict:
+    """Memory of the serve.py master and all of its workers, with totals."""
+    if not master_pid:
+        return {'workers': [process_memory()], 'master': None}
+
+    workers = [process_memory(pid) for pid in child_pids(master_pid)]
+    totals = {
+        key: sum(w.get(key, 0) for w in workers)
+        for key in ('rss_kb', 'pss_kb', 'shared_kb', 'private_kb')
+    }
+    return {'master': process_memory(master_pid), 'workers': workers, 'totals': totals}
@@ -0,0 +1,175 @@
+"""
+On-demand stack-sampling CPU profiler for a live worker.
+
+A background thread snapshots the Python stack of every thread with
+sys._current_frames() at a fixed interval and counts identical stacks. The
+result is exported in the collapsed format ("frame;frame;frame count" per line)
+read by flamegraph.pl, speedscope and inferno. Nothing runs while no profile
+is active.
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+
+def _frame_label(code) -> str:
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads (but its own) every `interval` seconds."""
+
+    def __init__(self, interval: float = 0.005, thread_names: bool = True):
+        self.interval = interval
+        self.thread_names = thread_names
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> 'SamplingProfiler':
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> 'SamplingProfiler':
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(exclude=own_id)
+
+    def sample(self, exclude: Optional[int] = None):
+        names = {t.ident: t.name for t in threading.enumerate()} if self.thread_names else {}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == exclude:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if self.thread_names:
+                stack.append(names.get(thread_id, str(thread_id)))
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        """Collapsed stacks, one "root;...;leaf count" line per distinct stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 20) -> dict:
+        """Most frequent leaf frames (self time) and total samples."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values())
+        return {
+            "samples": self.samples,
+            "stack_samples": total,
+            "interval_ms": self.interval * 1000,
+            "duration_seconds": round(self.duration, 3),
+            "distinct_stacks": len(self.stacks),
+            "top_self": [
+                {"frame": frame, "samples": n, "percent": round(100 * n / total, 1)}
+                for frame, n in leaves.most_common(top)
+            ],
+        }
+
+
+class ProfileStore:
+    """Keeps the last profiles so they can be downloaded after the profiled request."""
+
+    def __init__(self, max_profiles: int = 32):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profiler: SamplingProfiler, **info) -> str:
+        profile_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._profiles[profile_id] = {"collapsed": profiler.collapsed(), "summary": profiler.summary(), **info}
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                profile_id: {k: v for k, v in profile.items() if k != "collapsed"}
+                for profile_id, profile in self._profiles.items()
+            }
+
+
+class RequestProfilingMiddleware:
+    """Profiles a single request when it carries the opt-in header.
+
+    Only added to the app when profiling is enabled. The profile id is returned in
+    the X-Profile-Id response header. Stacks of concurrent requests on other threads
+    are sampled too: profile on a quiet worker for a clean picture.
+    """
+
+    def __init__(self, app, store: ProfileStore, header: str = "x-profile", token: Optional[str] = None,
+                 path_prefixes=("/predict", "/analytics"), interval: float = 0.001):
+        self.app = app
+        self.store = store
+        self.header = header.lower().encode("latin-1")
+        self.token = token
+        self.path_prefixes = tuple(path_prefixes)
+        self.interval = interval
+
+    def _requested(self, scope) -> bool:
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            return False
+        for name, value in scope["headers"]:
+            if name == self.header:
+                value = value.decode("latin-1")
+                # With a token configured, the header value must be the token
+                return value == self.token if self.token else value not in ("", "0", "false")
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profiler = SamplingProfiler(interval=self.interval).start()
+        profile_id = None
+
+        async def send_wrapper(message):
+            nonlocal profile_id
+            if message["type"] == "http.response.start":
+                # The profile covers the handler up to the response headers
+                profiler.stop()
+                profile_id = self.store.add(profiler, path=scope["path"], method=scope["method"])
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-profile-id", profile_id.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
@@ -0,0 +1,194 @@
+"""
+Non-blocking structured request logging.
+
+The ASGI middleware only measures the request and enqueues a dict; a background
+thread drains the bounded queue and writes JSON lines. Requests are sampled
+(server errors are always kept), request bodies are redacted and records that do
+not fit in the queue are dropped and counted instead of blocking the event loop.
+"""
+import contextvars
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+REDACTED = "[REDACTED]"
+
+# Fields of the record being built for the current request (None when not logging)
+_current_record: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_log_record", default=None)
+
+
+def redact(body, fields: Iterable[str] = (), keep_values: bool = False):
+    """Copy of `body` with the values of `fields` (or of every field unless keep_values) replaced."""
+    fields = set(fields)
+    if isinstance(body, dict):
+        return {
+            key: REDACTED if key in fields or (not keep_values and not isinstance(value, (dict, list)))
+            else redact(value, fields, keep_values)
+            for key, value in body.items()
+        }
+    if isinstance(body, list):
+        return [redact(item, fields, keep_values) for item in body]
+    return body if keep_values else REDACTED
+
+
+def annotate(**fields):
+    """Add fields to the log record of the current request (no-op outside a logged request)."""
+    record = _current_record.get()
+    if record is not None:
+        record.update(fields)
+
+
+class RequestLogger:
+    """Bounded queue of log records written as JSON lines by a background thread."""
+
+    def __init__(self, path: str = "-", sample_rate: float = 1.0, max_queue: int = 10000,
+                 log_bodies: str = "redacted", redact_fields: Iterable[str] = ()):
+        if log_bodies not in ("none", "redacted", "full"):
+            raise ValueError(f"Unknown body logging mode: {log_bodies}")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_queue = max_queue
+        self.log_bodies = log_bodies
+        self.redact_fields = set(redact_fields)
+
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.write_errors = 0
+
+    # ------------------------------------------------------------- lifecycle
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._drain, name="request-logger", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Write the records still queued, then stop the writer thread."""
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _drain(self):
+        stream = sys.stdout if self.path == "-" else open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                records = [self._queue.get()]
+                # Write everything already queued before flushing once
+                while len(records) < 1000:
+                    try:
+                        records.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = None in records
+                lines = [json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str)
+                         for r in records if r is not None]
+                try:
+                    if lines:
+                        stream.write("\n".join(lines) + "\n")
+                        stream.flush()
+                    self.written += len(lines)
+                except Exception:
+                    self.write_errors += len(lines)
+                if stop:
+                    return
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+    # --------------------------------------------------------------- records
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def log(self, record: dict) -> bool:
+        """Enqueue a record without blocking; returns False when it was dropped."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def body(self, body) -> Optional[dict]:
+        """Request body as it should appear in the log (None when bodies are not logged)."""
+        if self.log_bodies == "none":
+            return None
+        return redact(body, self.redact_fields, keep_values=self.log_bodies == "full")
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "sample_rate": self.sample_rate,
+            "log_bodies": self.log_bodies,
+            "max_queue": self.max_queue,
+            "queue_length": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "write_errors": self.write_errors,
+        }
+
+
+class RequestLoggingMiddleware:
+    """Pure ASGI middleware: times each request and hands a record to the RequestLogger.
+
+    The request body is never read here; endpoints attach what they know with `annotate`.
+    """
+
+    def __init__(self, app, logger: RequestLogger):
+        self.app = app
+        self.logger = logger
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        record = {}
+        token = _current_record.set(record)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_record.reset(token)
+            # Server errors are always logged, other requests are sampled
+            if status >= 500 or self.logger.sampled():
+                client = scope.get("client")
+                self.logger.log({
+                    "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1") or None,
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                    "client": client[0] if client else None,
+                    **record,
+                })
+            else:
+                self.logger.sampled_out += 1
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Serveur multi-workers: les modèles sont chargés une seule fois puis les workers
+sont créés par fork, ce qui leur fait partager les pages mémoire des modèles.
+
+Usage: python serve.py --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+
+import uvicorn
+
+
+def run_worker(sock: socket.socket, args):
+    """Boucle d'un worker: uvicorn sur le socket hérité du processus maître"""
+    import api
+
+    config = uvicorn.Config(api.app, log_level=args.log_level)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SmartMobility ML API - serveur multi-workers")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "2")))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    os.environ["SERVE_MASTER_PID"] = str(os.getpid())
+
+    # Charger les modèles une seule fois, avant le fork
+    import api
+    api.initialize_models()
+
+    # Geler les objets existants: le ramasse-miettes ne les touchera plus,
+    # les pages restent partagées (copy-on-write) entre les workers
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    print(f"🌐 Serveur sur http://{args.host}:{args.port} avec {args.workers} workers (PID maître {os.getpid()})")
+
+    children = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            run_worker(sock, args)
+            os._exit(0)
+        children.append(pid)
+        print(f"👷 Worker démarré (PID {pid})")
+
+    def stop(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    exit_code = 0
+    for child in children:
+        while True:
+            try:
+                _, status = os.waitpid(child, 0)
+                break
+            except InterruptedError:
+                continue
+        if os.waitstatus_to_exitcode(status) not in (0, -signal.SIGTERM):
+            exit_code = 1
+
+    print("🛑 Tous les workers sont arrêtés")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
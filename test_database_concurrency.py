@@ -0,0 +1,174 @@
+"""
+Test de la base sous charge mixte lecture/écriture (database.py).
+
+Plusieurs threads écrivent des prédictions pendant que d'autres lisent l'historique
+et la comparaison. Le débit est comparé à l'ancien fonctionnement (une connexion
+ouverte et fermée par appel, journal rollback).
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from database import ConnectionManager, Database, PredictionRecord
+
+DURATION = 2.0
+WRITERS = 2
+READERS = 4
+
+
+class PerCallConnections(ConnectionManager):
+    """Ancien fonctionnement: connexion ouverte et fermée à chaque appel, journal rollback."""
+
+    def enable_wal(self):
+        conn = sqlite3.connect(self.db_path)
+        self.journal_mode = conn.execute('PRAGMA journal_mode=DELETE').fetchone()[0]
+        conn.close()
+
+    def _get(self, role):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def writer(self):
+        conn = self._get('writer')
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def reader(self):
+        conn = self._get('reader')
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def make_record(i: int) -> PredictionRecord:
+    return PredictionRecord(
+        transport_type="Bus", line=f"Line{i % 5 + 1}", hour=i % 24, day="Lundi", weather="Pluie", event="Non",
+        model_used=("random_forest", "xgboost", "linear_regression")[i % 3],
+        predicted_delay=float(i % 30), predicted_risk=("Faible", "Moyen", "Élevé")[i % 3], predicted_probability=50.0
+    )
+
+
+def make_database(directory: str, legacy: bool = False) -> Database:
+    db = Database(os.path.join(directory, "test.db"))
+    if legacy:
+        db.connections = PerCallConnections(db.db_path)
+        db.connections.enable_wal()
+    db.save_predictions([make_record(i) for i in range(5000)])
+    return db
+
+
+def run_mixed_load(db: Database, duration: float = DURATION, writers: int = WRITERS, readers: int = READERS) -> dict:
+    """Écritures (save_prediction) et lectures (historique, comparaison) concurrentes pendant `duration` s."""
+    counts = {"writes": 0, "reads": 0}
+    errors = []
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def writer():
+        i = 0
+        while time.perf_counter() < stop:
+            try:
+                db.save_prediction(make_record(i))
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            i += 1
+            with lock:
+                counts["writes"] += 1
+
+    def reader():
+        while time.perf_counter() < stop:
+            try:
+                db.get_history_rows(limit=100)
+                db.get_model_comparison()
+            except Exception as e:
+                errors.append(repr(e))
+                continue
+            with lock:
+                counts["reads"] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    return {
+        "writes_per_s": counts["writes"] / duration,
+        "reads_per_s": counts["reads"] / duration,
+        "errors": errors,
+    }
+
+
+def test_connections_are_reused():
+    with tempfile.TemporaryDirectory() as directory:
+        db = make_database(directory)
+        for _ in range(50):
+            db.save_prediction(make_record(0))
+            db.get_prediction(1)
+        # Une connexion en écriture et une en lecture pour ce thread
+        assert db.connections.stats()["open_connections"] == 2
+        assert db.connections.stats()["journal_mode"] == "wal"
+        with db.connections.reader() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        db.connections.close_all()
+
+
+def test_readers_not_blocked_by_writer():
+    with tempfile.TemporaryDirectory() as directory:
+        db = make_database(directory)
+        total_before = db.get_history_rows(limit=1)[1]
+
+        # Transaction d'écriture ouverte (verrou d'écriture pris) par une autre connexion
+        blocker = sqlite3.connect(db.db_path)
+        blocker.execute("BEGIN IMMEDIATE")
+        blocker.execute("DELETE FROM predictions WHERE id > 10")
+
+        start = time.perf_counter()
+        rows, total = db.get_history_rows(limit=10)
+        comparison = db.get_model_comparison()
+        elapsed = time.perf_counter() - start
+
+        # Les lecteurs voient le dernier état validé, sans attendre le verrou
+        assert total == total_before and len(rows) == 10
+        assert sum(s["usage_count"] for s in comparison["statistics"].values()) == total_before
+        assert elapsed < 1.0, f"lecture bloquée {elapsed:.2f} s"
+
+        blocker.rollback()
+        blocker.close()
+        db.connections.close_all()
+
+
+def test_mixed_load_throughput():
+    with tempfile.TemporaryDirectory() as directory:
+        db = make_database(directory)
+        result = run_mixed_load(db)
+        db.connections.close_all()
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = run_mixed_load(make_database(directory, legacy=True))
+
+    print(f"\n  WAL + connexions par thread: {result['writes_per_s']:.0f} écritures/s, {result['reads_per_s']:.0f} lectures/s")
+    print(f"  Connexion par appel (rollback): {legacy['writes_per_s']:.0f} écritures/s, {legacy['reads_per_s']:.0f} lectures/s"
+          f" ({len(legacy['errors'])} erreurs)")
+
+    assert not result["errors"], result["errors"][:3]
+    assert result["writes_per_s"] > 0 and result["reads_per_s"] > 0
+    assert result["writes_per_s"] + result["reads_per_s"] > legacy["writes_per_s"] + legacy["reads_per_s"]
+
+
+if __name__ == "__main__":
+    print("🧪 Test de la base sous charge concurrente")
+    for test in (test_connections_are_reused, test_readers_not_blocked_by_writer, test_mixed_load_throughput):
+        test()
+        print(f"✅ {test.__name__}")
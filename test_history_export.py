@@ -0,0 +1,112 @@
+"""
+Test de l'export en flux de l'historique (GET /history/export).
+
+Un client qui abandonne le téléchargement en cours de route ne doit pas laisser
+la connexion de lecture dédiée ouverte: son instantané bloquerait les checkpoints
+WAL et le fichier -wal grossirait jusqu'au redémarrage de l'API.
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+import api
+from database import EXPORT_CHUNK_ROWS, Database
+
+ROWS = EXPORT_CHUNK_ROWS * 3
+
+
+def fill(db: Database, rows: int):
+    start = datetime.now() - timedelta(days=1)
+    with db.connections.writer() as conn:
+        conn.executemany('''
+            INSERT INTO predictions (
+                transport_type, line, hour, day, weather, event, model_used,
+                predicted_delay, predicted_risk, predicted_probability, timestamp
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            ("Bus", f"Line{i % 5 + 1}", i % 24, "Lundi", "Pluie", "Non", "xgboost",
+             float(i % 30), "Faible", 50.0, (start + timedelta(seconds=i)).isoformat())
+            for i in range(rows)
+        ))
+
+
+async def abandon_export(app, query: bytes) -> list:
+    """Lit le premier morceau de l'export puis se déconnecte; renvoie les morceaux reçus."""
+    received = []
+    first_body = asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await first_body.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            received.append(message["body"])
+            first_body.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/history/export", "raw_path": b"/history/export",
+        "query_string": query, "headers": [], "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    await app(scope, receive, send)
+    return received
+
+
+def run_abandoned_export(fmt: str):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "export.db")
+        db = Database(path)
+        fill(db, ROWS)
+        previous, api.db = api.db, db
+        try:
+            baseline = db.connections.stats()["open_connections"]
+
+            async def scenario():
+                received = await abandon_export(api.app, f"format={fmt}".encode())
+                # Vérifié avant la fin de la boucle: rien ne doit dépendre du ramasse-miettes
+                assert db.connections.stats()["open_connections"] == baseline
+                return received
+
+            received = asyncio.run(scenario())
+            assert received, "aucun morceau reçu avant la déconnexion"
+
+            # Plus aucun lecteur: une écriture suivie d'un checkpoint complet vide le fichier -wal
+            fill(db, 10)
+            conn = sqlite3.connect(path, timeout=0.5)
+            try:
+                busy, _, _ = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            finally:
+                conn.close()
+            assert busy == 0
+            assert os.path.getsize(path + "-wal") == 0
+        finally:
+            api.db = previous
+            db.connections.close_all()
+
+
+def test_abandoned_csv_export_closes_connection():
+    run_abandoned_export("csv")
+
+
+def test_abandoned_gzip_export_closes_connection():
+    run_abandoned_export("csv.gz")
+
+
+def test_abandoned_parquet_export_closes_connection():
+    run_abandoned_export("parquet")
+
+
+if __name__ == "__main__":
+    print("🧪 Test de l'export en flux de l'historique")
+    for test in (test_abandoned_csv_export_closes_connection, test_abandoned_gzip_export_closes_connection,
+                 test_abandoned_parquet_export_closes_connection):
+        test()
+        print(f"✅ {test.__name__}")
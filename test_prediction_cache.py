@@ -0,0 +1,98 @@
+"""
+Test du cache des prédictions (prediction_cache.py) et de son usage par /predict.
+
+Une requête avec des espaces autour des valeurs ne doit pas polluer l'entrée de la
+requête propre, et l'annulation de l'appel qui calcule une valeur ne doit pas
+annuler les appels identiques qui l'attendent.
+"""
+import asyncio
+import os
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from database import Database
+from prediction_cache import PredictionCache, make_key
+
+REQUEST = {"TransportType": "Train", "Line": "Line1", "Hour": 8, "Day": "Lundi",
+           "Weather": "Pluie", "Event": "Non", "model_type": "xgboost"}
+
+
+def test_whitespace_variant_does_not_poison_cache():
+    import api
+
+    padded = {**REQUEST, "TransportType": "Train ", "Day": " Lundi"}
+    # Historique dans une base temporaire: le test n'écrit pas dans ./predictions_history.db
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "cache.db"))
+        previous, api.db, api.history_writer.db = api.db, db, db  # aussi pour HISTORY_WRITE_BEHIND=1
+        try:
+            with TestClient(api.app) as client:
+                api.prediction_cache.clear()
+                api.prediction_cache.max_entries = 0  # sans cache: valeur calculée par le modèle
+                expected = client.post("/predict", json=REQUEST).json()["delay"]
+                api.prediction_cache.max_entries = 10000
+                try:
+                    # La variante avec espaces arrive en premier et remplit le cache
+                    assert client.post("/predict", json=padded).json()["delay"] == expected
+                    assert client.post("/predict", json=REQUEST).json()["delay"] == expected
+                    assert api.prediction_cache.stats()["hits"] >= 1
+                finally:
+                    api.prediction_cache.clear()
+        finally:
+            api.db = api.history_writer.db = previous
+            db.connections.close_all()
+    assert api.PredictionRequest(**padded) == api.PredictionRequest(**REQUEST)
+
+
+def test_key_uses_exact_values():
+    assert make_key("xgboost", "v1", {**REQUEST, "TransportType": "Train "}) != make_key("xgboost", "v1", REQUEST)
+
+
+def test_leader_cancellation_keeps_waiters():
+    async def scenario():
+        cache = PredictionCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return 4.8
+
+        leader = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_compute("key", compute)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+
+        results = await asyncio.gather(*waiters)
+        assert leader.cancelled()
+        assert results == [4.8] * 3
+        assert len(calls) == 1 and cache.stats()["coalesced"] == 3
+        assert cache.get("key") == (True, 4.8) and cache.stats()["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failure_reaches_waiters():
+    async def scenario():
+        cache = PredictionCache()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("modèle indisponible")
+
+        results = await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert cache.get("key") == (False, None) and cache.stats()["inflight"] == 0
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    print("🧪 Test du cache des prédictions")
+    for test in (test_whitespace_variant_does_not_poison_cache, test_key_uses_exact_values,
+                 test_leader_cancellation_keeps_waiters, test_failure_reaches_waiters):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,110 @@
+"""
+Test de l'évaluateur compilé (tree_compiler.py): les prédictions doivent
+correspondre à celles des modèles d'origine à une tolérance près.
+"""
+import os
+import tempfile
+
+import numpy as np
+import xgboost as xgb
+from sklearn.ensemble import RandomForestRegressor
+
+from tree_compiler import CompiledModel, CompiledTreeEnsemble, compile_model
+
+TOLERANCE = 1e-4
+COMPACT_TOLERANCE = 0.01  # minutes, valeur par défaut d'export_compact_models.py
+
+
+def make_data(n_samples=2000, n_features=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 12, (n_samples, n_features)).astype(np.float32)
+    y = X[:, 0] * 1.5 + np.sin(X[:, 1]) * 4 + (X[:, 2] > 5) * 3 + rng.normal(0, 1, n_samples)
+    return X, y
+
+
+def check(model, X):
+    compiled = compile_model(model)
+    expected = model.predict(X)
+
+    np.testing.assert_allclose(compiled.predict(X), expected, atol=TOLERANCE)
+    np.testing.assert_allclose(compiled.predict(X[:1]), expected[:1], atol=TOLERANCE)
+    assert abs(compiled.predict_row(X[0]) - expected[0]) < TOLERANCE
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "compiled.npz")
+        compiled.save(path)
+        reloaded = CompiledTreeEnsemble.load(path, mmap_mode="r")
+        np.testing.assert_array_equal(reloaded.predict(X), compiled.predict(X))
+
+    wrapped = CompiledModel(compiled, model, max_rows=16)
+    np.testing.assert_allclose(wrapped.predict(X[:10]), expected[:10], atol=TOLERANCE)
+    np.testing.assert_allclose(wrapped.predict(X), expected, atol=TOLERANCE)
+    return compiled
+
+
+def check_compact(model, X):
+    """La version compacte reste à COMPACT_TOLERANCE près de l'ensemble complet."""
+    compiled = compile_model(model)
+    compact = compiled.compact(COMPACT_TOLERANCE)
+    expected = model.predict(X)
+
+    assert compact.nbytes < compiled.nbytes
+    assert np.abs(compact.predict(X) - compiled.predict(X)).max() <= COMPACT_TOLERANCE
+    np.testing.assert_allclose(compact.predict(X), expected, atol=COMPACT_TOLERANCE + TOLERANCE)
+    assert abs(compact.predict_row(X[0]) - expected[0]) <= COMPACT_TOLERANCE + TOLERANCE
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "compact.npz")
+        compact.save(path)
+        reloaded = CompiledTreeEnsemble.load(path, mmap_mode="r")
+        np.testing.assert_array_equal(reloaded.predict(X), compact.predict(X))
+
+
+def test_random_forest():
+    X, y = make_data()
+    model = RandomForestRegressor(n_estimators=30, max_depth=12, random_state=42).fit(X, y)
+    check(model, make_data(500, seed=1)[0])
+
+
+def test_xgboost():
+    X, y = make_data()
+    model = xgb.XGBRegressor(objective='reg:squarederror', n_estimators=50, random_state=42, verbosity=0).fit(X, y)
+    check(model, make_data(500, seed=1)[0])
+
+
+def test_compact_random_forest():
+    X, y = make_data()
+    model = RandomForestRegressor(n_estimators=30, max_depth=12, random_state=42).fit(X, y)
+    check_compact(model, make_data(500, seed=1)[0])
+
+
+def test_compact_xgboost():
+    X, y = make_data()
+    X[::7, 3] = np.nan
+    model = xgb.XGBRegressor(objective='reg:squarederror', n_estimators=200, random_state=42, verbosity=0).fit(X, y)
+    X_test = make_data(500, seed=1)[0]
+    X_test[::5, 3] = np.nan
+    check_compact(model, X_test)
+
+
+def test_xgboost_missing_values():
+    X, y = make_data()
+    X[::7, 3] = np.nan
+    model = xgb.XGBRegressor(objective='reg:squarederror', n_estimators=50, random_state=42, verbosity=0).fit(X, y)
+    X_test = make_data(500, seed=1)[0]
+    X_test[::5, 3] = np.nan
+    check(model, X_test)
+
+
+def test_unsupported_model():
+    from sklearn.linear_model import LinearRegression
+    X, y = make_data(100)
+    assert compile_model(LinearRegression().fit(X, y)) is None
+
+
+if __name__ == "__main__":
+    print("🧪 Test de l'évaluateur compilé")
+    for test in (test_random_forest, test_xgboost, test_xgboost_missing_values, test_compact_random_forest,
+                 test_compact_xgboost, test_unsupported_model):
+        test()
+        print(f"✅ {test.__name__}")
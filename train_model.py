@@ -10,9 +10,11 @@ import os
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import xgboost as xgb
+from feature_transformer import FeatureTransformer, TRANSFORMER_PATH
+from model_registry import ModelRegistry
+from scenario_engine import compute_snapshot, save_snapshot
 
 def load_and_prepare_data():
     """Charge et prépare les données pour l'entraînement"""
@@ -20,18 +22,12 @@ def load_and_prepare_data():
         df = pd.read_csv("./data/processed/clean_data.csv")
         print(f"✅ Données chargées: {df.shape}")
 
-        # Encodage des variables catégorielles
+        # Encodage des variables catégorielles (vocabulaires partagés avec l'API)
         categorical_cols = ['TransportType', 'Line', 'Status', 'IncidentCause', 'Weather', 'Event']
-        le = LabelEncoder()
+        transformer = FeatureTransformer.fit(df, categorical_cols)
 
-        for col in categorical_cols:
-            if col in df.columns:
-                df[f'{col}_encoded'] = le.fit_transform(df[col].astype(str))
-
-        # Mapping des jours
-        day_mapping = {'Lundi': 0, 'Mardi': 1, 'Mercredi': 2, 'Jeudi': 3, 'Vendredi': 4, 'Samedi': 5, 'Dimanche': 6}
-        if 'Day' in df.columns:
-            df['day_of_week'] = df['Day'].map(day_mapping).fillna(0)
+        # Colonnes *_encoded et mapping des jours
+        df = transformer.encode_frame(df)
 
         # Sélection des features
         feature_cols = []
@@ -60,7 +56,9 @@ def load_and_prepare_data():
         print(f"🎯 Target: {target_col}")
         print(f"📊 Features: {feature_cols}")
 
-        return df[feature_cols + ['delay_minutes']], feature_cols
+        transformer = FeatureTransformer(feature_cols, transformer.vocabularies)
+
+        return df[feature_cols + ['delay_minutes']], feature_cols, transformer
 
     except Exception as e:
         print(f"❌ Erreur lors du chargement des données: {e}")
@@ -87,7 +85,7 @@ def load_and_prepare_data():
 
         feature_cols = [col for col in df.columns if col != 'delay_minutes']
 
-        return df, feature_cols
+        return df, feature_cols, FeatureTransformer(feature_cols)
 
 def train_and_save_model():
     """Entraîne et sauvegarde les 3 modèles (Random Forest, Linear Regression, XGBoost)"""
@@ -95,7 +93,7 @@ def train_and_save_model():
     print("🚀 Entraînement des modèles ML...")
 
     # Charger et préparer les données
-    df, feature_cols = load_and_prepare_data()
+    df, feature_cols, transformer = load_and_prepare_data()
 
     # Séparation des données
     X = df[feature_cols]
@@ -269,6 +267,32 @@ def train_and_save_model():
     joblib.dump(feature_info, "./models/feature_info.pkl")
     print("  • ./models/feature_info.pkl")
 
+    # Sauvegarder le transformer utilisé aussi par l'API
+    transformer.save(TRANSFORMER_PATH)
+    print(f"  • {TRANSFORMER_PATH}")
+
+    # Instantané des analyses du Dashboard (/analytics/*), servi tel quel par l'API
+    # (version des models/*.pkl = date de modification, comme dans l'API)
+    analytics = compute_snapshot(rf_model.predict, transformer, 'random_forest', None)
+    save_snapshot("./models/analytics.json", {
+        **analytics, 'model_version': f"{os.path.getmtime('./models/random_forest.pkl'):.0f}"
+    })
+    print(f"  • ./models/analytics.json ({analytics['compute_ms']} ms)")
+
+    # Publier une nouvelle version dans le registre: l'API la charge et la met en service à chaud
+    registry = ModelRegistry()
+    version = registry.publish(
+        {'random_forest': rf_model, 'linear_regression': lr_model, 'xgboost': xgb_model},
+        feature_info,
+        transformer,
+        metadata={
+            'best_model': best_model_key,
+            'performance': {key: feature_info['models'][key]['performance'] for key in feature_info['models']}
+        },
+        analytics=analytics
+    )
+    print(f"  • {registry.version_dir(version)} (version promue: {version})")
+
     print(f"\n✅ Entraînement et sauvegarde terminés!")
 
     return models_info, feature_cols
@@ -0,0 +1,297 @@
+"""
+Compile trained tree ensembles into flat NumPy node arrays.
+
+RandomForestRegressor and XGBRegressor are converted to arrays of
+(feature, threshold, left, right, value) over all trees, evaluated with a
+vectorized walk of every tree for a whole batch at once. This skips the input
+validation, thread dispatch and DMatrix construction of the original predict.
+"""
+import json
+import struct
+import zipfile
+from typing import Optional
+
+import numpy as np
+
+
+class CompiledTreeEnsemble:
+    """Flat array representation of a tree ensemble, with a vectorized evaluator.
+
+    Leaves point to themselves (left == right == node), so walking `max_depth`
+    levels always ends on a leaf.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, default_left, roots, max_depth,
+                 aggregate: str = "mean", base_score: float = 0.0, strict: bool = False, source: str = "",
+                 value_scale: float = 1.0, value_offset: float = 0.0):
+        self.feature = np.asarray(feature)
+        self.threshold = np.asarray(threshold)
+        self.left = np.asarray(left)
+        self.right = np.asarray(right)
+        self.value = np.asarray(value)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.roots = np.asarray(roots)
+        self.max_depth = int(max_depth)
+        self.aggregate = aggregate  # "mean" (forest) or "sum" (boosting)
+        self.base_score = float(base_score)
+        self.strict = strict  # XGBoost goes left on x < threshold, sklearn on x <= threshold
+        self.source = source
+        # Integer leaf codes (see compact()) decode to value * value_scale + value_offset
+        self.value_scale = float(value_scale)
+        self.value_offset = float(value_offset)
+        self.quantized = self.value.dtype.kind in "iu"
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.feature)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right,
+                                      self.value, self.default_left, self.roots))
+
+    def _go_left(self, x, nodes):
+        threshold = self.threshold.take(nodes)
+        go_left = x < threshold if self.strict else x <= threshold
+        missing = np.isnan(x)
+        if missing.any():
+            go_left = np.where(missing, self.default_left.take(nodes), go_left)
+        return go_left
+
+    def _finish(self, leaves):
+        if self.quantized:
+            leaves = leaves * self.value_scale + self.value_offset
+        if self.aggregate == "mean":
+            return leaves.mean(axis=-1)
+        return leaves.sum(axis=-1) + self.base_score
+
+    def predict_row(self, x) -> float:
+        """Fast path for a single row: walk all trees at once on 1-D arrays."""
+        x = np.asarray(x, dtype=np.float32).reshape(-1)
+        nodes = self.roots
+        for _ in range(self.max_depth):
+            go_left = self._go_left(x[self.feature[nodes]], nodes)
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+        return float(self._finish(self.value.take(nodes).astype(np.float64)))
+
+    def predict(self, X, chunk_size: int = 256) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[0] == 1:
+            return np.array([self.predict_row(X[0])])
+
+        # Rows are processed in chunks so that the (rows x trees) node matrix stays in cache
+        out = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_size):
+            out[start:start + chunk_size] = self._predict_chunk(X[start:start + chunk_size])
+        return out
+
+    def _predict_chunk(self, X) -> np.ndarray:
+        n_rows, n_features = X.shape
+        flat = np.ascontiguousarray(X).ravel()
+        row_offsets = (np.arange(n_rows, dtype=np.int64) * n_features)[:, None]
+
+        nodes = np.repeat(self.roots[None, :], n_rows, axis=0)
+        for _ in range(self.max_depth):
+            x = flat.take(row_offsets + self.feature.take(nodes))
+            go_left = self._go_left(x, nodes)
+            nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+        return self._finish(self.value.take(nodes).astype(np.float64))
+
+    def compact(self, tolerance: float = 0.01) -> 'CompiledTreeEnsemble':
+        """Memory-compact copy: float32 thresholds, smallest integer types, quantized leaves.
+
+        Leaf values are rounded to a grid fine enough that the prediction moves by at
+        most `tolerance`. Thresholds are rounded down to float32 so that `x <= t`
+        gives the same result as with the float64 threshold for any float32 input.
+        """
+        threshold = self.threshold.astype(np.float32)
+        if not self.strict:
+            too_high = threshold.astype(np.float64) > self.threshold
+            threshold[too_high] = np.nextafter(threshold[too_high], np.float32(-np.inf))
+
+        n_features = int(self.feature.max()) + 1
+        feature = self.feature.astype(np.int8 if n_features <= np.iinfo(np.int8).max else np.int16)
+
+        # Every leaf value is off by at most step/2; a sum of n_trees leaves accumulates it
+        values = self.value.astype(np.float64)
+        if self.quantized:
+            values = values * self.value_scale + self.value_offset
+        step = 2 * tolerance / (self.n_trees if self.aggregate == "sum" else 1)
+        offset = float(values.min())
+        codes = np.round((values - offset) / step)
+        code_dtype = next(dtype for dtype in (np.uint8, np.uint16, np.uint32) if codes.max() <= np.iinfo(dtype).max)
+
+        return CompiledTreeEnsemble(
+            feature, threshold, self.left.astype(np.int32), self.right.astype(np.int32), codes.astype(code_dtype),
+            self.default_left, self.roots.astype(np.int32), self.max_depth,
+            aggregate=self.aggregate, base_score=self.base_score, strict=self.strict, source=self.source,
+            value_scale=step, value_offset=offset
+        )
+
+    # ------------------------------------------------------------- persistence
+
+    def save(self, path: str):
+        """Save as an uncompressed .npz (arrays can then be memory-mapped)."""
+        np.savez(path, feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                 value=self.value, default_left=self.default_left, roots=self.roots,
+                 meta=np.array(json.dumps({
+                     "max_depth": self.max_depth, "aggregate": self.aggregate, "base_score": self.base_score,
+                     "strict": self.strict, "source": self.source,
+                     "value_scale": self.value_scale, "value_offset": self.value_offset
+                 })))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = None) -> 'CompiledTreeEnsemble':
+        # np.load ignores mmap_mode for .npz archives: members are mapped by hand
+        data = _mmap_npz(path, mmap_mode) if mmap_mode else np.load(path)
+        meta = json.loads(str(data["meta"]))
+        return cls(data["feature"], data["threshold"], data["left"], data["right"], data["value"],
+                   data["default_left"], data["roots"], **meta)
+
+
+def _mmap_npz(path: str, mmap_mode: str) -> dict:
+    """Memory-map the members of an uncompressed .npz (as written by np.savez)."""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info))
+                continue
+            # The member data follows its local header (30 bytes + file name + extra field)
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if dtype.hasobject or not shape or 0 in shape:
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                arrays[name] = np.lib.format.read_array(f)
+                continue
+            arrays[name] = np.memmap(path, dtype=dtype, mode=mmap_mode, shape=shape,
+                                     order="F" if fortran_order else "C", offset=f.tell())
+    return arrays
+
+
+def _concatenate(trees, **kwargs) -> CompiledTreeEnsemble:
+    """Stack per-tree arrays (feature, threshold, left, right, value, default_left, depth)."""
+    offsets = np.cumsum([0] + [len(t[0]) for t in trees])
+    feature, threshold, left, right, value, default_left = [], [], [], [], [], []
+
+    for offset, (f, thr, l, r, v, dl, _) in zip(offsets, trees):
+        node_ids = np.arange(len(f))
+        is_leaf = l < 0
+        feature.append(np.where(is_leaf, 0, f))
+        threshold.append(thr)
+        left.append(np.where(is_leaf, node_ids, l) + offset)
+        right.append(np.where(is_leaf, node_ids, r) + offset)
+        value.append(v)
+        default_left.append(dl)
+
+    return CompiledTreeEnsemble(
+        feature=np.concatenate(feature).astype(np.int32),
+        threshold=np.concatenate(threshold),
+        left=np.concatenate(left).astype(np.int32),
+        right=np.concatenate(right).astype(np.int32),
+        value=np.concatenate(value),
+        default_left=np.concatenate(default_left),
+        roots=offsets[:-1].astype(np.int32),
+        max_depth=max(t[6] for t in trees),
+        **kwargs
+    )
+
+
+def _depth(left, right) -> int:
+    depth = np.zeros(len(left), dtype=np.int64)
+    for node in range(len(left)):  # children always come after their parent
+        if left[node] >= 0:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max())
+
+
+def compile_random_forest(model) -> CompiledTreeEnsemble:
+    """sklearn RandomForestRegressor / ExtraTreesRegressor (single output)."""
+    trees = []
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        nodes = tree.__getstate__()["nodes"]
+        if "missing_go_to_left" in nodes.dtype.names:
+            default_left = nodes["missing_go_to_left"].astype(bool)
+        else:
+            default_left = np.zeros(tree.node_count, dtype=bool)
+        trees.append((
+            tree.feature, tree.threshold.astype(np.float64), tree.children_left, tree.children_right,
+            tree.value[:, 0, 0].astype(np.float64), default_left, tree.max_depth
+        ))
+    return _concatenate(trees, aggregate="mean", strict=False, source=type(model).__name__)
+
+
+def _xgb_base_score(config: dict) -> float:
+    base_score = config["learner"]["learner_model_param"]["base_score"]
+    return float(base_score.strip("[]").split(",")[0])
+
+
+def compile_xgboost(model) -> CompiledTreeEnsemble:
+    """XGBRegressor / Booster with a gbtree booster and an identity link (reg:squarederror)."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    state = json.loads(booster.save_raw(raw_format="json"))
+    config = json.loads(booster.save_config())
+
+    objective = config["learner"]["objective"]["name"]
+    if objective not in ("reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror"):
+        raise ValueError(f"Objectif XGBoost non supporté pour la compilation: {objective}")
+
+    trees = []
+    for tree in state["learner"]["gradient_booster"]["model"]["trees"]:
+        left = np.asarray(tree["left_children"], dtype=np.int64)
+        right = np.asarray(tree["right_children"], dtype=np.int64)
+        # For leaves, split_conditions holds the leaf weight (learning rate already applied)
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        trees.append((
+            np.asarray(tree["split_indices"], dtype=np.int64), conditions, left, right,
+            conditions.astype(np.float32), np.asarray(tree["default_left"], dtype=bool), _depth(left, right)
+        ))
+    return _concatenate(trees, aggregate="sum", base_score=_xgb_base_score(config), strict=True, source="XGBoost")
+
+
+def compile_model(model) -> Optional[CompiledTreeEnsemble]:
+    """Compile a supported tree model, or return None (the original model is kept)."""
+    name = type(model).__name__
+    if name in ("RandomForestRegressor", "ExtraTreesRegressor"):
+        return compile_random_forest(model)
+    if name in ("XGBRegressor", "Booster"):
+        return compile_xgboost(model)
+    return None
+
+
+class CompiledModel:
+    """Drop-in `predict` using the compiled ensemble for small batches.
+
+    The compiled walk wins on the per-request path (one row, many trees); for large
+    batches the original implementation (native, multi-threaded) stays faster, so
+    calls with more than `max_rows` rows are delegated to it.
+    """
+
+    def __init__(self, compiled: CompiledTreeEnsemble, original, max_rows: int = 64):
+        self.compiled = compiled
+        self.original = original
+        self.max_rows = max_rows
+
+    def predict(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 2 and X.shape[0] > self.max_rows:
+            return np.asarray(self.original.predict(X), dtype=np.float64)
+        return self.compiled.predict(X)
+
+    def __getattr__(self, name):
+        # Attributes such as feature_importances_ come from the original model
+        if name == "original":
+            raise AttributeError(name)
+        return getattr(self.original, name)